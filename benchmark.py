@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+@author: alexyang
+
+@contact: alex.yang0326@gmail.com
+
+@file: benchmark.py
+
+@time: 2019/4/20 11:03
+
+@desc: check the fast feature kernels against their reference implementations and time both
+
+"""
+
+import os
+import sys
+import json
+import random
+import string
+import tempfile
+import subprocess
+import threading
+import time
+
+import numpy as np
+import networkx as nx
+from fuzzywuzzy import fuzz
+from simhash import Simhash
+
+from utils import kernels
+from utils.features import char_ngram_overlap, word_ngram_overlap
+from utils.graph import graph_to_adjacency, GraphFeatures
+from utils.serving import DynamicBatcher, make_server, NLIClient
+
+
+def timeit(func, *args, repeat=3):
+    """best wall time of `repeat` runs of func(*args), and its result"""
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def random_pairs(n_pairs, min_len, max_len, seed=2019):
+    rand = random.Random(seed)
+    alphabet = string.ascii_lowercase + ' ' * 5
+    pairs = []
+    for _ in range(n_pairs):
+        pairs.append((''.join(rand.choice(alphabet) for _ in range(rand.randint(min_len, max_len))),
+                      ''.join(rand.choice(alphabet) for _ in range(rand.randint(min_len, max_len)))))
+    return pairs
+
+
+# reference full-table dynamic programming implementations
+def dp_lcs_seq(s1: str, s2: str):
+    result = [[0 for _ in range(len(s2)+1)] for _ in range(len(s1) + 1)]
+    for i in range(1, len(s1)+1):
+        for j in range(1, len(s2)+1):
+            if s1[i-1] == s2[j-1]:
+                result[i][j] = result[i-1][j-1] + 1
+            else:
+                result[i][j] = max(result[i-1][j], result[i][j-1])
+    return result[len(s1)][len(s2)]
+
+
+def dp_lcs_str(s1: str, s2: str):
+    max_len = 0
+    result = [[0 for _ in range(len(s2) + 1)] for _ in range(len(s1) + 1)]
+    for i in range(1, len(s1)+1):
+        for j in range(1, len(s2)+1):
+            if s1[i-1] == s2[j-1]:
+                result[i][j] = result[i-1][j-1] + 1
+            max_len = max(max_len, result[i][j])
+    return max_len
+
+
+def dp_edit_distance(s1: str, s2: str):
+    result = [[0 for _ in range(len(s2) + 1)] for _ in range(len(s1) + 1)]
+    for i in range(len(s1) + 1):
+        result[i][0] = i
+    for j in range(len(s2) + 1):
+        result[0][j] = j
+
+    for i in range(1, len(s1)+1):
+        for j in range(1, len(s2)+1):
+            if s1[i-1] == s2[j-1]:
+                result[i][j] = result[i-1][j-1]
+            else:
+                result[i][j] = min(result[i-1][j], result[i][j-1], result[i-1][j-1]) + 1
+
+    return result[len(s1)][len(s2)]
+
+
+def benchmark_string_kernels(n_pairs=20, min_len=400, max_len=1100):
+    """mednli-like character strings of 400-1100 chars"""
+    pairs = random_pairs(n_pairs, min_len, max_len)
+    s1_list = [p for p, _ in pairs]
+    s2_list = [h for _, h in pairs]
+    for name, reference, batch_kernel in [('lcs_seq', dp_lcs_seq, kernels.lcs_seq_length_batch),
+                                          ('lcs_str', dp_lcs_str, kernels.lcs_str_length_batch),
+                                          ('edit_distance', dp_edit_distance, kernels.edit_distance_batch)]:
+        ref_time, ref_result = timeit(lambda: np.array([reference(s1, s2) for s1, s2 in pairs]), repeat=1)
+        kernel_time, kernel_result = timeit(batch_kernel, s1_list, s2_list)
+        assert np.array_equal(ref_result, kernel_result), name
+        print('Logging Info - %s : %d pairs, dp: %.3fs, kernel: %.4fs, speedup: %.1fx' %
+              (name, n_pairs, ref_time, kernel_time, ref_time / kernel_time))
+
+
+def random_sentences(n_sents, min_words, max_words, vocab_size=5000, seed=2019):
+    rand = random.Random(seed)
+    return [' '.join('w%d' % rand.randrange(vocab_size) for _ in range(rand.randint(min_words, max_words)))
+            for _ in range(n_sents)]
+
+
+def benchmark_signatures(n_pairs=20000, n_premises=5000):
+    """snli-like pairs: every premise appears in several pairs"""
+    rand = random.Random(2019)
+    premises = random_sentences(n_premises, 8, 30)
+    hypothesis = random_sentences(n_pairs, 4, 15, seed=2020)
+    p_list = [rand.choice(premises) for _ in range(n_pairs)]
+
+    def batched():
+        sent2row = {sent: i for i, sent in enumerate(dict.fromkeys(p_list + hypothesis))}
+        signatures = kernels.simhash_signatures(list(sent2row.keys()))
+        p_rows = np.array([sent2row[sent] for sent in p_list])
+        h_rows = np.array([sent2row[sent] for sent in hypothesis])
+        return kernels.hamming_distance(signatures[p_rows], signatures[h_rows])
+
+    ref_time, ref_result = timeit(lambda: np.array([Simhash(p).distance(Simhash(h))
+                                                    for p, h in zip(p_list, hypothesis)]), repeat=1)
+    batch_time, batch_result = timeit(batched, repeat=1)
+    assert np.array_equal(ref_result, batch_result)
+    print('Logging Info - simhash : %d pairs, per pair: %.3fs, signatures: %.3fs, speedup: %.1fx' %
+          (n_pairs, ref_time, batch_time, ref_time / batch_time))
+
+    minhash_time, signatures = timeit(kernels.minhash_signatures, premises)
+    print('Logging Info - minhash : %d sentences, %.3fs' % (n_premises, minhash_time))
+
+
+def benchmark_ngram_overlap(n_pairs=20000, n_premises=5000):
+    rand = random.Random(2019)
+    premises = random_sentences(n_premises, 8, 30)
+    hypothesis = random_sentences(n_pairs, 4, 15, seed=2020)
+    p_list = [rand.choice(premises) for _ in range(n_pairs)]
+    for name, reference, batch_kernel in [('char_ngram_overlap', char_ngram_overlap, kernels.char_ngram_overlap_batch),
+                                          ('word_ngram_overlap', word_ngram_overlap, kernels.word_ngram_overlap_batch)]:
+        ref_time, ref_result = timeit(lambda: np.array([reference(p, h) for p, h in zip(p_list, hypothesis)]),
+                                      repeat=1)
+        batch_time, batch_result = timeit(batch_kernel, p_list, hypothesis, repeat=1)
+        assert np.array_equal(ref_result, batch_result), name
+        print('Logging Info - %s : %d pairs, per pair: %.3fs, batch: %.3fs, speedup: %.1fx' %
+              (name, n_pairs, ref_time, batch_time, ref_time / batch_time))
+
+
+def fuzz_scores(s1, s2):
+    """reference: the eight fuzzywuzzy scorers called one by one, as `utils.features.fuzzy` used to"""
+    return [fuzz.ratio(s1, s2) / 100, fuzz.partial_ratio(s1, s2) / 100, fuzz.token_sort_ratio(s1, s2) / 100,
+            fuzz.partial_token_sort_ratio(s1, s2) / 100, fuzz.token_set_ratio(s1, s2) / 100,
+            fuzz.partial_token_set_ratio(s1, s2) / 100, fuzz.QRatio(s1, s2) / 100, fuzz.WRatio(s1, s2) / 100]
+
+
+def benchmark_fuzzy(n_pairs=20000, n_premises=5000):
+    rand = random.Random(2019)
+    premises = random_sentences(n_premises, 8, 30, vocab_size=500)
+    hypothesis = random_sentences(n_pairs, 4, 15, vocab_size=500, seed=2020)
+    p_list = [rand.choice(premises) for _ in range(n_pairs)]
+    ref_time, ref_result = timeit(lambda: np.array([fuzz_scores(p, h) for p, h in zip(p_list, hypothesis)]))
+    batch_time, batch_result = timeit(kernels.fuzzy_batch, p_list, hypothesis)    # best of 3, single runs are noisy
+    assert np.array_equal(ref_result, batch_result)
+    print('Logging Info - fuzzy : %d pairs, fuzzywuzzy: %.3fs, batch: %.3fs, speedup: %.1fx' %
+          (n_pairs, ref_time, batch_time, ref_time / batch_time))
+
+
+# reference graph features computed with networkx, as `prepare_features.Feature.add_graph_feature` used to
+def nx_graph_features(graph, p_ids, h_ids):
+    n2clique, cliques = {}, []
+    for clique in nx.find_cliques(graph):
+        for n in clique:
+            n2clique.setdefault(n, []).append(len(cliques))
+        cliques.append(clique)
+    n2cc, ccs = {}, []
+    for cc in nx.connected_components(graph):
+        for n in cc:
+            n2cc[n] = len(ccs)
+        ccs.append(cc)
+    pagerank = nx.pagerank(graph, alpha=0.9, max_iter=100)
+    hits_h, hits_a = nx.hits(graph, max_iter=100)
+
+    features = []
+    for p_id, h_id in zip(p_ids, h_ids):
+        edge_cliques = [len(cliques[c]) for c in n2clique[p_id] if h_id in cliques[c]]
+        lnode = max(len(cliques[c]) for c in n2clique[p_id])
+        rnode = max(len(cliques[c]) for c in n2clique[h_id])
+        pr1, pr2 = pagerank[p_id] * 1e6, pagerank[h_id] * 1e6
+        h1, h2, a1, a2 = hits_h[p_id] * 1e6, hits_h[h_id] * 1e6, hits_a[p_id] * 1e6, hits_a[h_id] * 1e6
+        shortest_path = -1
+        weight = graph[p_id][h_id]['weight']
+        graph.remove_edge(p_id, h_id)
+        if nx.has_path(graph, p_id, h_id):
+            shortest_path = nx.dijkstra_path_length(graph, p_id, h_id)
+        graph.add_edge(p_id, h_id, weight=weight)
+        features.append([graph.degree[p_id], graph.degree[h_id], max(edge_cliques, default=0), len(edge_cliques),
+                         lnode, rnode, max(lnode, rnode), min(lnode, rnode), len(ccs[n2cc[p_id]]),
+                         pr1, pr2, max(pr1, pr2), min(pr1, pr2), (pr1 + pr2) / 2.,
+                         h1, h2, a1, a2, max(h1, h2), max(a1, a2), min(h1, h2), min(a1, a2), (h1 + h2) / 2.,
+                         (a1 + a2) / 2., shortest_path])
+    return np.array(features, dtype=np.float64)
+
+
+def random_sentence_graph(n_premises, n_hypothesis_per_premise=3, share_rate=0.3, cross_rate=0.05, seed=2019):
+    """
+    nli-like sentence graph: every premise has a few hypotheses, part of the hypotheses are shared, and a few pairs
+    link two premises (closing cycles and triangles)
+    """
+    rand = random.Random(seed)
+    graph, p_ids, h_ids = nx.Graph(), [], []
+    n_nodes = n_premises
+    for p_id in range(n_premises):
+        for _ in range(n_hypothesis_per_premise):
+            if rand.random() < cross_rate:
+                h_id = rand.randrange(n_premises)
+            elif rand.random() < share_rate and n_nodes > n_premises:
+                h_id = rand.randrange(n_premises, n_nodes)
+            else:
+                h_id, n_nodes = n_nodes, n_nodes + 1
+            graph.add_edge(p_id, h_id, weight=rand.choice([0.0, rand.random()]))
+            p_ids.append(p_id)
+            h_ids.append(h_id)
+    return graph, n_nodes, p_ids, h_ids
+
+
+def benchmark_graph_features(n_premises=3000):
+    graph, n_nodes, p_ids, h_ids = random_sentence_graph(n_premises)
+    ref_time, ref_result = timeit(nx_graph_features, graph, p_ids, h_ids, repeat=1)
+    engine_time, engine_result = timeit(
+        lambda: GraphFeatures(graph_to_adjacency(graph, n_nodes)).pair_features(p_ids, h_ids), repeat=1)
+    print('Logging Info - graph features : %d nodes, %d pairs, networkx: %.3fs, csr engine: %.3fs, speedup: %.1fx' %
+          (n_nodes, len(p_ids), ref_time, engine_time, ref_time / engine_time))
+    for name, start, end in [('degree', 0, 2), ('clique', 2, 8), ('cc', 8, 9), ('pagerank', 9, 14),
+                             ('hits', 14, 24), ('shortest_path', 24, 25)]:
+        close = np.isclose(engine_result[:, start:end], ref_result[:, start:end], rtol=1e-4, atol=1e-6)
+        print('Logging Info - %s : %.4f%% pairs match' % (name, 100 * np.mean(np.all(close, axis=-1))))
+
+
+def exp_normalize_attention(inputs, mask):
+    """reference: `DotProductAttention.call` as it was, exp of raw logits, multiplied by masks and divided twice"""
+    from keras import backend as K
+    inputs_a, inputs_b = inputs
+    mask_a, mask_b = mask
+    e = K.exp(K.batch_dot(inputs_a, inputs_b, axes=2))
+    e *= K.expand_dims(K.cast(mask_a, K.floatx()), 2)
+    e *= K.expand_dims(K.cast(mask_b, K.floatx()), 1)
+    e_b = e / K.cast(K.sum(e, axis=2, keepdims=True) + K.epsilon(), K.floatx())
+    e_a = e / K.cast(K.sum(e, axis=1, keepdims=True) + K.epsilon(), K.floatx())
+    return [K.batch_dot(e_b, inputs_b, axes=(2, 1)), K.batch_dot(e_a, inputs_a, axes=(1, 1))]
+
+
+def benchmark_attention(batch_size=128, embed_dim=300, max_lens=(82, 202), n_runs=10):
+    """
+    time and memory of the forward & backward pass of DotProductAttention vs. the reference. Memory is the sum of the
+    bytes of all tensors allocated during the step, which counts every materialized [len_a, len_b] tensor.
+    """
+    import tensorflow as tf
+    from keras import backend as K
+    from layers.attention import DotProductAttention
+
+    rand = np.random.RandomState(2019)
+    session = K.get_session()
+    for max_len in max_lens:
+        inputs = [K.placeholder((None, max_len, embed_dim)), K.placeholder((None, max_len, embed_dim))]
+        mask = [K.placeholder((None, max_len)), K.placeholder((None, max_len))]
+        feed_dict = {inputs[0]: rand.normal(0, 0.05, (batch_size, max_len, embed_dim)),
+                     inputs[1]: rand.normal(0, 0.05, (batch_size, max_len, embed_dim))}
+        for m in mask:
+            lengths = rand.randint(max_len // 4, max_len + 1, batch_size)
+            feed_dict[m] = (np.arange(max_len)[None, :] < lengths[:, None]).astype(np.float32)
+
+        results = dict()
+        for name, outputs in [('exp_normalize', exp_normalize_attention(inputs, mask)),
+                              ('masked_softmax', DotProductAttention().call(inputs, mask=mask))]:
+            grads = K.gradients(K.sum(outputs[0]) + K.sum(outputs[1]), inputs)
+            for phase, fetches in [('forward', outputs), ('forward & backward', outputs + grads)]:
+                results[name] = session.run(fetches, feed_dict)    # warm up
+                run_metadata = tf.RunMetadata()
+                session.run(fetches, feed_dict, options=tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE),
+                            run_metadata=run_metadata)
+                allocated = sum(output.tensor_description.allocation_description.requested_bytes
+                                for dev_stats in run_metadata.step_stats.dev_stats
+                                for node_stats in dev_stats.node_stats for output in node_stats.output)
+                run_time, _ = timeit(session.run, fetches, feed_dict, repeat=n_runs)
+                print('Logging Info - %s, max_len %d, %s : %.2fms, %.1fmb allocated' %
+                      (name, max_len, phase, run_time * 1000, allocated / 2 ** 20))
+        max_diff = max(np.max(np.abs(ref - new)) for ref, new in zip(results['exp_normalize'],
+                                                                       results['masked_softmax']))
+        print('Logging Info - max_len %d : max absolute difference %g' % (max_len, max_diff))
+
+
+def synthetic_predict(premises, hypotheses, features=None, fixed_cost=0.005, pair_cost=0.0001):
+    """stand-in for a model: a fixed cost per call (kernel launches, session overhead) plus a cost per pair"""
+    time.sleep(fixed_cost + pair_cost * len(premises))
+    return np.tile([[0.2, 0.5, 0.3]], (len(premises), 1))
+
+
+def benchmark_serving(n_clients=32, n_requests=50, settings=((1, 0.), (64, 0.), (64, 0.002), (64, 0.01))):
+    """
+    throughput & latency of the serving stack (unix socket server, dynamic batcher) under `n_clients` concurrent
+    clients each sending `n_requests` pairs one by one, for every (max_batch_size, max_latency) setting, with a
+    synthetic model so that it runs without a trained one
+    """
+    sentences = random_sentences(100, 5, 30)
+    unix_socket = os.path.join(tempfile.mkdtemp(), 'nli.sock')
+    for max_batch_size, max_latency in settings:
+        batcher = DynamicBatcher(synthetic_predict, max_batch_size, max_latency).start()
+        server = make_server(batcher, ['entailment', 'neutral', 'contradiction'], unix_socket=unix_socket)
+        server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+        server_thread.start()
+
+        def run_client(seed):
+            rand = random.Random(seed)
+            client = NLIClient(unix_socket=unix_socket)
+            for _ in range(n_requests):
+                client.predict(rand.choice(sentences), rand.choice(sentences))
+            client.close()
+
+        clients = [threading.Thread(target=run_client, args=(i,)) for i in range(n_clients)]
+        start = time.perf_counter()
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        elapsed = time.perf_counter() - start
+        report = batcher.metrics.report()
+        server.shutdown()
+        server.server_close()
+        batcher.stop()
+        print('Logging Info - max_batch_size %d, max_latency %.1fms : %.0f pairs/s, avg batch size %.1f, '
+              'latency p50 %.2fms, p95 %.2fms, p99 %.2fms' %
+              (max_batch_size, max_latency * 1000, report['n_requests'] / elapsed, report['avg_batch_size'],
+               report['latency_p50_ms'], report['latency_p95_ms'], report['latency_p99_ms']))
+    os.remove(unix_socket)
+
+
+IMPORT_PROBE = '''
+import sys, time, json, resource
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                  'modules': sorted(set(name.split('.')[0] for name in sys.modules))}}))
+'''
+
+HEAVY_BACKENDS = ['tensorflow', 'tensorflow_hub', 'keras', 'bert', 'allennlp', 'torch', 'gensim', 'fastText', 'glove',
+                  'lmdb', 'matplotlib']
+
+
+def benchmark_import_time(entry_points=('train', 'export', 'serve', 'preprocess', 'prepare_features',
+                                        'utils.inference', 'utils.feature_extractor'), repeat=3):
+    """
+    import time (best of `repeat` fresh interpreters), peak memory and heavy backends loaded by importing every entry
+    point, i.e. the startup cost paid before any work
+    """
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    for module in entry_points:
+        best, result = float('inf'), None
+        for _ in range(repeat):
+            process = subprocess.run([sys.executable, '-c', IMPORT_PROBE.format(module=module)], cwd=repo_dir,
+                                     stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+            if process.returncode != 0:
+                result = None
+                print('Logging Warning - import %s failed: %s' % (module, process.stderr.strip().splitlines()[-1]))
+                break
+            probe = json.loads(process.stdout.strip().splitlines()[-1])
+            if probe['seconds'] < best:
+                best, result = probe['seconds'], probe
+        if result is not None:
+            backends = [name for name in HEAVY_BACKENDS if name in result['modules']]
+            print('Logging Info - import %s : %.2fs, %.0fmb max rss, heavy backends: %s' %
+                  (module, best, result['max_rss_mb'], ', '.join(backends) or 'none'))
+
+
+if __name__ == '__main__':
+    benchmark_string_kernels()
+    benchmark_signatures()
+    benchmark_ngram_overlap()
+    benchmark_fuzzy()
+    benchmark_graph_features()
+    benchmark_attention()
+    benchmark_serving()
+    benchmark_import_time()
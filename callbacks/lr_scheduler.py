@@ -21,12 +21,6 @@ from keras.callbacks import Callback
 
 from config import IMG_DIR
 
-# Force matplotlib to not use any Xwindows backend.
-# See: https://stackoverflow.com/questions/2801882/generating-a-png-with-matplotlib-when-display-is-undefined
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-
 
 class LRScheduler(Callback):
     def __init__(self, alpha=0.2, sma=20, plot=False, save_plot_prefix=None):
@@ -114,6 +108,12 @@ class LRScheduler(Callback):
 
     @staticmethod
     def plot_figure(x, y, xlabel, ylabel, xscale=None, yscale=None, show=False, save_path=None):
+        # imported here, only lr range tests plot. Force matplotlib to not use any Xwindows backend.
+        # See: https://stackoverflow.com/questions/2801882/generating-a-png-with-matplotlib-when-display-is-undefined
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+
         plt.clf()
         plt.ylabel(ylabel)
         plt.xlabel(xlabel)
@@ -15,7 +15,7 @@
 """
 
 from os import path
-from keras.optimizers import Adam
+from utils.feature_store import get_feature_len
 
 
 RAW_DATA_DIR = './raw_data'
@@ -23,6 +23,7 @@ PROCESSED_DATA_DIR = './data'
 LOG_DIR = './log'
 MODEL_SAVED_DIR = './ckpt'
 FEATURE_DIR = './feature'
+EXPORT_DIR = './export'
 IMG_DIR = './img'
 
 
@@ -48,16 +49,16 @@ TRAIN_IDS_MATRIX_TEMPLATE = 'genre_{}_level_{}_ids_train.pkl'
 DEV_IDS_MATRIX_TEMPLATE = 'genre_{}_level_{}_ids_dev.pkl'
 TEST_IDS_MATRIX_TEMPLATE = 'genre_{}_level_{}_ids_test.pkl'
 
-TRAIN_FEATURES_TEMPLATE = 'genre_{}_feature_{}_train.pkl'
-DEV_FEATURES_TEMPLATE = 'genre_{}_feature_{}_dev.pkl'
-TEST_FEATURES_TEMPLATE = 'genre_{}_feature_{}_test.pkl'
-
 
 EMBEDDING_MATRIX_TEMPLATE = 'genre_{}_type_{}_embeddings.npy'
 TOKENIZER_TEMPLATE = 'genre_{}_level_{}_tokenizer.pkl'
 VOCABULARY_TEMPLATE = 'genre_{}_level_{}_vocab.pkl'
 
 ANALYSIS_LOG_TEMPLATE = 'genre_{}_analysis.log'
+MANIFEST_TEMPLATE = 'genre_{}_manifest.json'
+
+EXPORT_GRAPH_TEMPLATE = '{}.pb'     # frozen inference graph of an experiment
+EXPORT_SPEC_TEMPLATE = '{}_spec.json'   # its serving signature & text preprocessing
 PERFORMANCE_LOG = 'genre_{}_performance.log'
 
 EXTERNAL_WORD_VECTORS_DIR = path.join(RAW_DATA_DIR, 'word_embeddings/')
@@ -85,8 +86,9 @@ class ProcessConfig(object):
         self.clean = False
         self.stem = False
         self.lowercase = True
-        self.word_max_len = None
+        self.word_max_len = None    # padding length, chosen by `len_coverage` when None
         self.char_max_len = None
+        self.len_coverage = 0.995   # ratio of train sentences the padding length should cover
         self.padding = 'post'
         self.truncating = 'post'
         self.n_class = 3
@@ -99,6 +101,7 @@ class ModelConfig(object):
         # input configuration
         self.genre = 'snli'
         self.input_level = 'word'
+        # used only for data processed without a manifest, otherwise max_len is read from the manifest
         self.word_max_len = {'snli': 82, 'mednli': 202}
         self.char_max_len = {'snli': 406, 'mednli': 1132}
         self.max_len = 0
@@ -107,7 +110,7 @@ class ModelConfig(object):
         self.word_embed_trainable = False
         self.word_embeddings = None
         self.add_features = False   # whether to add additional statistical features
-        self.feature_len = 79   # dimension of statistical features
+        self.feature_len = get_feature_len()   # dimension of statistical features, derived from feature registry
 
         # elmo embedding configuration
         self.elmo_model_url = EXTERNAL_WORD_VECTORS_FILENAME['tfhub_elmo_2']
@@ -121,11 +124,13 @@ class ModelConfig(object):
         self.model_name = None
         self.rnn_units = 300
         self.dense_units = 128
+        self.attention_chunk_size = None    # compute attention over tiles of this many positions to bound memory
 
         # model training configuration
         self.batch_size = 512
         self.n_epoch = 16
         self.learning_rate = 0.001
+        from keras.optimizers import Adam   # not at module level: config is imported by tools not using keras
         self.optimizer = Adam(self.learning_rate)
         self.dropout = 0.5
         self.l2_reg = 0.001
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+@author: alexyang
+
+@contact: alex.yang0326@gmail.com
+
+@file: export.py
+
+@time: 2019/4/24 10:12
+
+@desc: export trained keras models as frozen inference graphs, to be served by `utils.inference.FrozenNLIModel`
+
+"""
+
+import os
+import json
+
+import tensorflow as tf
+from keras import backend as K
+
+from config import PROCESSED_DATA_DIR, TOKENIZER_TEMPLATE, MANIFEST_TEMPLATE, EXPORT_DIR, EXPORT_GRAPH_TEMPLATE, \
+    EXPORT_SPEC_TEMPLATE, LABELS, ProcessConfig
+from train import get_model_config, get_model
+from utils.io import format_filename, pickle_load
+from utils.length_policy import load_manifest
+
+
+def export_model(genre, input_level, word_embed_type, word_embed_trainable, batch_size, learning_rate,
+                 optimizer_type, model_name, n_epoch=50, add_features=False, scale_features=False,
+                 callbacks_to_add=None, swa_type=None, export_dir=EXPORT_DIR, **kwargs):
+    """
+    rebuild a model trained by `train.train_model` (called with the same arguments) in inference mode, load its best
+    checkpoint (or the `swa_type` one), and write:
+    1. a frozen graph: variables (frozen embeddings included) folded into constants, dropout built in test mode,
+       optimizer, loss and metrics pruned, output named `probabilities`;
+    2. a spec: input / output tensor names by role, labels, and the tokenizer & padding settings needed to turn raw
+       text into model input, so the graph can be run without keras or the model code.
+    """
+    input_config = kwargs.get('input_config', 'token')
+    if input_config != 'token':
+        raise ValueError('Only models with token input can be exported, input_config Not Understood: {}'.format(
+            input_config))
+    if not os.path.exists(export_dir):
+        os.makedirs(export_dir)
+
+    K.clear_session()
+    K.set_learning_phase(0)     # layers like dropout are built in test mode, without learning phase input
+    config = get_model_config(genre, input_level, word_embed_type, word_embed_trainable, batch_size, learning_rate,
+                              optimizer_type, model_name, n_epoch, add_features, scale_features, callbacks_to_add,
+                              **kwargs)
+    model = get_model(model_name, config, **kwargs)
+    if swa_type is not None:
+        model.load_swa_model(swa_type)
+    else:
+        model.load_best_model()
+
+    tf.identity(model.model.output, name='probabilities')
+    session = K.get_session()
+    graph_def = tf.graph_util.convert_variables_to_constants(session, session.graph.as_graph_def(),
+                                                             ['probabilities'])
+    graph_def = tf.graph_util.remove_training_nodes(graph_def, protected_nodes=['probabilities'])
+    exp_name = config.exp_name if swa_type is None else '{}_{}'.format(config.exp_name, swa_type)
+    graph_file = EXPORT_GRAPH_TEMPLATE.format(exp_name)
+    tf.train.write_graph(graph_def, export_dir, graph_file, as_text=False)
+    print('Logging Info - Saved:', os.path.join(export_dir, graph_file))
+
+    tokenizer = pickle_load(format_filename(PROCESSED_DATA_DIR, TOKENIZER_TEMPLATE, genre, input_level))
+    manifest = load_manifest(format_filename(PROCESSED_DATA_DIR, MANIFEST_TEMPLATE, genre)) or dict()
+    process_conf = ProcessConfig()
+    input_names = ['premise', 'hypothesis'] + (['features'] if add_features else [])
+    spec = {
+        'exp_name': exp_name,
+        'graph_file': graph_file,   # relative to the directory of the spec
+        'genre': genre,
+        'input_level': input_level,
+        'inputs': dict((name, tensor.name) for name, tensor in zip(input_names, model.model.inputs)),
+        'outputs': {'probabilities': 'probabilities:0'},
+        'labels': [label for label, _ in sorted(LABELS.items(), key=lambda x: x[1])],
+        'feature_scaled': scale_features if add_features else None,
+        'max_len': config.max_len,
+        'padding': manifest.get('padding', process_conf.padding),
+        'truncating': manifest.get('truncating', process_conf.truncating),
+        'tokenizer': {
+            'lower': tokenizer.lower,
+            'char_level': tokenizer.char_level,
+            'filters': tokenizer.filters,
+            'split': tokenizer.split,
+            'num_words': tokenizer.num_words,
+            'oov_token': tokenizer.oov_token,
+            'word_index': tokenizer.word_index
+        }
+    }
+    spec_path = os.path.join(export_dir, EXPORT_SPEC_TEMPLATE.format(exp_name))
+    with open(spec_path, 'w') as writer:
+        json.dump(spec, writer, ensure_ascii=False)
+    print('Logging Info - Saved:', spec_path)
+    return spec
+
+
+if __name__ == '__main__':
+    export_model('mednli', 'word', 'glove_cc', False, 32, 0.001, 'adam', 'KerasEsim', add_features=False)
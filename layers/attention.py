@@ -14,13 +14,20 @@
 
 """
 
-import numpy as np
 from keras import backend as K, initializers, regularizers, constraints
 from keras.engine.topology import Layer
 
 import tensorflow as tf
 
 
+def mask_bias(mask, axis):
+    """
+    additive mask from a 0/1 mask, expanded at `axis`: 0 at kept positions, a large negative value at masked ones,
+    so they get no weight from a softmax over the biased logits
+    """
+    return K.expand_dims((1.0 - K.cast(mask, K.floatx())) * -1e9, axis)
+
+
 class SelfAttention(Layer):
     """
     self-attention mechanism, supporting masking
@@ -99,21 +106,71 @@ class SelfAttention(Layer):
             return K.dot(x, kernel)
 
 
+def chunked_attend(queries, keys, values, key_mask=None, chunk_size=128, bias_func=None):
+    """
+    softmax(queries . keys^T + bias) . values (softmax over keys), computed over tiles of `chunk_size` keys with a
+    running max and normalizer: only a [batch_size, len_q, chunk_size] block of logits exists at a time instead of the
+    whole [batch_size, len_q, len_k] attention weight. The loop swaps the tensors kept for backward to host memory.
+    :param queries: [batch_size, len_q, dim]
+    :param keys: [batch_size, len_k, dim]
+    :param values: [batch_size, len_k, value_dim]
+    :param key_mask: [batch_size, len_k], masked keys get no weight
+    :param bias_func: function of (key_start, key_end) returning the additive bias of the logits of these keys,
+                      broadcastable to [batch_size, len_q, key_end - key_start]
+    :return: [batch_size, len_q, value_dim]
+    """
+    batch_size, len_q, len_k = tf.shape(queries)[0], tf.shape(queries)[1], tf.shape(keys)[1]
+
+    def step(start, running_max, normalizer, attend):
+        end = tf.minimum(start + chunk_size, len_k)
+        logits = tf.matmul(queries, keys[:, start:end], transpose_b=True)
+        if bias_func is not None:
+            logits += bias_func(start, end)
+        if key_mask is not None:
+            logits += mask_bias(key_mask[:, start:end], 1)
+        new_max = K.maximum(running_max, K.max(logits, axis=-1, keepdims=True))
+        weights = K.exp(logits - new_max)
+        rescale = K.exp(running_max - new_max)  # rescale what is accumulated so far to the new max
+        normalizer = normalizer * rescale + K.sum(weights, axis=-1, keepdims=True)
+        attend = attend * rescale + tf.matmul(weights, values[:, start:end])
+        return end, new_max, normalizer, attend
+
+    init_vars = [tf.constant(0), tf.fill(tf.stack([batch_size, len_q, 1]), -1e30),
+                 tf.zeros(tf.stack([batch_size, len_q, 1])),
+                 tf.zeros(tf.stack([batch_size, len_q, K.int_shape(values)[-1]]))]
+    _, _, normalizer, attend = tf.while_loop(lambda start, *_: start < len_k, step, init_vars, parallel_iterations=1,
+                                             swap_memory=True)
+    return attend / normalizer
+
+
 class DotProductAttention(Layer):
     """
     dot-product-attention mechanism, supporting masking
     """
-    def __init__(self, return_attend_weight=False, keep_mask=True, **kwargs):
+    def __init__(self, return_attend_weight=False, keep_mask=True, chunk_size=None, **kwargs):
+        """
+        :param return_attend_weight: whether to return the attention weights over b & a instead of the attended
+                                     outputs. The [len_a, len_b] weights are only materialized when they are returned.
+        :param chunk_size: if not None, compute the attended outputs over tiles of `chunk_size` positions (see
+                           `chunked_attend`), which bounds memory for long inputs
+        """
+        if chunk_size is not None and return_attend_weight:
+            raise ValueError('DotProductAttention can not return attention weights in chunked mode')
         self.return_attend_weight = return_attend_weight
         self.keep_mask = keep_mask
+        self.chunk_size = chunk_size
         self.supports_masking = True
         super(DotProductAttention, self).__init__(**kwargs)
 
     def build(self, input_shape):
-        assert isinstance(input_shape, list)
-        input_shape_a, input_shape_b = input_shape
+        """
+        inputs: [a, b], or [a, b, values_a, values_b] to attend to other values than the inputs aligned (values_a
+        (values_b) has the same length as a (b))
+        """
+        assert isinstance(input_shape, list) and len(input_shape) in [2, 4]
+        input_shape_a, input_shape_b = input_shape[:2]
 
-        if len(input_shape_a) != 3 or len(input_shape_b) != 3:
+        if any(len(shape) != 3 for shape in input_shape):
             raise ValueError('Inputs into DotProductAttention should be 3D tensors')
 
         if input_shape_a[-1] != input_shape_b[-1]:
@@ -121,43 +178,66 @@ class DotProductAttention(Layer):
 
     def call(self, inputs, mask=None):
         assert isinstance(inputs, list)
-        inputs_a, inputs_b = inputs
+        inputs_a, inputs_b = inputs[:2]
+        values_a, values_b = inputs[2:] if len(inputs) == 4 else inputs
 
         if mask is not None:
-            mask_a, mask_b = mask
+            mask_a, mask_b = mask[:2]
         else:
             mask_a, mask_b = None, None
-
-        e = K.exp(K.batch_dot(inputs_a, inputs_b, axes=2))  # similarity between a & b
-
-        # apply mask before normalization (softmax)
         if mask_a is not None:
-            e *= K.expand_dims(K.cast(mask_a, K.floatx()), 2)
+            mask_a = K.cast(mask_a, K.floatx())
         if mask_b is not None:
-            e *= K.expand_dims(K.cast(mask_b, K.floatx()), 1)
-
-        e_b = e / K.cast(K.sum(e, axis=2, keepdims=True) + K.epsilon(), K.floatx())    # attention weight over b
-        e_a = e / K.cast(K.sum(e, axis=1, keepdims=True) + K.epsilon(), K.floatx())     # attention weight over a
-
-        if self.return_attend_weight:
-            return [e_b, e_a]
+            mask_b = K.cast(mask_b, K.floatx())
 
-        a_attend = K.batch_dot(e_b, inputs_b, axes=(2, 1))  # a attend to b
-        b_attend = K.batch_dot(e_a, inputs_a, axes=(1, 1))  # b attend to a
+        if self.chunk_size is not None:
+            a_attend = chunked_attend(inputs_a, inputs_b, values_b, mask_b, self.chunk_size)   # a attend to b
+            b_attend = chunked_attend(inputs_b, inputs_a, values_a, mask_a, self.chunk_size)   # b attend to a
+        else:
+            e = K.batch_dot(inputs_a, inputs_b, axes=2)  # similarity between a & b
+            # mask before normalization: padded positions of b (a) get a large negative logit, so they have no weight
+            # in the softmax over b (a). The bias of a (b) is constant along b (a), so both softmax share the logits
+            if mask_a is not None:
+                e += mask_bias(mask_a, 2)
+            if mask_b is not None:
+                e += mask_bias(mask_b, 1)
+
+            # fused softmax kernels, max-subtracted along each direction
+            e_b = tf.nn.softmax(e, axis=2)  # attention weight over b
+            e_a = tf.nn.softmax(e, axis=1)  # attention weight over a
+
+            if self.return_attend_weight:
+                # padded positions attend to nothing
+                if mask_a is not None:
+                    e_b *= K.expand_dims(mask_a, 2)
+                if mask_b is not None:
+                    e_a *= K.expand_dims(mask_b, 1)
+                return [e_b, e_a]
+
+            a_attend = K.batch_dot(e_b, values_b, axes=(2, 1))  # a attend to b
+            b_attend = K.batch_dot(e_a, values_a, axes=(1, 1))  # b attend to a
+
+        # padded positions attend to nothing, masked on the outputs rather than on the [len_a, len_b] weights
+        if mask_a is not None:
+            a_attend *= K.expand_dims(mask_a, 2)
+        if mask_b is not None:
+            b_attend *= K.expand_dims(mask_b, 2)
         return [a_attend, b_attend]
 
     def compute_mask(self, inputs, mask=None):
-        if self.keep_mask:
-            return mask
+        if self.keep_mask and mask is not None:
+            return mask[:2]
         else:
             return [None, None]
 
     def compute_output_shape(self, input_shape):
+        input_shape_a, input_shape_b = input_shape[:2]
         if self.return_attend_weight:
-            input_shape_a, input_shape_b = input_shape
             return [(input_shape_a[0], input_shape_a[1], input_shape_b[1]),
                     (input_shape_a[0], input_shape_a[1], input_shape_b[1])]
-        return input_shape
+        value_shape_a, value_shape_b = input_shape[2:] if len(input_shape) == 4 else input_shape
+        return [(input_shape_a[0], input_shape_a[1], value_shape_b[-1]),
+                (input_shape_b[0], input_shape_b[1], value_shape_a[-1])]
 
 
 class IntraSentenceAttention(Layer):
@@ -165,39 +245,63 @@ class IntraSentenceAttention(Layer):
     intra-sentence-attention mechanism, supporting masking
     """
 
-    def __init__(self, return_attend_weight=False, **kwargs):
+    def __init__(self, return_attend_weight=False, max_distance=10, chunk_size=None, **kwargs):
+        """
+        :param return_attend_weight: whether to return the attention weight instead of the attended output, it's only
+                                     materialized when it is returned
+        :param max_distance: the distance-sensitive bias between position i and j is min(i - j, max_distance)
+        :param chunk_size: if not None, compute the attended output over tiles of `chunk_size` positions (see
+                           `chunked_attend`), which bounds memory for long inputs
+        """
+        if chunk_size is not None and return_attend_weight:
+            raise ValueError('IntraSentenceAttention can not return attention weight in chunked mode')
         self.return_attend_weight = return_attend_weight
-        self.distance_term = None
+        self.max_distance = max_distance
+        self.chunk_size = chunk_size
         self.supports_masking = True
         super(IntraSentenceAttention, self).__init__(**kwargs)
 
     def build(self, input_shape):
         if len(input_shape) != 3:
             raise ValueError('Input into IntraSentenceAttention should be a 3D tensor')
-        # create distance-sensitive bias term
-        time_steps = input_shape[1]
-        distance_term = np.zeros(shape=(time_steps, time_steps))
-        for i in range(time_steps):
-            for j in range(time_steps):
-                distance_term[i][j] = min(i-j, 10)
-        self.distance_term = K.variable(distance_term)
+        super(IntraSentenceAttention, self).build(input_shape)
+
+    def distance_term(self, time_steps, key_start=0, key_end=None):
+        """
+        distance-sensitive bias term between positions [0, time_steps) and [key_start, key_end) (all positions by
+        default), built in graph for the actual sequence length
+        """
+        key_end = time_steps if key_end is None else key_end
+        distance = K.expand_dims(tf.range(time_steps), 1) - K.expand_dims(tf.range(key_start, key_end), 0)  # i - j
+        return K.cast(K.minimum(distance, self.max_distance), K.floatx())
 
     def call(self, inputs, mask=None):
+        time_steps = K.shape(inputs)[1]
+        if mask is not None:
+            mask = K.cast(mask, K.floatx())
+
+        if self.chunk_size is not None:
+            attend = chunked_attend(inputs, inputs, inputs, mask, self.chunk_size,
+                                    bias_func=lambda start, end: self.distance_term(time_steps, start, end))
+        else:
+            e = K.batch_dot(inputs, inputs, axes=2) + self.distance_term(time_steps)
 
-        e = K.exp(K.batch_dot(inputs, inputs, axes=2) + self.distance_term)
+            # apply mask before normalization (softmax)
+            if mask is not None:
+                e += mask_bias(mask, 1)
 
-        # apply mask before normalization (softmax)
-        if mask is not None:
-            e *= K.expand_dims(K.cast(mask, K.floatx()), 2)
-            e *= K.expand_dims(K.cast(mask, K.floatx()), 1)
+            # normalization
+            e = tf.nn.softmax(e, axis=-1)
 
-        # normalization
-        e = e / K.cast(K.sum(e, axis=-1, keepdims=True) + K.epsilon(), K.floatx())  # attention weight over b
+            if self.return_attend_weight:
+                if mask is not None:
+                    e *= K.expand_dims(mask, 2)     # padded positions attend to nothing
+                return e
 
-        if self.return_attend_weight:
-            return e
+            attend = K.batch_dot(e, inputs, axes=(2, 1))
 
-        attend = K.batch_dot(e, inputs, axes=(2, 1))
+        if mask is not None:
+            attend *= K.expand_dims(mask, 2)
         return attend
 
     def compute_mask(self, inputs, mask=None):
@@ -16,7 +16,6 @@
 
 
 import tensorflow as tf
-import tensorflow_hub as hub
 from keras.engine.topology import Layer
 from keras import backend as K
 
@@ -79,6 +78,8 @@ class ELMoEmbedding(Layer):
                                                                                     default_value="<UNK>")
             self.lookup_table.init.run(session=K.get_session())
 
+        import tensorflow_hub as hub    # only elmo inputs need it
+
         print('Logging Info - Loading elmo from tensorflow hub....')
         self.elmo = hub.Module(self.hub_url, trainable=self.elmo_trainable,
                                name="{}_elmo_hub".format(self.name))
@@ -35,8 +35,8 @@ class KerasDecomposableAttentionModel(KerasBaseModel):
 
         # input representation
         if add_intra_sentence_attention:
-            premise_intra = IntraSentenceAttention()(premise_embed)
-            hypothesis_intra = IntraSentenceAttention()(hypothesis_embed)
+            premise_intra = IntraSentenceAttention(chunk_size=self.config.attention_chunk_size)(premise_embed)
+            hypothesis_intra = IntraSentenceAttention(chunk_size=self.config.attention_chunk_size)(hypothesis_embed)
             premise_input = concatenate([premise_embed, premise_intra])
             hypothesis_input = concatenate([hypothesis_embed, hypothesis_intra])
         else:
@@ -49,9 +49,9 @@ class KerasDecomposableAttentionModel(KerasBaseModel):
         premise_f = f2(f1(premise_input))
         hypothesis_f = f2(f1(premise_input))
 
-        hypothesis_attend_w, premise_attend_w = DotProductAttention(return_attend_weight=True)([premise_f, hypothesis_f])
-        hypothesis_attend = Lambda(lambda x: K.batch_dot(x[0], x[1], axes=(2, 1)))([hypothesis_attend_w, hypothesis_input])
-        premise_attend = Lambda(lambda x: K.batch_dot(x[0], x[1], axes=(1, 1)))([premise_attend_w, premise_input])
+        # align on the projected inputs, attend to the inputs themselves, without materializing attention weights
+        hypothesis_attend, premise_attend = DotProductAttention(chunk_size=self.config.attention_chunk_size)(
+            [premise_f, hypothesis_f, premise_input, hypothesis_input])
 
         # compare
         g1 = TimeDistributed(Dense(units=200, activation='relu'))
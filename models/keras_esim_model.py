@@ -39,7 +39,8 @@ class KerasEsimModel(KerasBaseModel):
         hypothesis_hidden = bilstm_1(hypothesis_embed)
 
         # local inference collected over sequences
-        premise_attend, hypothesis_attend = DotProductAttention()([premise_hidden, hypothesis_hidden])
+        premise_attend, hypothesis_attend = DotProductAttention(chunk_size=self.config.attention_chunk_size)(
+            [premise_hidden, hypothesis_hidden])
 
         # enhancement of local inference information
         premise_enhance = concatenate([premise_hidden, premise_attend, subtract([premise_hidden, premise_attend]),
@@ -33,7 +33,8 @@ class KerasIACNNModel(KerasBaseModel):
                                                                    elmo_trainable=elmo_trainable,
                                                                    elmo_model_url=elmo_model_url)
 
-        premise_attend, hypothesis_attend = DotProductAttention()([premise_embed, hypothesis_embed])
+        premise_attend, hypothesis_attend = DotProductAttention(chunk_size=self.config.attention_chunk_size)(
+            [premise_embed, hypothesis_embed])
         premise_enhance = concatenate([premise_embed, premise_attend, subtract([premise_embed, premise_attend]),
                                        multiply([premise_embed, premise_attend])])
         hypothesis_enhance = concatenate([hypothesis_embed, hypothesis_attend,
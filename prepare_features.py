@@ -15,259 +15,233 @@
 """
 
 import os
+from itertools import chain, repeat
+from multiprocessing import Pool
 import pandas as pd
-import networkx as nx
+from scipy import sparse
 from gensim import corpora
 from gensim.models import TfidfModel
-from sklearn.preprocessing import StandardScaler
-from sklearn.externals import joblib
-from config import TRAIN_DATA_TEMPLATE, DEV_DATA_TEMPLATE, TEST_DATA_TEMPLATE, PROCESSED_DATA_DIR, FEATURE_DIR, \
-    TRAIN_FEATURES_TEMPLATE, DEV_FEATURES_TEMPLATE, TEST_FEATURES_TEMPLATE
+from config import TRAIN_DATA_TEMPLATE, DEV_DATA_TEMPLATE, TEST_DATA_TEMPLATE, PROCESSED_DATA_DIR, FEATURE_DIR
 from utils.io import format_filename, pickle_load, pickle_dump
+from utils.feature_store import FeatureStore, FeatureScaler, get_feature_specs
+from utils.graph import adjacency_matrix, save_graph, load_graph, GraphFeatures
 from utils.features import *
+from utils import kernels
+import utils.features
+
+
+def similarity_worker(chunk):
+    """compute every similarity function on one chunk of (premise, hypothesis) pairs, used in process pool"""
+    premises, hypotheses, sim_funcs = chunk
+    # tokenize and build n-grams once per sentence, shared by all similarity functions
+    analyses = dict()
+    for sent in premises + hypotheses:
+        if sent not in analyses:
+            analyses[sent] = TextAnalysis(sent)
+    pairs = [(analyses[p], analyses[h]) for p, h in zip(premises, hypotheses)]
+    return [[sim_func(p, h) for p, h in pairs] for sim_func in sim_funcs]
 
 
 class Feature(object):
-    def __init__(self, genre):
+    def __init__(self, genre, n_jobs=None, chunk_size=1000):
+        """
+        :param n_jobs: number of worker processes used to compute similarity features, default to cpu count
+        :param chunk_size: number of pairs sent to a worker at a time
+        """
         self.genre = genre
+        self.n_jobs = n_jobs if n_jobs is not None else os.cpu_count()
+        self.chunk_size = chunk_size
         self.train_data = pickle_load(format_filename(PROCESSED_DATA_DIR, TRAIN_DATA_TEMPLATE, genre))
         self.dev_data = pickle_load(format_filename(PROCESSED_DATA_DIR, DEV_DATA_TEMPLATE, genre))
         self.test_data = pickle_load(format_filename(PROCESSED_DATA_DIR, TEST_DATA_TEMPLATE, genre))
+        self.store = FeatureStore(FEATURE_DIR, genre)
+        self._tfidf_index = None
+        self._graph_features = None
 
         if not os.path.exists(FEATURE_DIR):
             os.makedirs(FEATURE_DIR)
 
-    def gen_all_features(self, data_type, scaled=False):
+    def gen_all_features(self, data_type, scaled=False, recompute=()):
+        """
+        generate the features of the feature registry missing from the feature store, then assemble the feature
+        matrix from the stored columns.
+        :param scaled: whether to also prepare the feature scaler: refit it on train split, or make sure it exists for
+                       other splits. It's applied when loading the features (see `utils.data_loader.load_features`)
+        :param recompute: names of features, or of the artifacts they depend on ('tfidf', 'power_word', 'graph'),
+                          whose stored columns are dropped and generated again. Note that the artifacts themselves are
+                          only rebuilt when their files are removed from FEATURE_DIR.
+        """
+        specs = get_feature_specs()
+        for spec in specs:
+            if spec.name in recompute or set(spec.depends) & set(recompute):
+                self.store.remove(data_type, spec.name)
+
+        missing = [spec for spec in specs if not self.store.exists(data_type, spec.name)]
+        # pairwise similarity features are computed together in the process pool, the others by their own method
+        feat_types = [(spec.name, getattr(utils.features, spec.func)) for spec in missing if not hasattr(self, spec.func)]
+        if feat_types:
+            self.add_similarity_features(data_type, feat_types)
+        for spec in missing:
+            if hasattr(self, spec.func):
+                getattr(self, spec.func)(data_type)
+
+        features = self.store.gather(data_type)
         if scaled:
-            feat_file = self.format_feature_file(data_type, 'all_scaled')
-        else:
-            feat_file = self.format_feature_file(data_type, 'all')
-        if os.path.exists(feat_file):
-            features = pickle_load(feat_file)
-        else:
-            features = list()
-            feat_types = [('len_dis', length_distance), ('lcs_seq', lcs_seq_norm), ('lcs_str', lcs_str_1_norm),
-                          ('edit_dist', edit_distance), ('jaro', jaro_distance), ('jaro_winkler', jaro_winkler_dist),
-                          ('fuzz', fuzzy), ('simhash', simhash), ('w_share', word_share),
-                          ('w_ngram_dist', word_ngram_distance), ('c_ngram_ol', char_ngram_overlap),
-                          ('w_ngram_ol', word_ngram_overlap)]
-            for feat_type, sim_func in feat_types:
-                features.append(self.add_similarity_feature(data_type, feat_type, sim_func))
-
-            features.append(self.add_weighted_word_ngram_overlap_feature(data_type))
-            features.append(self.add_tfidf_feature(data_type))
-            features.append(self.add_word_power_feature(data_type))
-            features.append(self.add_graph_feature(data_type))
-            features = np.concatenate(features, axis=-1)
-
-            if scaled:
-                scaler = StandardScaler()
-                features = scaler.fit_transform(features)
-                joblib.dump(scaler, os.path.join(FEATURE_DIR, '{}_scaler.model'.format(self.genre)))
-
-            pickle_dump(feat_file, features)
+            if data_type == 'train':
+                self.fit_scaler(features)
+            else:
+                self.get_scaler()
 
         print('Logging Info - {} : all feature shape : {}'.format(data_type, features.shape))
+        return features
+
+    def fit_scaler(self, train_features):
+        """fit the feature scaler on the train split only, it's saved with the feature registry version"""
+        scaler = FeatureScaler().fit(train_features)
+        scaler.save(FEATURE_DIR, self.genre)
+        return scaler
+
+    def get_scaler(self):
+        """scaler fitted for the current feature registry version, fit it (on the train split) if there is none"""
+        if os.path.exists(FeatureScaler.path(FEATURE_DIR, self.genre)):
+            return FeatureScaler.load(FEATURE_DIR, self.genre)
+        return self.fit_scaler(self.gen_all_features('train'))
+
+    def add_similarity_features(self, data_type, feat_types):
+        """
+        compute several similarity features at once in a process pool. Pairs are split into chunks and each worker
+        computes all the (uncached) similarity functions for its chunk in one pass, so the strings only cross the
+        process boundary once.
+        :param feat_types: list of (feat_type, sim_func), sim_func must be picklable (a module-level function)
+        """
+        to_compute = [i for i, (feat_type, _) in enumerate(feat_types) if not self.store.exists(data_type, feat_type)]
+
+        computed = dict()
+        if to_compute:
+            premises = self.get_data(data_type)['premise']
+            hypotheses = self.get_data(data_type)['hypothesis']
+            sim_funcs = [feat_types[i][1] for i in to_compute]
+            chunks = [(premises[start:start+self.chunk_size], hypotheses[start:start+self.chunk_size], sim_funcs)
+                      for start in range(0, len(premises), self.chunk_size)]
+            results = [list() for _ in to_compute]
+            with Pool(self.n_jobs) as pool:
+                for chunk_results in pool.imap(similarity_worker, chunks):
+                    for result, chunk_result in zip(results, chunk_results):
+                        result.extend(chunk_result)
+            for i, result in zip(to_compute, results):
+                computed[i] = self.check_and_expand_shape(np.array(result))
+                self.store.save(data_type, feat_types[i][0], computed[i])
+
+        features = list()
+        for i, (feat_type, _) in enumerate(feat_types):
+            feature = computed[i] if i in computed else self.store.load(data_type, feat_type)
+            print('Logging Info - {} : {} feature shape : {}'.format(data_type, feat_type, feature.shape))
+            features.append(feature)
+        return features
+
+    def add_simhash_feature(self, data_type):
+        """hamming distance between simhash fingerprints, each unique sentence is hashed once"""
+        if self.store.exists(data_type, 'simhash'):
+            features = self.store.load(data_type, 'simhash')
+        else:
+            premises, hypothesis = self.get_data(data_type)['premise'], self.get_data(data_type)['hypothesis']
+            sent2row = {sent: i for i, sent in enumerate(dict.fromkeys(premises + hypothesis))}
+            signatures = kernels.simhash_signatures(list(sent2row.keys()))
+            p_rows = np.array([sent2row[sent] for sent in premises], dtype=np.int64)
+            h_rows = np.array([sent2row[sent] for sent in hypothesis], dtype=np.int64)
+            features = kernels.hamming_distance(signatures[p_rows], signatures[h_rows])
+            self.store.save(data_type, 'simhash', features)
+        print('Logging Info - {} : simhash feature shape : {}'.format(data_type, features.shape))
+        return features
+
+    def add_char_ngram_overlap_feature(self, data_type):
+        """dice & jaccard ratios between char 1~5-gram sets, computed for the whole split at once on interned n-grams"""
+        if self.store.exists(data_type, 'c_ngram_ol'):
+            features = self.store.load(data_type, 'c_ngram_ol')
+        else:
+            features = kernels.char_ngram_overlap_batch(self.get_data(data_type)['premise'],
+                                                        self.get_data(data_type)['hypothesis'])
+            self.store.save(data_type, 'c_ngram_ol', features)
+        print('Logging Info - {} : c_ngram_ol feature shape : {}'.format(data_type, features.shape))
+        return features
 
-    def add_similarity_feature(self, data_type, feat_type, sim_func):
-        feat_file = self.format_feature_file(data_type, feat_type)
-        if os.path.exists(feat_file):
-            features = pickle_load(feat_file)
+    def add_word_ngram_overlap_feature(self, data_type):
+        """dice & jaccard ratios between word 1-gram and 4-gram sets, computed for the whole split at once"""
+        if self.store.exists(data_type, 'w_ngram_ol'):
+            features = self.store.load(data_type, 'w_ngram_ol')
         else:
-            len_dist_feat = np.array([sim_func(p, h) for p, h in zip(self.get_data(data_type)['premise'],
-                                                                     self.get_data(data_type)['hypothesis'])])
-            features = self.check_and_expand_shape(len_dist_feat)
-            pickle_dump(feat_file, features)
-        print('Logging Info - {} : {} feature shape : {}'.format(data_type, feat_type, features.shape))
+            features = kernels.word_ngram_overlap_batch(self.get_data(data_type)['premise'],
+                                                        self.get_data(data_type)['hypothesis'])
+            self.store.save(data_type, 'w_ngram_ol', features)
+        print('Logging Info - {} : w_ngram_ol feature shape : {}'.format(data_type, features.shape))
         return features
 
     def add_tfidf_feature(self, data_type):
-        feat_file = self.format_feature_file(data_type, 'tfidf')
-        if os.path.exists(feat_file):
-            features = pickle_load(feat_file)
+        if self.store.exists(data_type, 'tfidf'):
+            features = self.store.load(data_type, 'tfidf')
         else:
-            dictionary, tfidf_model = self.tfidf_model()
-            features = list()
-            for premise, hypothesis in zip(self.get_data(data_type)['premise'], self.get_data(data_type)['hypothesis']):
-                premise = premise.split()
-                hypothesis = hypothesis.split()
-                p_tfidf = dict(tfidf_model[dictionary.doc2bow(premise)])
-                h_tfidf = dict(tfidf_model[dictionary.doc2bow(hypothesis)])
-                features.append([np.sum(list(p_tfidf.values())), np.sum(list(h_tfidf.values())),
-                                 np.mean(list(p_tfidf.values())), np.mean(list(h_tfidf.values()))])
-            features = np.array(features)
-            pickle_dump(feat_file, features)
-        print('Logging Info - {} : w_ngram_ol_tfidf feature shape : {}'.format(data_type, features.shape))
+            sent2row, tfidf_matrix, _, _ = self.tfidf_index()
+            p_rows, h_rows = self.get_sent_rows(data_type, sent2row)
+            sent_sum = np.asarray(tfidf_matrix.sum(axis=1)).ravel()
+            with np.errstate(invalid='ignore', divide='ignore'):
+                sent_mean = sent_sum / np.diff(tfidf_matrix.indptr)     # nan for sentences without any weighted word
+            features = np.stack([sent_sum[p_rows], sent_sum[h_rows], sent_mean[p_rows], sent_mean[h_rows]], axis=-1)
+            self.store.save(data_type, 'tfidf', features)
+        print('Logging Info - {} : tfidf feature shape : {}'.format(data_type, features.shape))
         return features
 
     def add_weighted_word_ngram_overlap_feature(self, data_type):
-        feat_file = self.format_feature_file(data_type, 'w_ngram_ol_tfidf')
-        if os.path.exists(feat_file):
-            features = pickle_load(feat_file)
+        if self.store.exists(data_type, 'w_ngram_ol_tfidf'):
+            features = self.store.load(data_type, 'w_ngram_ol_tfidf')
         else:
-            dictionary, tfidf_model = self.tfidf_model()
-            idf_model = tfidf_model.idfs
-            features = list()
-            for premise, hypothesis in zip(self.get_data(data_type)['premise'], self.get_data(data_type)['hypothesis']):
-                premise = premise.split()
-                p_tfidf = dict(tfidf_model[dictionary.doc2bow(premise)])
-                input_premise = [(word, idf_model.get(dictionary.token2id.get(word, 0), 0.0),
-                                  p_tfidf.get(dictionary.token2id.get(word, 0), 0.0)) for word in premise]
-
-                hypothesis = hypothesis.split()
-                h_tfidf = dict(tfidf_model[dictionary.doc2bow(hypothesis)])
-                input_hypothesis = [(word, idf_model.get(dictionary.token2id.get(word, 0), 0.0),
-                                     h_tfidf.get(dictionary.token2id.get(word, 0), 0.0)) for word in hypothesis]
-                features.append(weighted_word_ngram_overlap(input_premise, input_hypothesis))
-            features = np.array(features)
-            pickle_dump(feat_file, features)
+            sent2row, tfidf_matrix, idfs, token2id = self.tfidf_index()
+            p_rows, h_rows = self.get_sent_rows(data_type, sent2row)
+
+            # (word, idf, tf-idf) of every word of every sentence, prepared once per unique sentence
+            sent_inputs = dict()
+            for row in np.unique(np.concatenate([p_rows, h_rows])):
+                words = self.tfidf_sents[row].split()
+                # out of vocabulary words are looked up as token 0
+                token_ids = np.array([token2id.get(word, 0) for word in words], dtype=np.int64)
+                row_ids = tfidf_matrix.indices[tfidf_matrix.indptr[row]:tfidf_matrix.indptr[row+1]]
+                row_tfidfs = tfidf_matrix.data[tfidf_matrix.indptr[row]:tfidf_matrix.indptr[row+1]]
+                pos = np.minimum(np.searchsorted(row_ids, token_ids), max(len(row_ids) - 1, 0))
+                tfidfs = np.where(row_ids[pos] == token_ids, row_tfidfs[pos], 0.0) if len(row_ids) else \
+                    np.zeros(len(words))
+                sent_inputs[row] = list(zip(words, idfs[token_ids].tolist(), tfidfs.tolist()))
+
+            features = np.array([weighted_word_ngram_overlap(sent_inputs[p_row], sent_inputs[h_row])
+                                 for p_row, h_row in zip(p_rows, h_rows)])
+            self.store.save(data_type, 'w_ngram_ol_tfidf', features)
         print('Logging Info - {} : w_ngram_ol_tfidf feature shape : {}'.format(data_type, features.shape))
         return features
 
     def add_word_power_feature(self, data_type):
-        feat_file = self.format_feature_file(data_type, 'word_power')
-        if os.path.exists(feat_file):
-            features = pickle_load(feat_file)
+        if self.store.exists(data_type, 'word_power'):
+            features = self.store.load(data_type, 'word_power')
         else:
-            power_word = self.get_power_word()
-            num_least = 100
-            features = list()
-            for premise, hypothesis in zip(self.get_data(data_type)['premise'], self.get_data(data_type)['hypothesis']):
-                premise = premise.split()
-                hypothesis = hypothesis.split()
-
-                rate = [1.0, 1.0]
-                share_words = list(set(premise).intersection(set(hypothesis)))
-                for word in share_words:
-                    if word not in power_word:
-                        continue
-                    if power_word[word][0] * power_word[word][5] < num_least:   # 共享词出现在双侧语句对数量要大于num_least
-                        continue
-                    rate[0] *= (1.0 - power_word[word][6])  # 共享词但是语句对不是正确的（label!=2）
-                p_diff = list(set(premise).difference(set(hypothesis)))
-                h_diff = list(set(premise).difference(set(hypothesis)))
-                all_diff = set(p_diff + h_diff)
-                for word in all_diff:
-                    if word not in power_word:
-                        continue
-                    if power_word[word][0] * power_word[word][3] < num_least:   # 共享词只出现在单侧语句数量要大于num_least
-                        continue
-                    rate[1] *= (1.0 - power_word[word][4])  # 非共享词但是语句对是正确的（label=2）
-                rate = [1 - num for num in rate]
-                features.append(rate)
-            features = np.array(features)
-            pickle_dump(feat_file, features)
+            word2idx, power_stats = self.get_power_word()
+            shared_factor, diff_factor = word_power_factors(power_stats)
+            p_words = self.word_incidence(self.get_data(data_type)['premise'], word2idx)
+            h_words = self.word_incidence(self.get_data(data_type)['hypothesis'], word2idx)
+            shared_words = p_words.multiply(h_words).tocsr()
+            diff_words = (p_words - shared_words).tocsr()
+            diff_words.eliminate_zeros()
+            features = np.stack([1 - self.row_prod(shared_words, shared_factor),
+                                 1 - self.row_prod(diff_words, diff_factor)], axis=-1)
+            self.store.save(data_type, 'word_power', features)
         print('Logging Info - {} : word_power feature shape : {}'.format(data_type, features.shape))
         return features
 
     def add_graph_feature(self, data_type):
-        feat_file = self.format_feature_file(data_type, 'word_power')
-        if os.path.exists(feat_file):
-            graph_features = pickle_load(feat_file)
+        if self.store.exists(data_type, 'graph'):
+            graph_features = self.store.load(data_type, 'graph')
         else:
-            sent2id, graph = self.generate_graph()
-
-            n2clique = {}
-            cliques = []
-            for clique in nx.find_cliques(graph):
-                for n in clique:
-                    if n not in n2clique:
-                        n2clique[n] = []
-                    n2clique[n].append(len(cliques))
-                cliques.append(clique)
-
-            n2cc = {}
-            ccs = []
-            for cc in nx.connected_components(graph):
-                for n in cc:
-                    n2cc[n] = len(ccs)
-                ccs.append(cc)
-
-            pagerank = nx.pagerank(graph, alpha=0.9, max_iter=100)
-
-            hits_h, hits_a = nx.hits(graph, max_iter=100)
-
-            indegree_features = list()
-            clique_features = list()
-            cc_features = list()
-            pagerank_features = list()
-            hits_features = list()
-            shortestpath_features = list()
-            # neighbor_features = list()
-            for premise, hypothesis in zip(self.get_data(data_type)['premise'], self.get_data(data_type)['hypothesis']):
-                p_id = sent2id[premise]
-                h_id = sent2id[hypothesis]
-
-                # graph in-degree fetures
-                indegree_features.append([graph.degree[p_id], graph.degree[h_id]])
-
-                # clique features
-                edge_max_clique_size = 0
-                num_clique = 0
-                for clique_id in n2clique[p_id]:
-                    if h_id in cliques[clique_id]:
-                        edge_max_clique_size = max(edge_max_clique_size, len(cliques[clique_id]))
-                        num_clique += 1
-                clique_features.append([edge_max_clique_size, num_clique])
-
-                lnode_max_clique_size = 0
-                rnode_max_clique_size = 0
-                for clique_id in n2clique[p_id]:
-                    lnode_max_clique_size = max(lnode_max_clique_size, len(cliques[clique_id]))
-
-                for clique_id in n2clique[h_id]:
-                    rnode_max_clique_size = max(rnode_max_clique_size, len(cliques[clique_id]))
-
-                clique_features[-1] += [lnode_max_clique_size, rnode_max_clique_size,
-                                        max(lnode_max_clique_size, rnode_max_clique_size),
-                                        min(lnode_max_clique_size, rnode_max_clique_size)]
-
-                # connected components features
-                cc_features.append([len(ccs[n2cc[p_id]])])
-
-                # page rank features
-                pr1 = pagerank[p_id] * 1e6
-                pr2 = pagerank[h_id] * 1e6
-                pagerank_features.append([pr1, pr2, max(pr1, pr2), min(pr1, pr2), (pr1 + pr2) / 2.])
-
-                # graph hits features
-                h1 = hits_h[p_id] * 1e6
-                h2 = hits_h[h_id] * 1e6
-                a1 = hits_a[p_id] * 1e6
-                a2 = hits_a[h_id] * 1e6
-                hits_features.append([h1, h2, a1, a2, max(h1, h2), max(a1, a2), min(h1, h2), min(a1, a2),
-                                      (h1 + h2) / 2., (a1 + a2) / 2.])
-
-                # graph shortest path features
-                shortest_path = -1
-                weight = graph[p_id][h_id]['weight']
-                graph.remove_edge(p_id, h_id)
-                if nx.has_path(graph, p_id, h_id):
-                    shortest_path = nx.dijkstra_path_length(graph, p_id, h_id)
-                graph.add_edge(p_id, h_id, weight=weight)
-                shortestpath_features.append([shortest_path])
-
-                # graph neighbour features
-                # l = []
-                # r = []
-                # l_nb = graph.neighbors(p_id)
-                # r_nb = graph.neighbors(h_id)
-                # for n in l_nb:
-                #     if (n != h_id) and (n != p_id):
-                #         l.append(graph[p_id][n]['weight'])
-                # for n in r_nb:
-                #     if (n != h_id) and (n != p_id):
-                #         r.append(graph[h_id][n]['weight'])
-                # if len(l) == 0 or len(r) == 0:
-                #     neighbor_features.append([0.0] * 11)
-                # else:
-                #     neighbor_features.append(l + r +
-                #                              [len(list((set(l_nb).union(set(r_nb))) ^ (set(l_nb) ^ set(r_nb))))])
-
-            graph_features = np.concatenate((np.array(indegree_features), np.array(clique_features),
-                                             np.array(cc_features), np.array(pagerank_features),
-                                             np.array(hits_features), np.array(shortestpath_features)), axis=-1)
-            pickle_dump(feat_file, graph_features)
+            sent2id, graph_stats = self.graph_features()
+            p_ids = [sent2id[premise] for premise in self.get_data(data_type)['premise']]
+            h_ids = [sent2id[hypothesis] for hypothesis in self.get_data(data_type)['hypothesis']]
+            graph_features = graph_stats.pair_features(p_ids, h_ids)
+            self.store.save(data_type, 'graph', graph_features)
         print('Logging Info - {} : graph feature shape : {}'.format(data_type, graph_features.shape))
         return graph_features
 
@@ -278,9 +252,8 @@ class Feature(object):
         to be duplicated.
         """
 
-        feat_file = self.format_feature_file(data_type, 'sent_fred')
-        if os.path.exists(feat_file):
-            features = pickle_load(feat_file)
+        if self.store.exists(data_type, 'sent_fred'):
+            features = self.store.load(data_type, 'sent_fred')
         else:
             sents_dict, p_vc, h_vc = self.get_sent_freq()
             data = pd.DataFrame(self.get_data(data_type))
@@ -294,20 +267,9 @@ class Feature(object):
             data['h_freq_sq'] = data['h_freq'] * data['h_freq']
 
             features = data[['p_freq', 'h_freq', 'freq_mean', 'freq_cross', 'p_freq_sq', 'h_freq_sq']].values
-            pickle_dump(feat_file, features)
+            self.store.save(data_type, 'sent_fred', features)
         return features
 
-    def format_feature_file(self, data_type, feat_type):
-        if data_type == 'train':
-            feat_file = format_filename(FEATURE_DIR, TRAIN_FEATURES_TEMPLATE, self.genre, feat_type)
-        elif data_type == 'dev' or data_type == 'valid':
-            feat_file = format_filename(FEATURE_DIR, DEV_FEATURES_TEMPLATE, self.genre, feat_type)
-        elif data_type == 'test':
-            feat_file = format_filename(FEATURE_DIR, TEST_FEATURES_TEMPLATE, self.genre, feat_type)
-        else:
-            raise ValueError('Data Type `{}` not understood'.format(data_type))
-        return feat_file
-
     def get_data(self, data_type):
         if data_type == 'train':
             return self.train_data
@@ -346,95 +308,185 @@ class Feature(object):
 
         return dictionary, tfidf_model
 
+    def tfidf_index(self):
+        """
+        tf-idf vectors of all the unique sentences as one csr matrix (same weights as the gensim tfidf model), built once
+        and shared by the tfidf features. Return sentence --> row index, tf-idf matrix, idf of every token id and
+        token --> token id.
+        """
+        if self._tfidf_index is None:
+            dictionary, tfidf_model = self.tfidf_model()
+            token2id = dictionary.token2id
+            idfs = np.zeros(max(len(dictionary), max(tfidf_model.idfs.keys(), default=-1) + 1))
+            idfs[list(tfidf_model.idfs.keys())] = list(tfidf_model.idfs.values())
+
+            sent2row = dict()
+            for data_type in ['train', 'dev', 'test']:
+                for sent in self.get_data(data_type)['premise'] + self.get_data(data_type)['hypothesis']:
+                    if sent not in sent2row:
+                        sent2row[sent] = len(sent2row)
+            self.tfidf_sents = list(sent2row.keys())
+
+            print('Logging Info - Build tf-idf matrix of {} sentences...'.format(len(sent2row)))
+            rows, token_ids = list(), list()
+            for row, sent in enumerate(self.tfidf_sents):
+                sent_ids = [token2id[word] for word in sent.split() if word in token2id]
+                rows.extend([row] * len(sent_ids))
+                token_ids.extend(sent_ids)
+            token_ids = np.array(token_ids, dtype=np.int64)
+            # duplicate entries are summed up into term counts
+            tfidf_matrix = sparse.csr_matrix((np.ones(len(token_ids)), (np.array(rows, dtype=np.int64), token_ids)),
+                                             shape=(len(sent2row), len(idfs)))
+            tfidf_matrix.sum_duplicates()
+            tfidf_matrix.data *= idfs[tfidf_matrix.indices]
+            tfidf_matrix.eliminate_zeros()
+            # l2 normalized rows, then tiny weights dropped, as gensim does
+            norms = np.sqrt(np.asarray(tfidf_matrix.multiply(tfidf_matrix).sum(axis=1)).ravel())
+            tfidf_matrix.data /= np.repeat(norms, np.diff(tfidf_matrix.indptr))
+            tfidf_matrix.data[np.abs(tfidf_matrix.data) <= tfidf_model.eps] = 0.0
+            tfidf_matrix.eliminate_zeros()
+            self._tfidf_index = (sent2row, tfidf_matrix, idfs, token2id)
+        return self._tfidf_index
+
+    def get_sent_rows(self, data_type, sent2row):
+        p_rows = np.array([sent2row[sent] for sent in self.get_data(data_type)['premise']], dtype=np.int64)
+        h_rows = np.array([sent2row[sent] for sent in self.get_data(data_type)['hypothesis']], dtype=np.int64)
+        return p_rows, h_rows
+
+    @staticmethod
+    def word_incidence(sents, word2idx):
+        """binary csr matrix of shape (len(sents), vocab), entry (i, j) is 1 when word j appears in sentence i"""
+        sent_words = [sent.split() for sent in sents]
+        word_ids = np.fromiter(map(word2idx.get, chain.from_iterable(sent_words), repeat(-1)), dtype=np.int64)
+        rows = np.repeat(np.arange(len(sents)), [len(words) for words in sent_words])
+        known = word_ids >= 0
+        incidence = sparse.csr_matrix((np.ones(known.sum()), (rows[known], word_ids[known])),
+                                      shape=(len(sents), len(word2idx)))
+        incidence.sum_duplicates()
+        incidence.data[:] = 1.
+        return incidence
+
+    @staticmethod
+    def row_prod(matrix, factors):
+        """product of `factors` over the column indices of every row of the csr `matrix`, 1.0 for empty rows"""
+        prods = np.ones(matrix.shape[0])
+        non_empty = np.diff(matrix.indptr) > 0
+        if non_empty.any():
+            prods[non_empty] = np.multiply.reduceat(factors[matrix.indices], matrix.indptr[:-1][non_empty])
+        return prods
+
     def get_power_word(self):
         """
-        计算数据中词语的影响力，格式如下：
-        词语 --> [0. 出现语句对数量，1. 出现语句对比例，2. 正确语句对比例，3. 单侧语句对比例，4. 单侧语句对正确比例，
-                 5. 双侧语句对比例，6. 双侧语句对正确比例]
+        计算数据中词语的影响力，返回 词语 --> 行号 以及 shape 为 (vocab, 7) 的统计量数组，每行为：
+        [0. 出现语句对数量，1. 出现语句对比例，2. 正确语句对比例，3. 单侧语句对比例，4. 单侧语句对正确比例，
+         5. 双侧语句对比例，6. 双侧语句对正确比例]
         """
         print('Logging Info - Get power word...')
-        words_power_path = os.path.join(FEATURE_DIR, '{}_power_word.pkl'.format(self.genre))
+        words_power_path = os.path.join(FEATURE_DIR, '{}_power_word.npz'.format(self.genre))
         if os.path.exists(words_power_path):
-            words_power = pickle_load(words_power_path)
+            with np.load(words_power_path) as words_power:
+                word2idx = {word: i for i, word in enumerate(words_power['words'].tolist())}
+                power_stats = words_power['stats']
+            print('Logging Info - Loaded:', words_power_path)
         else:
-            words_power = {}
-            x_a = [text.split() for text in
-                   self.train_data['premise'] + self.dev_data['premise'] + self.test_data['premise']]
-            x_b = [text.split() for text in
-                   self.train_data['hypothesis'] + self.dev_data['hypothesis'] + self.test_data['hypothesis']]
-            y = self.train_data['label'] + self.dev_data['label'] + self.test_data['label']
-            for i in range(len(x_a)):
-                label = y[i]
-                q1_words = x_a[i]
-                q2_words = x_b[i]
-                all_words = set(q1_words + q2_words)
-                q1_words = set(q1_words)
-                q2_words = set(q2_words)
-                for word in all_words:
-                    if word not in words_power:
-                        words_power[word] = [0. for _ in range(7)]
-                    words_power[word][0] += 1.  # 计算出现语句对的数量
-                    words_power[word][1] += 1.  # 计算出现语句对比例
-
-                    if ((word in q1_words) and (word not in q2_words)) or ((word not in q1_words) and (word in q2_words)):
-                        words_power[word][3] += 1.      # 计算单侧语句对比例
-                        if 0 == label:
-                            words_power[word][2] += 1.  # 计算正确语句对比例
-                            words_power[word][4] += 1.  # 计算单侧语句正确比例
-                    if (word in q1_words) and (word in q2_words):
-                        words_power[word][5] += 1.  # 计算双侧语句数量
-                        if 2 == label:
-                            words_power[word][2] += 1.  # 计算正确语句对比例
-                            words_power[word][6] += 1.  # 计算双侧语句正确比例
-
-            for word in words_power:
-                words_power[word][1] /= len(x_a)    # 计算出现语句对比例=出现语句对数量/总的语句对数量
-                words_power[word][2] /= words_power[word][0]    # 计算正确语句对比例=正确语句对数量/出现语句对数量
-                if words_power[word][3] > 1e-6:
-                    words_power[word][4] /= words_power[word][3]    # 计算单侧语句正确比例=单侧语句正确数量/出现单侧语句数量
-                words_power[word][3] /= words_power[word][0]    # 计算出现单侧语句对比例=出现单侧语句数量/出现语句对数量
-                if words_power[word][5] > 1e-6:
-                    words_power[word][6] /= words_power[word][5]    # 计算双侧语句正确比例=双侧语句正确数量/出现双侧语句数量
-                words_power[word][5] /= words_power[word][0]    # 计算出现双侧语句对比例=出现双侧语句数量/出现语句数量
-            del x_a, x_b, y
-            pickle_dump(words_power_path, words_power)
-
-        return words_power
+            premises = self.train_data['premise'] + self.dev_data['premise'] + self.test_data['premise']
+            hypothesis = self.train_data['hypothesis'] + self.dev_data['hypothesis'] + self.test_data['hypothesis']
+            y = np.array(self.train_data['label'] + self.dev_data['label'] + self.test_data['label'])
+
+            words = dict.fromkeys(chain.from_iterable(sent.split() for sent in premises + hypothesis))
+            word2idx = {word: i for i, word in enumerate(words)}
+
+            # pair x word incidence matrices
+            q1_words = self.word_incidence(premises, word2idx)
+            q2_words = self.word_incidence(hypothesis, word2idx)
+            both_words = q1_words.multiply(q2_words).tocsr()
+            all_words = q1_words + q2_words
+            all_words.data[:] = 1.
+            one_words = all_words - both_words
+
+            n_pair = np.asarray(all_words.sum(axis=0)).ravel()    # 出现语句对数量
+            n_one = np.asarray(one_words.sum(axis=0)).ravel()     # 单侧语句对数量
+            n_both = np.asarray(both_words.sum(axis=0)).ravel()   # 双侧语句对数量
+            n_one_right = one_words.T.dot((y == 0).astype(np.float64))     # 单侧语句正确数量
+            n_both_right = both_words.T.dot((y == 2).astype(np.float64))   # 双侧语句正确数量
+
+            power_stats = np.zeros((len(word2idx), 7))
+            power_stats[:, 0] = n_pair
+            power_stats[:, 1] = n_pair / len(premises)  # 出现语句对比例=出现语句对数量/总的语句对数量
+            power_stats[:, 2] = (n_one_right + n_both_right) / n_pair   # 正确语句对比例=正确语句对数量/出现语句对数量
+            power_stats[:, 3] = n_one / n_pair  # 出现单侧语句对比例=出现单侧语句数量/出现语句对数量
+            power_stats[:, 4] = np.where(n_one > 1e-6, n_one_right / np.maximum(n_one, 1e-6), n_one_right)
+            power_stats[:, 5] = n_both / n_pair     # 出现双侧语句对比例=出现双侧语句数量/出现语句数量
+            power_stats[:, 6] = np.where(n_both > 1e-6, n_both_right / np.maximum(n_both, 1e-6), n_both_right)
+
+            np.savez(words_power_path, words=np.array(list(word2idx.keys())), stats=power_stats)
+            print('Logging Info - Saved:', words_power_path)
+
+        return word2idx, power_stats
+
+    def graph_features(self):
+        """statistics of the sentence graph (see `utils.graph.GraphFeatures`), computed once and shared by all splits"""
+        if self._graph_features is None:
+            sent2id, adj = self.generate_graph()
+            print('Logging Info - Compute graph statistics...')
+            self._graph_features = (sent2id, GraphFeatures(adj))
+        return self._graph_features
 
     def generate_graph(self):
+        """
+        sentence graph: one node per unique sentence, one edge per pair, weighted by the rate of shared words
+        2 * (number of premise words appearing in hypothesis) / (total number of words). It's saved as an edge list.
+        """
         print('Logging Info - Get graph...')
         sent2id_path = os.path.join(FEATURE_DIR, '{}_graph_sent2id.pkl'.format(self.genre))
-        graph_path = os.path.join(FEATURE_DIR, '{}_graph.pkl'.format(self.genre))
+        graph_path = os.path.join(FEATURE_DIR, '{}_graph.npz'.format(self.genre))
         if os.path.exists(graph_path):
             sent2id = pickle_load(sent2id_path)
-            graph = pickle_load(graph_path)
+            adj = load_graph(graph_path)
         else:
-            sent2id = {}    # sentence to id
-            graph = nx.Graph()
+            premises, hypothesis = list(), list()
             for data_type in ['train', 'dev', 'test']:
-                for premise, hypothesis in zip(self.get_data(data_type)['premise'], self.get_data(data_type)['hypothesis']):
-                    if premise not in sent2id:
-                        sent2id[premise] = len(sent2id)
-                    if hypothesis not in sent2id:
-                        sent2id[hypothesis] = len(sent2id)
-                    p_id = sent2id[premise]
-                    h_id = sent2id[hypothesis]
-
-                    match = 0.0
-                    premise = premise.split()
-                    hypothesis = hypothesis.split()
-                    for w1 in premise:
-                        if w1 in hypothesis:
-                            match += 1
-
-                    if len(premise) + len(hypothesis) == 0:
-                        weight = 0.0
-                    else:
-                        weight = 2.0 * (match / (len(premise) + len(hypothesis)))
-                    graph.add_edge(p_id, h_id, weight=weight)
+                premises.extend(self.get_data(data_type)['premise'])
+                hypothesis.extend(self.get_data(data_type)['hypothesis'])
+
+            # sentence to id, in order of first appearance
+            sent2id = {sent: i for i, sent in enumerate(dict.fromkeys(
+                chain.from_iterable(zip(premises, hypothesis))))}
+            p_ids = np.array([sent2id[premise] for premise in premises], dtype=np.int64)
+            h_ids = np.array([sent2id[hypo] for hypo in hypothesis], dtype=np.int64)
+
+            # token ids of all the sentences, concatenated
+            sent_words = [sent.split() for sent in sent2id]
+            word2idx = {word: i for i, word in enumerate(dict.fromkeys(chain.from_iterable(sent_words)))}
+            sent_lens = np.array([len(words) for words in sent_words], dtype=np.int64)
+            sent_starts = np.concatenate([[0], np.cumsum(sent_lens)[:-1]])
+            word_ids = np.fromiter(map(word2idx.get, chain.from_iterable(sent_words)), dtype=np.int64,
+                                   count=int(sent_lens.sum()))
+
+            def pair_words(sent_ids):
+                """pair index & token id of every word of the given sentence of every pair"""
+                lens = sent_lens[sent_ids]
+                pair_idx = np.repeat(np.arange(len(sent_ids)), lens)
+                offsets = np.arange(len(pair_idx)) - np.repeat(np.cumsum(lens) - lens, lens)
+                return pair_idx, word_ids[np.repeat(sent_starts[sent_ids], lens) + offsets]
+
+            # a premise word is matched when it appears in the hypothesis of the same pair: look up (pair, word) keys
+            # of premise words among those of hypothesis words
+            p_pairs, p_words = pair_words(p_ids)
+            h_pairs, h_words = pair_words(h_ids)
+            p_keys = p_pairs * len(word2idx) + p_words
+            h_keys = np.sort(h_pairs * len(word2idx) + h_words)
+            pos = np.minimum(np.searchsorted(h_keys, p_keys), max(len(h_keys) - 1, 0))
+            matched = h_keys[pos] == p_keys if len(h_keys) else np.zeros(len(p_keys), dtype=bool)
+            match = np.bincount(p_pairs[matched], minlength=len(p_ids))
+
+            total_lens = sent_lens[p_ids] + sent_lens[h_ids]
+            weights = np.divide(2.0 * match, total_lens, out=np.zeros(len(p_ids)), where=total_lens > 0)
+
             pickle_dump(sent2id_path, sent2id)
-            pickle_dump(graph_path, graph)
-        return sent2id, graph
+            save_graph(graph_path, len(sent2id), p_ids, h_ids, weights)
+            adj = adjacency_matrix(len(sent2id), p_ids, h_ids, weights)
+        return sent2id, adj
 
     def get_sent_freq(self):
         print('Logging Info - Get sentence frequency...')
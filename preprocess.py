@@ -27,13 +27,15 @@ from config import SNLI_TRAIN_FILENAME, SNLI_DEV_FILENAME, SNLI_TEST_FILENAME, M
     MULTINLI_DEV_FILENAME, MLI_TRAIN_FILENAME, MLI_DEV_FILENAME, MLI_TEST_FILENAME, TRAIN_DATA_TEMPLATE, \
     DEV_DATA_TEMPLATE, TEST_DATA_TEMPLATE, TRAIN_IDS_MATRIX_TEMPLATE, DEV_IDS_MATRIX_TEMPLATE, \
     TEST_IDS_MATRIX_TEMPLATE, PROCESSED_DATA_DIR, LOG_DIR, MODEL_SAVED_DIR, EXTERNAL_WORD_VECTORS_FILENAME, \
-    EMBEDDING_MATRIX_TEMPLATE, TOKENIZER_TEMPLATE, VOCABULARY_TEMPLATE, ANALYSIS_LOG_TEMPLATE, IMG_DIR
+    EMBEDDING_MATRIX_TEMPLATE, TOKENIZER_TEMPLATE, VOCABULARY_TEMPLATE, ANALYSIS_LOG_TEMPLATE, IMG_DIR, \
+    MANIFEST_TEMPLATE
 from config import LABELS, GENRES
 from config import ProcessConfig
 from utils.data_loader import read_nli_data
 from utils.text import get_tokens_from_parse, clean_data, stem_data
 from utils.embedding import load_trained, train_w2v, train_glove, train_fasttext
 from utils.analysis import analyze_len_distribution, analyze_class_distribution
+from utils.length_policy import length_policy, save_manifest
 from utils.io import pickle_dump, write_log, format_filename
 
 
@@ -193,11 +195,20 @@ def main():
                                'char_vocab': len(char_tokenizer.word_index)})
 
         # length analysis
-        word_len_distribution, word_max_len = analyze_len_distribution(sentences_train, level='word')
+        word_len_distribution, word_len_hist = analyze_len_distribution(sentences_train, level='word')
         analyze_result.update(dict(('word_{}'.format(k), v) for k, v in word_len_distribution.items()))
-        char_len_distribution, char_max_len = analyze_len_distribution(sentences_train, level='char')
+        char_len_distribution, char_len_hist = analyze_len_distribution(sentences_train, level='char')
         analyze_result.update(dict(('char_{}'.format(k), v) for k, v in char_len_distribution.items()))
 
+        # padding length: cover `len_coverage` of train sentences instead of padding every batch to the longest one
+        manifest = {'genre': genre, 'padding': process_conf.padding, 'truncating': process_conf.truncating}
+        for level, len_hist, fixed_max_len in [('word', word_len_hist, process_conf.word_max_len),
+                                               ('char', char_len_hist, process_conf.char_max_len)]:
+            manifest[level] = length_policy(len_hist, len(genre_train_data['label']), process_conf.len_coverage,
+                                            max_len=fixed_max_len)
+        word_max_len, char_max_len = manifest['word']['max_len'], manifest['char']['max_len']
+        analyze_result.update({'word_max_len': word_max_len, 'char_max_len': char_max_len})
+
         train_word_ids = create_data_matrices(word_tokenizer, genre_train_data, process_conf.padding,
                                               process_conf.truncating, process_conf.n_class, word_max_len)
         train_char_ids = create_data_matrices(char_tokenizer, genre_train_data, process_conf.padding,
@@ -261,6 +272,9 @@ def main():
         # save analyze result
         analyze_result['timestamp'] = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
         write_log(format_filename(LOG_DIR, ANALYSIS_LOG_TEMPLATE, genre), analyze_result)
+        # the manifest tells `train_model` the max_len the id matrices are padded to
+        manifest['timestamp'] = analyze_result['timestamp']
+        save_manifest(format_filename(PROCESSED_DATA_DIR, MANIFEST_TEMPLATE, genre), manifest)
 
 
 if __name__ == '__main__':
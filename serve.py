@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+@author: alexyang
+
+@contact: alex.yang0326@gmail.com
+
+@file: serve.py
+
+@time: 2019/4/25 10:30
+
+@desc: local inference server: load a trained model once, and predict concurrent requests in dynamic micro-batches
+
+"""
+
+from config import PROCESSED_DATA_DIR, TOKENIZER_TEMPLATE, MANIFEST_TEMPLATE, LABELS, ProcessConfig
+from train import get_model_config, get_model
+from utils.io import format_filename, pickle_load
+from utils.length_policy import load_manifest
+from utils.serving import DynamicBatcher, make_server
+
+
+class KerasNLIPredictor(object):
+    """
+    A model trained by `train.train_model` (built with the same arguments), with the tokenizer and padding settings of
+    its processed data, predicting raw (tokenized) sentences with `KerasBaseModel.predict`.
+    """
+    def __init__(self, genre, input_level, word_embed_type, word_embed_trainable, batch_size, learning_rate,
+                 optimizer_type, model_name, n_epoch=50, add_features=False, scale_features=False,
+                 callbacks_to_add=None, swa_type=None, **kwargs):
+        input_config = kwargs.get('input_config', 'token')
+        if input_config != 'token':
+            raise ValueError('Only models with token input can be served, input_config Not Understood: {}'.format(
+                input_config))
+        # keras is imported here, serving an exported `FrozenNLIModel` doesn't need it
+        from keras import backend as K
+
+        K.set_learning_phase(0)
+        self.config = get_model_config(genre, input_level, word_embed_type, word_embed_trainable, batch_size,
+                                       learning_rate, optimizer_type, model_name, n_epoch, add_features,
+                                       scale_features, callbacks_to_add, **kwargs)
+        self.model = get_model(model_name, self.config, **kwargs)
+        if swa_type is not None:
+            self.model.load_swa_model(swa_type)
+        else:
+            self.model.load_best_model()
+        # build the predict function now: it is then called from the batcher thread, in the graph it was built in
+        self.model.model._make_predict_function()
+        self.graph = K.get_session().graph
+
+        self.tokenizer = pickle_load(format_filename(PROCESSED_DATA_DIR, TOKENIZER_TEMPLATE, genre, input_level))
+        manifest = load_manifest(format_filename(PROCESSED_DATA_DIR, MANIFEST_TEMPLATE, genre)) or dict()
+        process_conf = ProcessConfig()
+        self.padding = manifest.get('padding', process_conf.padding)
+        self.truncating = manifest.get('truncating', process_conf.truncating)
+        self.labels = [label for label, _ in sorted(LABELS.items(), key=lambda x: x[1])]
+
+    def texts_to_matrix(self, texts):
+        from keras.preprocessing.sequence import pad_sequences
+
+        return pad_sequences(self.tokenizer.texts_to_sequences(texts), maxlen=self.config.max_len,
+                             padding=self.padding, truncating=self.truncating)
+
+    def predict(self, premises, hypotheses, features=None):
+        x = [self.texts_to_matrix(premises), self.texts_to_matrix(hypotheses)]
+        if self.config.add_features:
+            if features is None:
+                raise ValueError('Model {} needs statistical features as input'.format(self.config.exp_name))
+            x.append(features)
+        with self.graph.as_default():
+            return self.model.predict(x)
+
+
+def serve(predictor, feature_extractor=None, max_batch_size=64, max_latency=0.01, host='127.0.0.1', port=8080,
+          unix_socket=None):
+    """
+    serve `predictor` (`KerasNLIPredictor`, or `utils.inference.FrozenNLIModel` for an exported model) until
+    interrupted.
+    :param feature_extractor: `utils.feature_extractor.FeatureExtractor` computing the features of a pair online,
+                              required by models trained with features (scaled the same way)
+    :param max_latency: latency budget of batching, in seconds: the longest a request waits for its batch to fill
+    """
+    batcher = DynamicBatcher(predictor.predict, max_batch_size, max_latency).start()
+    server = make_server(batcher, predictor.labels, feature_extractor.transform if feature_extractor else None,
+                         host, port, unix_socket)
+    print('Logging Info - Serving on {}, max_batch_size: {}, max_latency: {}ms'.format(
+        unix_socket or '{}:{}'.format(host, port), max_batch_size, max_latency * 1000))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.stop()
+        print('Logging Info - Serving metrics:', batcher.metrics.report())
+
+
+if __name__ == '__main__':
+    serve(KerasNLIPredictor('mednli', 'word', 'glove_cc', False, 32, 0.001, 'adam', 'KerasEsim'))
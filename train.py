@@ -17,32 +17,35 @@
 import os
 import time
 import re
+import importlib
 import numpy as np
 from itertools import product
-from keras import optimizers
-
-from models.keras_infersent_model import KerasInfersentModel
-from models.keras_esim_model import KerasEsimModel
-from models.keras_decomposable_model import KerasDecomposableAttentionModel
-from models.keras_siamese_bilstm_model import KerasSimaeseBiLSTMModel
-from models.keras_siamese_cnn_model import KerasSiameseCNNModel
-from models.keras_iacnn_model import KerasIACNNModel
-from models.tfhub_bert_model import TFHubBertModel
-from models.keras_siamese_lstmcnn_model import KerasSiameseLSTMCNNModel
-from models.keras_refined_ssa_model import KerasRefinedSSAModel
 
 from config import ModelConfig, PERFORMANCE_LOG, LOG_DIR, PROCESSED_DATA_DIR, EMBEDDING_MATRIX_TEMPLATE, \
-    VOCABULARY_TEMPLATE, EXTERNAL_WORD_VECTORS_FILENAME
+    VOCABULARY_TEMPLATE, EXTERNAL_WORD_VECTORS_FILENAME, MANIFEST_TEMPLATE
 from utils.data_loader import load_input_data
 from utils.io import write_log, format_filename, pickle_load
-from utils.cache import ELMoCache
-from utils.data_generator import ELMoGenerator
 from utils.metrics import eval_acc
+from utils.length_policy import load_manifest
 
 os.environ['CUDA_VISIBLE_DEVICES'] = '2'
 
+# model name --> (module, class), a model module is only imported when the model is used
+MODELS = {
+    'KerasInfersent': ('models.keras_infersent_model', 'KerasInfersentModel'),
+    'KerasEsim': ('models.keras_esim_model', 'KerasEsimModel'),
+    'KerasDecomposable': ('models.keras_decomposable_model', 'KerasDecomposableAttentionModel'),
+    'KerasSiameseBiLSTM': ('models.keras_siamese_bilstm_model', 'KerasSimaeseBiLSTMModel'),
+    'KerasSiameseCNN': ('models.keras_siamese_cnn_model', 'KerasSiameseCNNModel'),
+    'KerasIACNN': ('models.keras_iacnn_model', 'KerasIACNNModel'),
+    'KerasSiameseLSTMCNNModel': ('models.keras_siamese_lstmcnn_model', 'KerasSiameseLSTMCNNModel'),
+    'KerasRefinedSSAModel': ('models.keras_refined_ssa_model', 'KerasRefinedSSAModel')
+}
+
 
 def get_optimizer(op_type, learning_rate):
+    from keras import optimizers    # keras (and tensorflow) is only loaded once a model is configured
+
     if op_type == 'sgd':
         return optimizers.SGD(learning_rate)
     elif op_type == 'rmsprop':
@@ -57,13 +60,23 @@ def get_optimizer(op_type, learning_rate):
         raise ValueError('Optimizer Not Understood: {}'.format(op_type))
 
 
-def train_model(genre, input_level, word_embed_type, word_embed_trainable, batch_size, learning_rate,
-                optimizer_type, model_name, n_epoch=50, add_features=False, scale_features=False, overwrite=False,
-                lr_range_test=False, callbacks_to_add=None, eval_on_train=False, **kwargs):
+def get_max_len(config, genre, input_level):
+    manifest = load_manifest(format_filename(PROCESSED_DATA_DIR, MANIFEST_TEMPLATE, genre))
+    if manifest is not None:
+        # id matrices are padded to the max_len chosen by the length policy in preprocess.py
+        return manifest[input_level]['max_len']
+    print('Logging Warning - No manifest for genre {}, use default max_len'.format(genre))
+    return config.word_max_len[genre] if input_level == 'word' else config.char_max_len[genre]
+
+
+def get_model_config(genre, input_level, word_embed_type, word_embed_trainable, batch_size, learning_rate,
+                     optimizer_type, model_name, n_epoch=50, add_features=False, scale_features=False,
+                     callbacks_to_add=None, **kwargs):
+    """configuration (and experiment name) of a model, shared by training and exporting"""
     config = ModelConfig()
     config.genre = genre
     config.input_level = input_level
-    config.max_len = config.word_max_len[genre] if input_level == 'word' else config.char_max_len[genre]
+    config.max_len = get_max_len(config, genre, input_level)
     config.word_embed_type = word_embed_type
     config.word_embed_trainable = word_embed_trainable
     config.callbacks_to_add = callbacks_to_add or []
@@ -88,9 +101,29 @@ def train_model(genre, input_level, word_embed_type, word_embed_trainable, batch
         callback_str = '_' + '_'.join(config.callbacks_to_add)
         callback_str = callback_str.replace('_modelcheckpoint', '').replace('_earlystopping', '')
         config.exp_name += callback_str
+    return config
+
+
+def get_model(model_name, config, **kwargs):
+    if model_name not in MODELS:
+        raise ValueError('Model Name Not Understood : {}'.format(model_name))
+    module_name, class_name = MODELS[model_name]
+    return getattr(importlib.import_module(module_name), class_name)(config, **kwargs)
+
+
+def train_model(genre, input_level, word_embed_type, word_embed_trainable, batch_size, learning_rate,
+                optimizer_type, model_name, n_epoch=50, add_features=False, scale_features=False, overwrite=False,
+                lr_range_test=False, callbacks_to_add=None, eval_on_train=False, **kwargs):
+    config = get_model_config(genre, input_level, word_embed_type, word_embed_trainable, batch_size, learning_rate,
+                              optimizer_type, model_name, n_epoch, add_features, scale_features, callbacks_to_add,
+                              **kwargs)
 
     input_config = kwargs['input_config'] if 'input_config' in kwargs else 'token'  # input default is word embedding
     if input_config in ['cache_elmo', 'token_combine_cache_elmo']:
+        # elmo backends (allennlp, lmdb) are only imported for elmo inputs
+        from utils.cache import ELMoCache
+        from utils.data_generator import ELMoGenerator
+
         # get elmo embedding based on cache, we first get a ELMoCache instance
         if 'elmo_model_type' in kwargs:
             elmo_model_type = kwargs['elmo_model_type']
@@ -115,24 +148,7 @@ def train_model(genre, input_level, word_embed_type, word_embed_trainable, batch
                  'learning_rate': learning_rate, 'other_params': kwargs}
 
     print('Logging Info - Experiment: %s' % config.exp_name)
-    if model_name == 'KerasInfersent':
-        model = KerasInfersentModel(config, **kwargs)
-    elif model_name == 'KerasEsim':
-        model = KerasEsimModel(config, **kwargs)
-    elif model_name == 'KerasDecomposable':
-        model = KerasDecomposableAttentionModel(config, **kwargs)
-    elif model_name == 'KerasSiameseBiLSTM':
-        model = KerasSimaeseBiLSTMModel(config, **kwargs)
-    elif model_name == 'KerasSiameseCNN':
-        model = KerasSiameseCNNModel(config, **kwargs)
-    elif model_name == 'KerasIACNN':
-        model = KerasIACNNModel(config, **kwargs)
-    elif model_name == 'KerasSiameseLSTMCNNModel':
-        model = KerasSiameseLSTMCNNModel(config, **kwargs)
-    elif model_name == 'KerasRefinedSSAModel':
-        model = KerasRefinedSSAModel(config, **kwargs)
-    else:
-        raise ValueError('Model Name Not Understood : {}'.format(model_name))
+    model = get_model(model_name, config, **kwargs)
     # model.summary()
 
     train_input, dev_input, test_input = None, None, None
@@ -255,9 +271,13 @@ def train_model(genre, input_level, word_embed_type, word_embed_trainable, batch
 
 
 def train_bert(genre, input_level, batch_size):
+    from models.tfhub_bert_model import TFHubBertModel
+
     config = ModelConfig()
     config.genre = genre
     config.input_level = input_level
+    # bert's max_len bounds the wordpiece length of a packed pair (with [CLS] & [SEP]), not the sentence length
+    # chosen by the length policy, so keep the fixed lengths here
     config.max_len = config.word_max_len[genre] if input_level == 'word' else config.char_max_len[genre]
     config.batch_size = batch_size
 
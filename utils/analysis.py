@@ -15,31 +15,113 @@
 """
 
 from collections import Counter
+from itertools import islice
 import numpy as np
 
 
-def analyze_len_distribution(sentences, level):
+def text_lengths(sentences, level):
+    """length of every sentence at word or char level, lazily, so `sentences` can be streamed"""
     if level == 'word':
-        text_len = [len(sentence.split()) for sentence in sentences]
+        return (len(sentence.split()) for sentence in sentences)
     elif level == 'char':
-        text_len = [len(list(sentence)) for sentence in sentences]
+        return (len(sentence) for sentence in sentences)
     else:
         raise ValueError('Level Not Understood: {}'.format(level))
 
+
+class LengthHistogram(object):
+    """
+    Histogram of text lengths. It's filled batch by batch, so the lengths of a corpus can be streamed instead of held
+    in memory, and every statistic (min / max / mean, percentiles, coverage ratio of any length) is then read from the
+    counts and their cumulative sum in O(max length).
+    """
+    def __init__(self, lengths=None):
+        self.counts = np.zeros(0, dtype=np.int64)   # number of texts of every length
+        self.total_len = 0
+        if lengths is not None:
+            self.update(lengths)
+
+    def update(self, lengths):
+        lengths = np.asarray(lengths, dtype=np.int64)
+        if lengths.size == 0:
+            return self
+        counts = np.bincount(lengths)
+        if len(counts) > len(self.counts):
+            self.counts = np.concatenate([self.counts, np.zeros(len(counts) - len(self.counts), dtype=np.int64)])
+        self.counts[:len(counts)] += counts
+        self.total_len += int(lengths.sum())
+        return self
+
+    @property
+    def n_texts(self):
+        return int(self.counts.sum())
+
+    @property
+    def min_len(self):
+        return int(np.flatnonzero(self.counts)[0])
+
+    @property
+    def max_len(self):
+        return int(np.flatnonzero(self.counts)[-1])
+
+    @property
+    def avg_len(self):
+        return self.total_len / self.n_texts
+
+    def coverage(self):
+        """coverage[l]: ratio of texts whose length is less than or equal to l"""
+        return np.cumsum(self.counts) / self.n_texts
+
+    def kth_len(self, k):
+        """length of the k-th (0-based) shortest text"""
+        return int(np.searchsorted(np.cumsum(self.counts), k, side='right'))
+
+    def percentile(self, q):
+        """q-th percentile of lengths, linearly interpolated as `np.percentile`"""
+        rank = q / 100 * (self.n_texts - 1)
+        lower, upper = self.kth_len(int(np.floor(rank))), self.kth_len(int(np.ceil(rank)))
+        return lower + (upper - lower) * (rank - np.floor(rank))
+
+    @property
+    def median_len(self):
+        return (self.kth_len((self.n_texts - 1) // 2) + self.kth_len(self.n_texts // 2)) / 2
+
+    def min_len_for_coverage(self, coverage):
+        """smallest length that covers at least `coverage` of the texts"""
+        return int(np.argmax(self.coverage() >= coverage))
+
+
+def length_histogram(sentences, level, batch_size=100000):
+    """
+    :param sentences: iterable of sentences, read `batch_size` at a time, a generator over a corpus that does not fit
+                      in memory works too
+    """
+    len_hist = LengthHistogram()
+    lengths = text_lengths(sentences, level)
+    batch = np.fromiter(islice(lengths, batch_size), dtype=np.int64)
+    while batch.size > 0:
+        len_hist.update(batch)
+        batch = np.fromiter(islice(lengths, batch_size), dtype=np.int64)
+    return len_hist
+
+
+def analyze_len_distribution(sentences, level, batch_size=100000):
+    """length statistics of sentences, and their `LengthHistogram` to be reused (e.g. by the length policy)"""
+    len_hist = length_histogram(sentences, level, batch_size)
     len_dist = dict()
 
-    max_len = np.max(text_len)
-    min_len = np.min(text_len)
-    avg_len = np.average(text_len)
-    median_len = np.median(text_len)
+    max_len = len_hist.max_len
+    min_len = len_hist.min_len
+    avg_len = len_hist.avg_len
+    median_len = len_hist.median_len
     print('Logging Info - max len: %d, min_len: %d, avg_len: %2f, median_len: %2f' % (max_len, min_len, avg_len,
                                                                                       median_len))
     len_dist.update({'max len:': max_len, 'min_len': min_len, 'avg len': avg_len, 'median len': median_len})
 
+    coverage = len_hist.coverage()
     _start_log_ratio = 0.95
     for i in range(int(median_len), int(max_len), 2):
-        less = list(filter(lambda x: x <= i, text_len))
-        ratio = len(less) / len(text_len)
+        ratio = float(coverage[i])
         print('Logging Info - len: %d, ratio: %2f' % (i, ratio))
 
         if ratio >= _start_log_ratio:
@@ -47,7 +129,7 @@ def analyze_len_distribution(sentences, level):
             _start_log_ratio += 0.01
         if ratio >= 0.99:
             break
-    return len_dist, max_len
+    return len_dist, len_hist
 
 
 def analyze_class_distribution(labels):
@@ -312,6 +312,92 @@ def _get_batch(generator, batch_size, num_steps, max_word_length):
 
         yield X
 
+
+def _get_batch_packed(generator, batch_size, num_steps, max_word_length,
+                      buffer_steps=16):
+    """Read batches of input from packed streams.
+
+    Same batches as `_get_batch`, but each of the `batch_size` streams is
+    packed into one row of a flat int32 buffer as sentences are pulled from
+    the generator, so every sentence is copied exactly once and each batch is
+    a `[:, start:start + num_steps]` strided view into the buffers.
+
+    Sentences are pulled lazily in the same order as `_get_batch` (row by
+    row, only when a row runs out of tokens), so the assignment of sentences
+    to rows, and therefore every yielded batch, is identical.
+
+    NOTE: the yielded arrays are views.  They stay valid until the next
+    batch is requested; copy them if they need to be kept around longer.
+    """
+    capacity = max(num_steps * buffer_steps, num_steps)
+
+    def _alloc(n):
+        token_buf = np.zeros([batch_size, n], np.int32)
+        target_buf = np.zeros([batch_size, n], np.int32)
+        if max_word_length is not None:
+            char_buf = np.zeros([batch_size, n, max_word_length], np.int32)
+        else:
+            char_buf = None
+        return token_buf, target_buf, char_buf
+
+    inputs, targets, char_inputs = _alloc(capacity)
+    # end of the packed tokens in each row
+    fill = [0] * batch_size
+    start = 0
+
+    while True:
+        end = start + num_steps
+        if end > capacity:
+            # move the unread tail of every row to the front of the buffer
+            inputs[:, :capacity - start] = inputs[:, start:]
+            targets[:, :capacity - start] = targets[:, start:]
+            if max_word_length is not None:
+                char_inputs[:, :capacity - start] = char_inputs[:, start:]
+            fill = [f - start for f in fill]
+            start, end = 0, num_steps
+
+        for i in range(batch_size):
+            while fill[i] < end:
+                try:
+                    token_ids, char_ids = next(generator)
+                except StopIteration:
+                    # No more data.  Note: this will not return data
+                    # for the incomplete batch
+                    return
+
+                how_many = len(token_ids) - 1
+                if how_many <= 0:
+                    continue
+
+                next_fill = fill[i] + how_many
+                if next_fill > capacity:
+                    # a very long sentence, grow the buffers to hold it
+                    capacity = max(2 * capacity, next_fill)
+                    new_inputs, new_targets, new_char_inputs = \
+                        _alloc(capacity)
+                    new_inputs[:, :inputs.shape[1]] = inputs
+                    new_targets[:, :targets.shape[1]] = targets
+                    if max_word_length is not None:
+                        new_char_inputs[:, :char_inputs.shape[1]] = \
+                            char_inputs
+                    inputs, targets, char_inputs = \
+                        new_inputs, new_targets, new_char_inputs
+
+                inputs[i, fill[i]:next_fill] = token_ids[:how_many]
+                targets[i, fill[i]:next_fill] = token_ids[1:]
+                if max_word_length is not None:
+                    char_inputs[i, fill[i]:next_fill] = char_ids[:how_many]
+                fill[i] = next_fill
+
+        X = {'token_ids': inputs[:, start:end],
+             'tokens_characters': char_inputs[:, start:end]
+             if max_word_length is not None else None,
+             'next_token_id': targets[:, start:end]}
+        start = end
+
+        yield X
+
+
 class LMDataset(object):
     """
     Hold a language model dataset.
@@ -420,8 +506,8 @@ class LMDataset(object):
             return None
 
     def iter_batches(self, batch_size, num_steps):
-        for X in _get_batch(self.get_sentence(), batch_size, num_steps,
-                           self.max_word_length):
+        for X in _get_batch_packed(self.get_sentence(), batch_size,
+                                   num_steps, self.max_word_length):
 
             # token_ids = (batch_size, num_steps)
             # char_inputs = (batch_size, num_steps, 50) of character ids
@@ -448,10 +534,10 @@ class BidirectionalLMDataset(object):
         max_word_length = self._data_forward.max_word_length
 
         for X, Xr in zip(
-            _get_batch(self._data_forward.get_sentence(), batch_size,
-                      num_steps, max_word_length),
-            _get_batch(self._data_reverse.get_sentence(), batch_size,
-                      num_steps, max_word_length)
+            _get_batch_packed(self._data_forward.get_sentence(), batch_size,
+                              num_steps, max_word_length),
+            _get_batch_packed(self._data_reverse.get_sentence(), batch_size,
+                              num_steps, max_word_length)
             ):
 
             for k, v in Xr.items():
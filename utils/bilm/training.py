@@ -6,6 +6,7 @@ import os
 import time
 import json
 import re
+import itertools
 
 import tensorflow as tf
 import numpy as np
@@ -37,6 +38,12 @@ class LanguageModel(object):
     is_training is a boolean used to control behavior of dropout layers
         and softmax.  Set to False for testing.
 
+    inputs is an optional dict of input tensors (e.g. from a tf.data
+        iterator) keyed like the batches of `LMDataset.iter_batches`.
+        When given, the model reads its token ids / characters and targets
+        from them; the usual input names can still be fed through
+        feed_dict to override the pipeline.
+
     The LSTM cell is controlled by the 'lstm' key in options
     Here is an example:
 
@@ -52,9 +59,10 @@ class LanguageModel(object):
         'dim' is the hidden state size.
         Set 'dim' == 'projection_dim' to skip a projection layer.
     '''
-    def __init__(self, options, is_training):
+    def __init__(self, options, is_training, inputs=None):
         self.options = options
         self.is_training = is_training
+        self.inputs = inputs
         self.bidirectional = options.get('bidirectional', False)
 
         # use word or char inputs?
@@ -71,6 +79,13 @@ class LanguageModel(object):
 
         self._build()
 
+    def _get_input(self, name, shape):
+        # placeholder for feed_dict, defaulting to the pipeline tensor if any
+        if self.inputs is not None and name in self.inputs:
+            return tf.placeholder_with_default(self.inputs[name],
+                                               shape=shape, name=name)
+        return tf.placeholder(DTYPE_INT, shape=shape, name=name)
+
     def _build_word_embeddings(self):
         n_tokens_vocab = self.options['n_tokens_vocab']
         batch_size = self.options['batch_size']
@@ -80,9 +95,8 @@ class LanguageModel(object):
         projection_dim = self.options['lstm']['projection_dim']
 
         # the input token_ids and word embeddings
-        self.token_ids = tf.placeholder(DTYPE_INT,
-                               shape=(batch_size, unroll_steps),
-                               name='token_ids')
+        self.token_ids = self._get_input('token_ids',
+                               shape=(batch_size, unroll_steps))
         # the word embeddings
         with tf.device("/cpu:0"):
             self.embedding_weights = tf.get_variable(
@@ -95,9 +109,8 @@ class LanguageModel(object):
         # if a bidirectional LM then make placeholders for reverse
         # model and embeddings
         if self.bidirectional:
-            self.token_ids_reverse = tf.placeholder(DTYPE_INT,
-                               shape=(batch_size, unroll_steps),
-                               name='token_ids_reverse')
+            self.token_ids_reverse = self._get_input('token_ids_reverse',
+                               shape=(batch_size, unroll_steps))
             with tf.device("/cpu:0"):
                 self.embedding_reverse = tf.nn.embedding_lookup(
                     self.embedding_weights, self.token_ids_reverse)
@@ -150,9 +163,8 @@ class LanguageModel(object):
             activation = tf.nn.relu
 
         # the input character ids 
-        self.tokens_characters = tf.placeholder(DTYPE_INT,
-                                   shape=(batch_size, unroll_steps, max_chars),
-                                   name='tokens_characters')
+        self.tokens_characters = self._get_input('tokens_characters',
+                                   shape=(batch_size, unroll_steps, max_chars))
         # the character embeddings
         with tf.device("/cpu:0"):
             self.embedding_weights = tf.get_variable(
@@ -165,9 +177,9 @@ class LanguageModel(object):
                                                     self.tokens_characters)
 
             if self.bidirectional:
-                self.tokens_characters_reverse = tf.placeholder(DTYPE_INT,
-                                   shape=(batch_size, unroll_steps, max_chars),
-                                   name='tokens_characters_reverse')
+                self.tokens_characters_reverse = self._get_input(
+                                   'tokens_characters_reverse',
+                                   shape=(batch_size, unroll_steps, max_chars))
                 self.char_embedding_reverse = tf.nn.embedding_lookup(
                     self.embedding_weights, self.tokens_characters_reverse)
 
@@ -445,9 +457,8 @@ class LanguageModel(object):
         # DEFINE next_token_id and *_reverse placeholders for the gold input
         def _get_next_token_placeholders(suffix):
             name = 'next_token_id' + suffix
-            id_placeholder = tf.placeholder(DTYPE_INT,
-                                   shape=(batch_size, unroll_steps),
-                                   name=name)
+            id_placeholder = self._get_input(name,
+                                   shape=(batch_size, unroll_steps))
             return id_placeholder
 
         # get the window and weight placeholders
@@ -672,14 +683,107 @@ def _get_feed_dict_from_X(X, start, end, model, char_inputs, bidirectional):
     return feed_dict
 
 
-def train(options, data, n_gpus, tf_save_dir, tf_log_dir,
-          restart_ckpt_file=None):
+def _get_input_names(char_inputs, bidirectional):
+    # names of the batch entries consumed by the model
+    names = ['tokens_characters' if char_inputs else 'token_ids',
+             'next_token_id']
+    if bidirectional:
+        names += [name + '_reverse' for name in names]
+    return names
 
-    # not restarting so save the options
-    if restart_ckpt_file is None:
-        with open(os.path.join(tf_save_dir, 'options.json'), 'w') as fout:
-            fout.write(json.dumps(options))
 
+def _get_dataset_inputs(options, data, n_gpus):
+    '''
+    Build a tf.data input pipeline over `data.iter_batches` and return
+    one dict of input tensors per tower, to be passed to LanguageModel.
+
+    Batches are converted to tensors on a background thread, cast to
+    DTYPE_INT with a parallel map and prefetched, so the host-to-device
+    copies overlap with the training step.
+    '''
+    batch_size = options['batch_size']
+    unroll_steps = options['unroll_steps']
+    bidirectional = options.get('bidirectional', False)
+    char_inputs = 'char_cnn' in options
+    names = _get_input_names(char_inputs, bidirectional)
+
+    output_types, output_shapes = {}, {}
+    for name in names:
+        output_types[name] = tf.int32
+        if name.startswith('tokens_characters'):
+            max_chars = options['char_cnn']['max_characters_per_token']
+            output_shapes[name] = tf.TensorShape(
+                [batch_size * n_gpus, unroll_steps, max_chars])
+        else:
+            output_shapes[name] = tf.TensorShape(
+                [batch_size * n_gpus, unroll_steps])
+
+    def _generator():
+        for X in data.iter_batches(batch_size * n_gpus, unroll_steps):
+            yield {name: X[name] for name in names}
+
+    def _cast(X):
+        return {name: tf.cast(v, DTYPE_INT) for name, v in X.items()}
+
+    dataset = tf.data.Dataset.from_generator(_generator, output_types,
+                                             output_shapes)
+    dataset = dataset.map(
+        _cast, num_parallel_calls=options.get('n_input_threads', 4))
+    dataset = dataset.prefetch(options.get('n_prefetch_batches', 4))
+    X = dataset.make_one_shot_iterator().get_next()
+
+    # slice the batch for each tower
+    tower_inputs = []
+    for k in range(n_gpus):
+        start = k * batch_size
+        end = (k + 1) * batch_size
+        tower_inputs.append({name: X[name][start:end] for name in names})
+    return tower_inputs
+
+
+def _get_tower_device(options, k):
+    # towers go on the GPUs unless the CPU data-parallel mode is on
+    if 'cpu_towers' in options:
+        return '/cpu:%d' % k
+    return '/gpu:%d' % k
+
+
+def _get_session_config(options, n_towers):
+    '''
+    Session config for training.
+
+    When options contains 'cpu_towers', e.g.
+
+     'cpu_towers': {
+      'intra_op_threads': 8,
+      'inter_op_threads': 2},
+
+    the session exposes one CPU device per tower ('/cpu:0' ... '/cpu:N-1')
+    and sizes the thread pools to the per-tower parallelism times the number
+    of towers.  Omitted values split os.cpu_count() evenly across towers.
+    '''
+    config = tf.ConfigProto(allow_soft_placement=True)
+    if 'cpu_towers' in options:
+        cpu_options = options['cpu_towers']
+        n_cores_per_tower = max((os.cpu_count() or 1) // n_towers, 1)
+        intra_op_threads = cpu_options.get('intra_op_threads',
+                                           n_cores_per_tower)
+        inter_op_threads = cpu_options.get('inter_op_threads', 2)
+        config.device_count['CPU'] = n_towers
+        config.intra_op_parallelism_threads = intra_op_threads * n_towers
+        config.inter_op_parallelism_threads = inter_op_threads * n_towers
+    return config
+
+
+def _build_train_graph(options, n_gpus, tower_inputs=None):
+    '''
+    Build the towers, the averaged and clipped gradients and the summaries.
+    Returns a dict of the ops and tensors used by the training loop.
+
+    There is one tower per GPU, or one per CPU device when options
+    contains 'cpu_towers' (see `_get_session_config`); in both cases
+    n_gpus is the number of towers.
+    '''
     with tf.device('/cpu:0'):
         global_step = tf.get_variable(
             'global_step', [],
@@ -698,11 +802,12 @@ def train(options, data, n_gpus, tf_save_dir, tf_log_dir,
             initializer=tf.constant_initializer(0.0), trainable=False)
         norm_summaries = []
         for k in range(n_gpus):
-            with tf.device('/gpu:%d' % k):
+            with tf.device(_get_tower_device(options, k)):
                 with tf.variable_scope('lm', reuse=k > 0):
                     # calculate the loss for one model replica and get
                     #   lstm states
-                    model = LanguageModel(options, True)
+                    inputs = tower_inputs[k] if tower_inputs else None
+                    model = LanguageModel(options, True, inputs=inputs)
                     loss = model.total_loss
                     models.append(model)
                     # get gradients
@@ -760,11 +865,115 @@ def train(options, data, n_gpus, tf_save_dir, tf_log_dir,
 
         init = tf.initialize_all_variables()
 
-    # do the training loop
+    return {'models': models, 'train_op': train_op, 'summary_op': summary_op,
+            'hist_summary_op': hist_summary_op,
+            'train_perplexity': train_perplexity, 'global_step': global_step,
+            'saver': saver, 'init': init}
+
+
+def _get_zero_feed_dict(models, options):
+    # zero inputs used to compute the initial lstm states
+    batch_size = options['batch_size']
+    unroll_steps = options['unroll_steps']
+    bidirectional = options.get('bidirectional', False)
+    char_inputs = 'char_cnn' in options
+    if char_inputs:
+        max_chars = options['char_cnn']['max_characters_per_token']
+
+    if not char_inputs:
+        feed_dict = {
+            model.token_ids:
+                np.zeros([batch_size, unroll_steps], dtype=np.int64)
+            for model in models
+        }
+    else:
+        feed_dict = {
+            model.tokens_characters:
+                np.zeros([batch_size, unroll_steps, max_chars],
+                         dtype=np.int32)
+            for model in models
+        }
+
+    if bidirectional:
+        if not char_inputs:
+            feed_dict.update({
+                model.token_ids_reverse:
+                    np.zeros([batch_size, unroll_steps], dtype=np.int64)
+                for model in models
+            })
+        else:
+            feed_dict.update({
+                model.tokens_characters_reverse:
+                    np.zeros([batch_size, unroll_steps, max_chars],
+                             dtype=np.int32)
+                for model in models
+            })
+    return feed_dict
+
+
+def _get_lstm_state_tensors(models):
+    init_state_tensors = []
+    final_state_tensors = []
+    for model in models:
+        init_state_tensors.extend(model.init_lstm_state)
+        final_state_tensors.extend(model.final_lstm_state)
+    return init_state_tensors, final_state_tensors
+
+
+def _get_batch_feed_dict(X, models, options):
+    # slice the input in the batch for the feed_dict
+    batch_size = options['batch_size']
+    char_inputs = 'char_cnn' in options
     bidirectional = options.get('bidirectional', False)
-    with tf.Session(config=tf.ConfigProto(
-            allow_soft_placement=True)) as sess:
-        sess.run(init)
+    feed_dict = {}
+    for k, model in enumerate(models):
+        start = k * batch_size
+        end = (k + 1) * batch_size
+        feed_dict.update(
+            _get_feed_dict_from_X(X, start, end, model,
+                                  char_inputs, bidirectional)
+        )
+    return feed_dict
+
+
+def train(options, data, n_gpus, tf_save_dir, tf_log_dir,
+          restart_ckpt_file=None):
+    '''
+    Train the language model.
+
+    n_gpus is the number of towers, which run on CPU devices instead of
+    GPUs when options contains 'cpu_towers' (see `_get_session_config`).
+
+    options['input_pipeline'] selects how batches reach the model:
+        'feed_dict' (default) feeds every batch into placeholders,
+        'tf_data' reads them from a prefetching tf.data pipeline built on
+        the same `data.iter_batches` (see `_get_dataset_inputs`).
+    '''
+
+    # not restarting so save the options
+    if restart_ckpt_file is None:
+        with open(os.path.join(tf_save_dir, 'options.json'), 'w') as fout:
+            fout.write(json.dumps(options))
+
+    input_pipeline = options.get('input_pipeline', 'feed_dict')
+    if input_pipeline == 'tf_data':
+        tower_inputs = _get_dataset_inputs(options, data, n_gpus)
+    elif input_pipeline == 'feed_dict':
+        tower_inputs = None
+    else:
+        raise ValueError('Input pipeline Not Understood: {}'.format(
+            input_pipeline))
+
+    graph = _build_train_graph(options, n_gpus, tower_inputs)
+    models = graph['models']
+    train_op = graph['train_op']
+    summary_op = graph['summary_op']
+    hist_summary_op = graph['hist_summary_op']
+    train_perplexity = graph['train_perplexity']
+
+    # do the training loop
+    with tf.Session(config=_get_session_config(options, n_gpus)) as sess:
+        sess.run(graph['init'])
 
         # load the checkpoint data if needed
         if restart_ckpt_file is not None:
@@ -776,7 +985,8 @@ def train(options, data, n_gpus, tf_save_dir, tf_log_dir,
         # For each batch:
         # Get a batch of data from the generator. The generator will
         # yield batches of size batch_size * n_gpus that are sliced
-        # and fed for each required placeholer.
+        # and fed for each required placeholer (or read from the tf.data
+        # iterator when input_pipeline is 'tf_data').
         #
         # We also need to be careful with the LSTM states.  We will
         # collect the final LSTM states after each batch, then feed
@@ -792,110 +1002,105 @@ def train(options, data, n_gpus, tf_save_dir, tf_log_dir,
             options['n_epochs'], n_batches_total))
 
         # get the initial lstm states
-        init_state_tensors = []
-        final_state_tensors = []
-        for model in models:
-            init_state_tensors.extend(model.init_lstm_state)
-            final_state_tensors.extend(model.final_lstm_state)
-
-        char_inputs = 'char_cnn' in options
-        if char_inputs:
-            max_chars = options['char_cnn']['max_characters_per_token']
-
-        if not char_inputs:
-            feed_dict = {
-                model.token_ids:
-                    np.zeros([batch_size, unroll_steps], dtype=np.int64)
-                for model in models
-            }
-        else:
-            feed_dict = {
-                model.tokens_characters:
-                    np.zeros([batch_size, unroll_steps, max_chars],
-                             dtype=np.int32)
-                for model in models
-            }
-
-        if bidirectional:
-            if not char_inputs:
-                feed_dict.update({
-                    model.token_ids_reverse:
-                        np.zeros([batch_size, unroll_steps], dtype=np.int64)
-                    for model in models
-                })
-            else:
-                feed_dict.update({
-                    model.tokens_characters_reverse:
-                        np.zeros([batch_size, unroll_steps, max_chars],
-                                 dtype=np.int32)
-                    for model in models
-                })
-
-        init_state_values = sess.run(init_state_tensors, feed_dict=feed_dict)
+        init_state_tensors, final_state_tensors = \
+            _get_lstm_state_tensors(models)
+        init_state_values = sess.run(init_state_tensors,
+                                     feed_dict=_get_zero_feed_dict(models, options))
 
         t1 = time.time()
-        data_gen = data.iter_batches(batch_size * n_gpus, unroll_steps)
-        for batch_no, batch in enumerate(data_gen, start=1):
-
-            # slice the input in the batch for the feed_dict
-            X = batch
+        t_last, last_batch_no = t1, 0
+        if input_pipeline == 'tf_data':
+            # the batches are read by the graph itself
+            data_gen = itertools.repeat(None)
+        else:
+            data_gen = data.iter_batches(batch_size * n_gpus, unroll_steps)
+        for batch_no, X in enumerate(data_gen, start=1):
             feed_dict = {t: v for t, v in zip(
                                         init_state_tensors, init_state_values)}
-            for k in range(n_gpus):
-                model = models[k]
-                start = k * batch_size
-                end = (k + 1) * batch_size
-
-                feed_dict.update(
-                    _get_feed_dict_from_X(X, start, end, model,
-                                          char_inputs, bidirectional)
-                )
+            if X is not None:
+                feed_dict.update(_get_batch_feed_dict(X, models, options))
 
             # This runs the train_op, summaries and the "final_state_tensors"
             #   which just returns the tensors, passing in the initial
             #   state tensors, token ids and next token ids
-            if batch_no % 1250 != 0:
-                ret = sess.run(
-                    [train_op, summary_op, train_perplexity] +
-                                                final_state_tensors,
-                    feed_dict=feed_dict
-                )
-
-                # first three entries of ret are:
-                #  train_op, summary_op, train_perplexity
-                # last entries are the final states -- set them to
-                # init_state_values
-                # for next batch
-                init_state_values = ret[3:]
-
-            else:
+            fetches = [train_op, summary_op, train_perplexity]
+            if batch_no % 1250 == 0:
                 # also run the histogram summaries
-                ret = sess.run(
-                    [train_op, summary_op, train_perplexity, hist_summary_op] + 
-                                                final_state_tensors,
-                    feed_dict=feed_dict
-                )
-                init_state_values = ret[4:]
-                
+                fetches.append(hist_summary_op)
+            try:
+                ret = sess.run(fetches + final_state_tensors,
+                               feed_dict=feed_dict)
+            except tf.errors.OutOfRangeError:
+                # the input pipeline ran out of data
+                break
+
+            # first entries of ret are the fetches, last entries are the
+            # final states -- set them to init_state_values for next batch
+            init_state_values = ret[len(fetches):]
 
             if batch_no % 1250 == 0:
                 summary_writer.add_summary(ret[3], batch_no)
             if batch_no % 100 == 0:
                 # write the summaries to tensorboard and display perplexity
                 summary_writer.add_summary(ret[1], batch_no)
+                t_now = time.time()
                 print("Batch %s, train_perplexity=%s" % (batch_no, ret[2]))
-                print("Total time: %s" % (time.time() - t1))
+                print("Total time: %s, steps/sec (%s): %.3f" % (
+                    t_now - t1, input_pipeline,
+                    (batch_no - last_batch_no) / (t_now - t_last)))
+                t_last, last_batch_no = t_now, batch_no
 
             if (batch_no % 1250 == 0) or (batch_no == n_batches_total):
                 # save the model
                 checkpoint_path = os.path.join(tf_save_dir, 'model.ckpt')
-                saver.save(sess, checkpoint_path, global_step=global_step)
+                graph['saver'].save(sess, checkpoint_path,
+                                    global_step=graph['global_step'])
 
             if batch_no == n_batches_total:
                 # done training!
                 break
 
 
+def benchmark_input_pipeline(options, data, n_gpus, n_batches=200):
+    '''
+    Run `n_batches` training steps fed through feed_dict and `n_batches`
+    steps read from the tf.data pipeline on the same graph, and log the
+    steps/sec of both side by side.
+    '''
+    tower_inputs = _get_dataset_inputs(options, data, n_gpus)
+    graph = _build_train_graph(options, n_gpus, tower_inputs)
+    models = graph['models']
+    fetches = [graph['train_op'], graph['train_perplexity']]
+    init_state_tensors, final_state_tensors = _get_lstm_state_tensors(models)
+
+    batch_size = options['batch_size']
+    unroll_steps = options['unroll_steps']
+    steps_per_sec = {}
+    with tf.Session(config=_get_session_config(options, n_gpus)) as sess:
+        sess.run(graph['init'])
+        zero_feed_dict = _get_zero_feed_dict(models, options)
+
+        for input_pipeline in ['feed_dict', 'tf_data']:
+            init_state_values = sess.run(init_state_tensors,
+                                         feed_dict=zero_feed_dict)
+            data_gen = data.iter_batches(batch_size * n_gpus, unroll_steps)
+            t1 = time.time()
+            for batch_no in range(n_batches):
+                feed_dict = {t: v for t, v in zip(
+                                        init_state_tensors, init_state_values)}
+                if input_pipeline == 'feed_dict':
+                    feed_dict.update(
+                        _get_batch_feed_dict(next(data_gen), models, options))
+                ret = sess.run(fetches + final_state_tensors,
+                               feed_dict=feed_dict)
+                init_state_values = ret[len(fetches):]
+            steps_per_sec[input_pipeline] = n_batches / (time.time() - t1)
+
+    print("steps/sec: feed_dict=%.3f, tf_data=%.3f" % (
+        steps_per_sec['feed_dict'], steps_per_sec['tf_data']))
+    return steps_per_sec
+
+
 def clip_by_global_norm_summary(t_list, clip_norm, norm_name, variables):
     # wrapper around tf.clip_by_global_norm that also does summary ops of norms
 
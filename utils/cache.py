@@ -21,8 +21,6 @@ import lmdb
 import pickle
 import numpy as np
 import tensorflow as tf
-from allennlp.commands.elmo import ElmoEmbedder
-from utils.bilm import Batcher, BidirectionalLanguageModel, weight_layers
 
 
 class ELMoCache(object):
@@ -63,10 +61,14 @@ class ELMoCache(object):
 
     def init_elmo_model(self):
         if self.elmo_model_type == 'allennlp':
+            from allennlp.commands.elmo import ElmoEmbedder   # heavy (torch), only imported for this model type
+
             print('Logging Info - Loading pre-trained elmo model using allennlp.ElmoEmbedder')
             self.elmo_model = ElmoEmbedder(options_file=self.options_file, weight_file=self.weight_file,
                                            cuda_device=0)
         elif self.elmo_model_type == 'bilmtf':
+            from utils.bilm import Batcher, BidirectionalLanguageModel, weight_layers
+
             print('Logging Info - Loading pre-trained elmo model using bilmtf')
             if self.vocab_file is None:
                 self.vocab_file = os.path.join(self.cache_dir, 'vocab.txt')
@@ -14,14 +14,18 @@
 
 """
 
+import typing
+
 import numpy as np
 from keras.utils import Sequence
 from utils.data_loader import load_processed_data, load_features
-from utils.cache import ELMoCache
+
+if typing.TYPE_CHECKING:
+    from utils.cache import ELMoCache   # for the type hint only, not imported at runtime (it loads the elmo backends)
 
 
 class ELMoGenerator(Sequence):
-    def __init__(self, genre, level, data_type, batch_size, elmocache: ELMoCache, shuffle=True, return_data=False,
+    def __init__(self, genre, level, data_type, batch_size, elmocache: 'ELMoCache', shuffle=True, return_data=False,
                  return_features=False, return_label=True):
         """
         :param elmocache:  instance of ELMoCache, used to genrate elmo embedding
@@ -16,12 +16,11 @@
 import json
 import numpy as np
 import pandas as pd
-from bert import run_classifier
 
 from config import PROCESSED_DATA_DIR, TRAIN_IDS_MATRIX_TEMPLATE, DEV_IDS_MATRIX_TEMPLATE, TEST_IDS_MATRIX_TEMPLATE, \
-    TRAIN_DATA_TEMPLATE, DEV_DATA_TEMPLATE, TEST_DATA_TEMPLATE, FEATURE_DIR, TRAIN_FEATURES_TEMPLATE, \
-    DEV_FEATURES_TEMPLATE, TEST_FEATURES_TEMPLATE
+    TRAIN_DATA_TEMPLATE, DEV_DATA_TEMPLATE, TEST_DATA_TEMPLATE, FEATURE_DIR
 from utils.io import pickle_load, format_filename
+from utils.feature_store import FeatureStore, FeatureScaler
 
 
 def read_nli_data(filename, set_genre=None):
@@ -68,17 +67,13 @@ def load_processed_data(genre, level, data_type):
     return pickle_load(filename)
 
 
-def load_features(genre, data_type, scale_features):
-    feat_type = 'all_scaled' if scale_features else 'all'
-    if data_type == 'train':
-        filename = format_filename(FEATURE_DIR, TRAIN_FEATURES_TEMPLATE, genre, feat_type)
-    elif data_type == 'valid' or data_type == 'dev':
-        filename = format_filename(FEATURE_DIR, DEV_FEATURES_TEMPLATE, genre, feat_type)
-    elif data_type == 'test':
-        filename = format_filename(FEATURE_DIR, TEST_FEATURES_TEMPLATE, genre, feat_type)
-    else:
-        raise ValueError('Data Type Not Understood: {}'.format(data_type))
-    return pickle_load(filename)
+def load_features(genre, data_type, scale_features, feature_names=None):
+    # assemble the feature matrix from the columns of `feature_names` (all registered features by default)
+    features = FeatureStore(FEATURE_DIR, genre).gather(data_type, feature_names)
+    if scale_features:
+        # standardized with the statistics of the train split, whatever `data_type` is
+        features = FeatureScaler.load(FEATURE_DIR, genre, feature_names).transform(features)
+    return features
 
 
 # load model input data
@@ -100,6 +95,8 @@ def load_input_data(genre, level, data_type, input_config, add_features, scale_f
         input_data = {'x': [_data['premise'], _data['hypothesis'], _text_data['premise'], _text_data['hypothesis']],
                       'y': _data['label']}
     elif input_config == 'bert':
+        from bert import run_classifier     # only bert input needs it, and it pulls in tensorflow
+
         # prepare input examples for bert model
         _data = load_processed_text_data(genre, data_type)
         if _data['label'] is None:
@@ -16,14 +16,9 @@
 
 import os
 import numpy as np
-from gensim.models import Word2Vec
-from gensim.models import KeyedVectors
-from fastText import train_unsupervised
-from glove import Glove, Corpus
 
-import tensorflow as tf
-import tensorflow_hub as hub
-from allennlp.commands.elmo import ElmoEmbedder
+# the embedding backends (gensim, glove, fastText, tensorflow_hub, allennlp) are heavy to import and each needed by one
+# function only, so they are imported in the function using it
 
 
 def load_glove_format(filename):
@@ -53,6 +48,8 @@ def load_glove_format(filename):
 
 
 def load_trained(load_filename, vocabulary):
+    from gensim.models import KeyedVectors
+
     word_vectors = {}
     try:
         model = KeyedVectors.load_word2vec_format(load_filename)
@@ -79,6 +76,9 @@ def load_trained(load_filename, vocabulary):
 
 def load_elmo_from_tfhub(idx2token, token_ids, hub_url=None):
     """input sentence are processed token id sequences"""
+    import tensorflow as tf
+    import tensorflow_hub as hub
+
     idx2token[0] = ''   # pad position, must add
     word_mapping = [x[1] for x in sorted(idx2token.items(), key=lambda x: x[0])]
     lookup_table = tf.contrib.lookup.index_to_string_table_from_tensor(word_mapping, default_value="<UNK>")
@@ -104,6 +104,8 @@ def load_elmo_from_tfhub(idx2token, token_ids, hub_url=None):
 
 def load_elmo_from_allennlp(idx2token, token_ids, options_file, weight_file, cuda_device=0):
     """input sentence are processed token id sequences"""
+    from allennlp.commands.elmo import ElmoEmbedder
+
     print('Logging Info - Loading elmo from pre-trained model using ElmoEmbedder')
     elmo = ElmoEmbedder(options_file=options_file, weight_file=weight_file, cuda_device=cuda_device)
 
@@ -122,6 +124,8 @@ def load_elmo_from_allennlp(idx2token, token_ids, options_file, weight_file, cud
 
 
 def train_w2v(corpus, cut_func, vocabulary, embedding_dim=300):
+    from gensim.models import Word2Vec
+
     corpus = [cut_func(sentence) for sentence in corpus]
     model = Word2Vec(corpus, size=embedding_dim, min_count=1, window=5, sg=1, iter=10)
     weights = model.wv.syn0
@@ -142,6 +146,8 @@ def train_w2v(corpus, cut_func, vocabulary, embedding_dim=300):
 # here we use a python implementation of Glove, but the official glove implementation of C version is also highly
 # recommended: https://github.com/stanfordnlp/GloVe/blob/master/demo.sh
 def train_glove(corpus, cut_func, vocabulary, embedding_dim=300):
+    from glove import Glove, Corpus
+
     corpus = [cut_func(sentence) for sentence in corpus]
     corpus_model = Corpus()
     corpus_model.fit(corpus, window=10)
@@ -163,6 +169,8 @@ def train_glove(corpus, cut_func, vocabulary, embedding_dim=300):
 
 
 def train_fasttext(corpus, cut_func, vocabulary, embedding_dim=300):
+    from fastText import train_unsupervised
+
     corpus = [' '.join(cut_func(sentence)) for sentence in corpus]
     corpus_file_path = 'fasttext_tmp_corpus.txt'
     with open(corpus_file_path, 'w', encoding='utf8')as writer:
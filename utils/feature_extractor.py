@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+@author: alexyang
+
+@contact: alex.yang0326@gmail.com
+
+@file: feature_extractor.py
+
+@time: 2019/4/22 10:36
+
+@desc: online feature extraction for single (premise, hypothesis) pairs at serving time
+
+"""
+
+import os
+import time
+from collections import Counter, defaultdict, deque
+from functools import partial
+
+import numpy as np
+from gensim.models import TfidfModel
+
+from config import FEATURE_DIR
+from utils.io import pickle_load
+from utils.feature_store import FeatureScaler, get_feature_specs, get_feature_len
+from utils.graph import load_graph, GraphFeatures
+from utils.features import TextAnalysis, weighted_word_ngram_overlap, word_power_factors, word_power_rate
+import utils.features
+
+
+class FeatureExtractor(object):
+    """
+    Online counterpart of `prepare_features.Feature`: compute the feature vector of one (premise, hypothesis) pair.
+    The global artifacts generated offline (tfidf dictionary & model, word power statistics, sentence graph) are loaded
+    once and turned into in-memory indexes, so a pair only costs lookups besides its own similarity features. Sentences
+    must be tokenized the same way as the processed data (tokens joined by space).
+
+    Pairs seen offline get the stored graph features. For a pair that is not in the graph, the pair is
+    considered as one new edge added to it, without updating the global statistics:
+    - degree: stored degree + 1 (1 for an unseen sentence);
+    - clique: the new edge is its only clique (size 2), node max clique size is at least 2;
+    - connected component: size of the component the new edge belongs to (components are merged);
+    - pagerank: teleport-only score (1 - alpha) / n_nodes for an unseen sentence; hits: 0 for an unseen sentence;
+    - shortest path: path without the new edge, -1 when a sentence is unseen.
+    """
+    def __init__(self, genre, feature_names=None, scaled=False, feature_dir=FEATURE_DIR, pagerank_alpha=0.9,
+                 latency_window=10000):
+        """
+        :param feature_names: names of features to extract, all registered features by default
+        :param scaled: whether to standardize the output with the scaler fitted on train split
+        :param latency_window: number of latest transform calls latency percentiles are computed over
+        """
+        self.genre = genre
+        self.feature_dir = feature_dir
+        self.specs = get_feature_specs(feature_names)
+        self.feature_len = get_feature_len(feature_names)
+        self.scaler = FeatureScaler.load(feature_dir, genre, feature_names) if scaled else None
+        self.pagerank_alpha = pagerank_alpha
+
+        self.pair_funcs = {
+            'simhash': utils.features.simhash,
+            'c_ngram_ol': utils.features.char_ngram_overlap,
+            'w_ngram_ol': utils.features.word_ngram_overlap,
+            'tfidf': self.tfidf_feature,
+            'w_ngram_ol_tfidf': self.weighted_word_ngram_overlap_feature,
+            'word_power': self.word_power_feature,
+            'graph': self.graph_feature
+        }
+        for spec in self.specs:
+            if spec.depends and spec.name not in self.pair_funcs:
+                raise ValueError('Feature Not Understood: {}'.format(spec.name))
+
+        depends = set(artifact for spec in self.specs for artifact in spec.depends)
+        if 'tfidf' in depends:
+            self.load_tfidf()
+        if 'power_word' in depends:
+            self.load_power_word()
+        if 'graph' in depends:
+            self.load_graph()
+
+        # feature group --> latencies (in seconds) of the latest transform calls, bounded for long running servers
+        self.latency = defaultdict(partial(deque, maxlen=latency_window))
+
+    def load_tfidf(self):
+        dictionary = pickle_load(os.path.join(self.feature_dir, '{}_tfidf.dict'.format(self.genre)))
+        tfidf_model = TfidfModel.load(os.path.join(self.feature_dir, '{}_tfidf.model'.format(self.genre)))
+        self.token2id = dictionary.token2id
+        self.idfs = np.zeros(max(len(dictionary), max(tfidf_model.idfs.keys(), default=-1) + 1))
+        for token_id, idf in tfidf_model.idfs.items():
+            self.idfs[token_id] = idf
+        self.tfidf_eps = tfidf_model.eps
+
+    def load_power_word(self):
+        with np.load(os.path.join(self.feature_dir, '{}_power_word.npz'.format(self.genre))) as power_word:
+            self.word2idx = {word: i for i, word in enumerate(power_word['words'].tolist())}
+            self.power_factors = word_power_factors(power_word['stats'])
+
+    def load_graph(self):
+        self.sent2id = pickle_load(os.path.join(self.feature_dir, '{}_graph_sent2id.pkl'.format(self.genre)))
+        adj = load_graph(os.path.join(self.feature_dir, '{}_graph.npz'.format(self.genre)))
+
+        print('Logging Info - Index graph statistics...')
+        self.graph_stats = GraphFeatures(adj, pagerank_alpha=self.pagerank_alpha)
+        self.unseen_pagerank = (1.0 - self.pagerank_alpha) / max(len(self.sent2id), 1)
+
+    def sentence_tfidf(self, words):
+        """tf-idf vector of a sentence as {token_id: weight}, same as `tfidf_model[dictionary.doc2bow(words)]`"""
+        counts = Counter(self.token2id[word] for word in words if word in self.token2id)
+        if not counts:
+            return dict()
+        token_ids = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        weights = np.fromiter(counts.values(), dtype=np.float64, count=len(counts)) * self.idfs[token_ids]
+        keep = weights != 0
+        token_ids, weights = token_ids[keep], weights[keep]
+        norm = np.sqrt(np.sum(weights ** 2))
+        if norm > 0:
+            weights = weights / norm
+        keep = np.abs(weights) > self.tfidf_eps
+        return dict(zip(token_ids[keep].tolist(), weights[keep].tolist()))
+
+    def tfidf_feature(self, premise, hypothesis):
+        p_tfidf = list(self.sentence_tfidf(premise.tokens).values())
+        h_tfidf = list(self.sentence_tfidf(hypothesis.tokens).values())
+        return [np.sum(p_tfidf), np.sum(h_tfidf), np.mean(p_tfidf), np.mean(h_tfidf)]
+
+    def weighted_word_ngram_overlap_feature(self, premise, hypothesis):
+        inputs = []
+        for sent in [premise, hypothesis]:
+            sent_tfidf = self.sentence_tfidf(sent.tokens)
+            # out of vocabulary words are looked up as token 0, as done offline
+            token_ids = [self.token2id.get(word, 0) for word in sent.tokens]
+            inputs.append([(word, self.idfs[token_id], sent_tfidf.get(token_id, 0.0))
+                           for word, token_id in zip(sent.tokens, token_ids)])
+        return weighted_word_ngram_overlap(inputs[0], inputs[1])
+
+    def word_power_feature(self, premise, hypothesis):
+        return word_power_rate(premise, hypothesis, self.word2idx, self.power_factors)
+
+    def graph_feature(self, premise, hypothesis):
+        stats = self.graph_stats
+        p_id = self.sent2id.get(str(premise))
+        h_id = self.sent2id.get(str(hypothesis))
+        if p_id is not None and h_id is not None and stats.has_edge(p_id, h_id):
+            return stats.pair_features([p_id], [h_id])[0]
+
+        # graph in-degree fetures
+        features = [stats.degree[p_id] + 1 if p_id is not None else 1,
+                    stats.degree[h_id] + 1 if h_id is not None else 1]
+
+        # clique features
+        lnode_max_clique_size = max(stats.cliques.node_max_clique[p_id], 2) if p_id is not None else 2
+        rnode_max_clique_size = max(stats.cliques.node_max_clique[h_id], 2) if h_id is not None else 2
+        features += [2, 1, lnode_max_clique_size, rnode_max_clique_size,
+                     max(lnode_max_clique_size, rnode_max_clique_size),
+                     min(lnode_max_clique_size, rnode_max_clique_size)]
+
+        # connected components features
+        if p_id is not None and h_id is not None:
+            cc_size = stats.cc_sizes[stats.cc_labels[p_id]]
+            if stats.cc_labels[p_id] != stats.cc_labels[h_id]:
+                cc_size += stats.cc_sizes[stats.cc_labels[h_id]]
+        elif p_id is not None or h_id is not None:
+            cc_size = stats.cc_sizes[stats.cc_labels[p_id if p_id is not None else h_id]] + 1
+        else:
+            cc_size = 1 if premise == hypothesis else 2
+        features.append(cc_size)
+
+        # page rank features
+        pr1 = (stats.pagerank[p_id] if p_id is not None else self.unseen_pagerank) * 1e6
+        pr2 = (stats.pagerank[h_id] if h_id is not None else self.unseen_pagerank) * 1e6
+        features += [pr1, pr2, max(pr1, pr2), min(pr1, pr2), (pr1 + pr2) / 2.]
+
+        # graph hits features
+        h1 = stats.hits_h[p_id] * 1e6 if p_id is not None else 0.0
+        h2 = stats.hits_h[h_id] * 1e6 if h_id is not None else 0.0
+        a1 = stats.hits_a[p_id] * 1e6 if p_id is not None else 0.0
+        a2 = stats.hits_a[h_id] * 1e6 if h_id is not None else 0.0
+        features += [h1, h2, a1, a2, max(h1, h2), max(a1, a2), min(h1, h2), min(a1, a2), (h1 + h2) / 2.,
+                     (a1 + a2) / 2.]
+
+        # graph shortest path features, the new edge between the pair is not in the graph
+        if p_id is not None and h_id is not None:
+            features.append(stats.shortest_paths.length(p_id, h_id))
+        else:
+            features.append(-1)
+        return features
+
+    def transform(self, premise, hypothesis):
+        """feature vector of one pair, its columns are in the order of the feature registry"""
+        start = time.perf_counter()
+        # tokenize and build n-grams once, shared by all features
+        premise, hypothesis = TextAnalysis(premise), TextAnalysis(hypothesis)
+        self.latency['analysis'].append(time.perf_counter() - start)
+
+        features = np.empty(self.feature_len, dtype=np.float64)
+        offset = 0
+        for spec in self.specs:
+            group_start = time.perf_counter()
+            if spec.name in self.pair_funcs:
+                feature = self.pair_funcs[spec.name](premise, hypothesis)
+            else:
+                feature = getattr(utils.features, spec.func)(premise, hypothesis)
+            features[offset:offset+spec.width] = feature
+            offset += spec.width
+            self.latency[spec.name].append(time.perf_counter() - group_start)
+
+        if self.scaler is not None:
+            features = self.scaler.transform(features)
+        self.latency['all'].append(time.perf_counter() - start)
+        return features
+
+    def latency_report(self, reset=False):
+        """p50 / p99 latency (in milliseconds) of every feature group over the latest transform calls"""
+        report = dict()
+        for name, latencies in self.latency.items():
+            p50, p99 = np.percentile(np.array(latencies) * 1000, [50, 99])
+            report[name] = (p50, p99)
+            print('Logging Info - {} : {} calls, p50: {:.3f}ms, p99: {:.3f}ms'.format(name, len(latencies), p50, p99))
+        if reset:
+            self.latency.clear()
+        return report
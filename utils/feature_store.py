@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+@author: alexyang
+
+@contact: alex.yang0326@gmail.com
+
+@file: feature_store.py
+
+@time: 2019/4/21 15:27
+
+@desc: registry of the statistical features and the columnar store holding their values
+
+"""
+
+import os
+import hashlib
+from collections import namedtuple
+
+import numpy as np
+
+
+# name: name of the feature (group), also the name of its column file in the feature store
+# width: number of columns it outputs
+# func: for pairwise similarity features, name of the function in `utils.features` applied to (premise, hypothesis);
+#       otherwise name of the `Feature` method (in prepare_features.py) that generates it for one data type
+# depends: global artifacts it is computed from, generated over all the data: 'tfidf' (tfidf model & dictionary),
+#          'power_word' (word power statistics), 'graph' (sentence graph)
+FeatureSpec = namedtuple('FeatureSpec', ['name', 'width', 'func', 'depends'])
+
+FEATURE_REGISTRY = [
+    FeatureSpec('len_dis', 8, 'length_distance', ()),
+    FeatureSpec('lcs_seq', 1, 'lcs_seq_norm', ()),
+    FeatureSpec('lcs_str', 1, 'lcs_str_1_norm', ()),
+    FeatureSpec('edit_dist', 1, 'edit_distance', ()),
+    FeatureSpec('jaro', 1, 'jaro_distance', ()),
+    FeatureSpec('jaro_winkler', 1, 'jaro_winkler_dist', ()),
+    FeatureSpec('fuzz', 8, 'fuzzy', ()),
+    FeatureSpec('simhash', 1, 'add_simhash_feature', ()),
+    FeatureSpec('w_share', 1, 'word_share', ()),
+    FeatureSpec('w_ngram_dist', 40, 'word_ngram_distance', ()),
+    FeatureSpec('c_ngram_ol', 10, 'add_char_ngram_overlap_feature', ()),
+    FeatureSpec('w_ngram_ol', 4, 'add_word_ngram_overlap_feature', ()),
+    FeatureSpec('w_ngram_ol_tfidf', 4, 'add_weighted_word_ngram_overlap_feature', ('tfidf',)),
+    FeatureSpec('tfidf', 4, 'add_tfidf_feature', ('tfidf',)),
+    FeatureSpec('word_power', 2, 'add_word_power_feature', ('power_word',)),
+    FeatureSpec('graph', 25, 'add_graph_feature', ('graph',)),
+]
+
+FEATURE_SPECS = {spec.name: spec for spec in FEATURE_REGISTRY}
+FEATURE_NAMES = [spec.name for spec in FEATURE_REGISTRY]
+
+
+def get_feature_specs(feature_names=None):
+    if feature_names is None:
+        return list(FEATURE_REGISTRY)
+    return [FEATURE_SPECS[name] for name in feature_names]
+
+
+def get_feature_len(feature_names=None):
+    """dimension of the feature matrix assembled from `feature_names` (all registered features by default)"""
+    return sum(spec.width for spec in get_feature_specs(feature_names))
+
+
+def get_feature_columns(feature_names=None):
+    """indices of the columns of `feature_names` in the feature matrix assembled from all registered features"""
+    offsets, start = dict(), 0
+    for spec in FEATURE_REGISTRY:
+        offsets[spec.name] = start
+        start += spec.width
+    return np.concatenate([np.arange(offsets[spec.name], offsets[spec.name] + spec.width)
+                           for spec in get_feature_specs(feature_names)])
+
+
+def get_registry_version(feature_names=None):
+    """short hash identifying the layout (names, widths, order) of the assembled feature matrix"""
+    layout = ','.join('{}:{}'.format(spec.name, spec.width) for spec in get_feature_specs(feature_names))
+    return hashlib.md5(layout.encode('utf-8')).hexdigest()[:8]
+
+
+class FeatureStore(object):
+    """
+    Columnar feature store: every feature (group) of every data type is saved as its own `.npy` file, so features can
+    be added, dropped or recomputed one at a time. The feature matrix is assembled by gathering the columns through
+    memory maps, without loading every file in full first.
+    """
+    def __init__(self, feature_dir, genre):
+        self.feature_dir = feature_dir
+        self.genre = genre
+
+    @staticmethod
+    def check_data_type(data_type):
+        if data_type == 'valid':
+            return 'dev'
+        if data_type not in ['train', 'dev', 'test']:
+            raise ValueError('Data Type `{}` not understood'.format(data_type))
+        return data_type
+
+    def path(self, data_type, name):
+        return os.path.join(self.feature_dir, 'genre_{}_feature_{}_{}.npy'.format(self.genre, name,
+                                                                                self.check_data_type(data_type)))
+
+    def exists(self, data_type, name):
+        return os.path.exists(self.path(data_type, name))
+
+    def save(self, data_type, name, features):
+        features = np.asarray(features, dtype=np.float64)
+        if features.ndim == 1:
+            features = np.expand_dims(features, -1)
+        if name in FEATURE_SPECS and features.shape[1] != FEATURE_SPECS[name].width:
+            raise ValueError('Feature `{}` has {} columns, registry declares {}'.format(
+                name, features.shape[1], FEATURE_SPECS[name].width))
+        np.save(self.path(data_type, name), features)
+        print('Logging Info - Saved:', self.path(data_type, name))
+
+    def load(self, data_type, name, mmap=False):
+        return np.load(self.path(data_type, name), mmap_mode='r' if mmap else None)
+
+    def remove(self, data_type, name):
+        if self.exists(data_type, name):
+            os.remove(self.path(data_type, name))
+            print('Logging Info - Removed:', self.path(data_type, name))
+
+    def gather(self, data_type, feature_names=None):
+        """assemble the feature matrix of `data_type` from the columns of `feature_names` (all registered by default)"""
+        specs = get_feature_specs(feature_names)
+        columns = [self.load(data_type, spec.name, mmap=True) for spec in specs]
+        for spec, column in zip(specs, columns):
+            if column.shape[1] != spec.width:
+                raise ValueError('Feature `{}` in store has {} columns, registry declares {}, recompute it'.format(
+                    spec.name, column.shape[1], spec.width))
+        features = np.empty((columns[0].shape[0], get_feature_len(feature_names)), dtype=np.float64)
+        start = 0
+        for spec, column in zip(specs, columns):
+            features[:, start:start+spec.width] = column
+            start += spec.width
+        return features
+
+
+class FeatureScaler(object):
+    """
+    Standardize features with the mean and standard deviation of the train split (same as sklearn's StandardScaler),
+    fit once and persisted as a plain `.npz` tied to the feature registry version, so dev / test / new pairs at
+    inference time are transformed with the train statistics and without loading sklearn. It's fitted on all registered
+    features, a matrix assembled from a subset of them is scaled with the statistics of its columns (see `select`).
+    """
+    def __init__(self, mean=None, scale=None, version=None):
+        self.mean = mean
+        self.scale = scale
+        self.version = version if version is not None else get_registry_version()
+
+    @staticmethod
+    def path(feature_dir, genre, version=None):
+        version = version if version is not None else get_registry_version()
+        return os.path.join(feature_dir, '{}_scaler_{}.npz'.format(genre, version))
+
+    def fit(self, features):
+        features = np.asarray(features, dtype=np.float64)
+        # nans are ignored, as sklearn does: they are kept in the output instead of spoiling the whole column
+        self.mean = np.nanmean(features, axis=0)
+        scale = np.nanstd(features, axis=0)
+        scale[~(scale > 0.0)] = 1.0     # leave constant (or all nan) features unscaled
+        self.scale = scale
+        return self
+
+    def transform(self, features):
+        if self.mean is None:
+            raise ValueError('FeatureScaler is not fitted yet')
+        return (np.asarray(features, dtype=np.float64) - self.mean) / self.scale
+
+    def fit_transform(self, features):
+        return self.fit(features).transform(features)
+
+    def select(self, feature_names=None):
+        """scaler of the matrix assembled from `feature_names`, taken from this scaler fitted on all features"""
+        if feature_names is None:
+            return self
+        columns = get_feature_columns(feature_names)
+        return FeatureScaler(self.mean[columns], self.scale[columns], get_registry_version(feature_names))
+
+    def save(self, feature_dir, genre):
+        np.savez(self.path(feature_dir, genre, self.version), mean=self.mean, scale=self.scale,
+                 version=self.version)
+        print('Logging Info - Saved:', self.path(feature_dir, genre, self.version))
+
+    @classmethod
+    def load(cls, feature_dir, genre, feature_names=None):
+        """load the scaler fitted for the current feature registry version, for the columns of `feature_names`"""
+        scaler_path = cls.path(feature_dir, genre)
+        if not os.path.exists(scaler_path):
+            raise ValueError('No scaler fitted for feature registry version {}: {} not found, run '
+                             'prepare_features.py first'.format(get_registry_version(), scaler_path))
+        with np.load(scaler_path) as params:
+            scaler = cls(params['mean'], params['scale'], str(params['version']))
+        print('Logging Info - Loaded:', scaler_path)
+        return scaler.select(feature_names)
@@ -17,15 +17,66 @@
 import numpy as np
 import textdistance
 from collections import Counter
-from fuzzywuzzy import fuzz
 from simhash import Simhash
-from difflib import SequenceMatcher
+from utils import kernels
+
+
+class TextAnalysis(str):
+    """
+    A sentence together with its tokens, token counts and word / char n-grams, each computed at most once and shared
+    by all the similarity features below. It is a str, so it can be passed to any feature function in place of the raw
+    sentence; functions that split or build n-grams read them from here instead of recomputing them.
+    """
+    def __new__(cls, text, word_cut_func=None):
+        analysis = super(TextAnalysis, cls).__new__(cls, text)
+        analysis.word_cut_func = word_cut_func
+        analysis.tokens = text.split() if word_cut_func is None else word_cut_func(text)
+        analysis._token_counts = None
+        analysis._word_ngram_lists = dict()
+        analysis._word_ngram_sets = dict()
+        analysis._char_ngram_sets = dict()
+        analysis._fuzzy_forms = None
+        return analysis
+
+    @property
+    def token_counts(self):
+        if self._token_counts is None:
+            self._token_counts = Counter(self.tokens)
+        return self._token_counts
+
+    def word_ngram_list(self, n):
+        if n not in self._word_ngram_lists:
+            self._word_ngram_lists[n] = [' '.join(self.tokens[i:i + n]) for i in range(len(self.tokens) - n + 1)]
+        return self._word_ngram_lists[n]
+
+    def word_ngram_set(self, n):
+        if n not in self._word_ngram_sets:
+            self._word_ngram_sets[n] = set(self.word_ngram_list(n))
+        return self._word_ngram_sets[n]
+
+    @property
+    def fuzzy_forms(self):
+        if self._fuzzy_forms is None:
+            self._fuzzy_forms = kernels.FuzzyForms(self)
+        return self._fuzzy_forms
+
+    def char_ngram_set(self, n):
+        if n not in self._char_ngram_sets:
+            self._char_ngram_sets[n] = set(self[i:i + n] for i in range(len(self) - n + 1))
+        return self._char_ngram_sets[n]
+
+
+def analyze(s, word_cut_func=None):
+    """return `s` as a TextAnalysis, reusing it if it already is one built with the same `word_cut_func`"""
+    if isinstance(s, TextAnalysis) and s.word_cut_func is word_cut_func:
+        return s
+    return TextAnalysis(s, word_cut_func)
 
 
 # length difference in word & char level
 def length_distance(s1: str, s2: str, word_cut_func=None):
-    s1_words = s1.split() if word_cut_func is None else word_cut_func(s1)
-    s2_words = s2.split() if word_cut_func is None else word_cut_func(s2)
+    s1_words = analyze(s1, word_cut_func).tokens
+    s2_words = analyze(s2, word_cut_func).tokens
     return [len(s1_words), len(s2_words), abs(len(s1_words)-len(s2_words)),
             min(len(s1_words), len(s2_words)) / max(len(s1_words), len(s2_words)),
             len(s1), len(s2), abs(len(s1)-len(s2)), min(len(s1), len(s2)) / max(len(s1), len(s2))]
@@ -33,14 +84,7 @@ def length_distance(s1: str, s2: str, word_cut_func=None):
 
 # longest common sequence
 def lcs_seq(s1: str, s2: str):
-    result = [[0 for _ in range(len(s2)+1)] for _ in range(len(s1) + 1)]
-    for i in range(1, len(s1)+1):
-        for j in range(1, len(s2)+1):
-            if s1[i-1] == s2[j-1]:  # be careful with index
-                result[i][j] = result[i-1][j-1] + 1
-            else:
-                result[i][j] = max(result[i-1][j], result[i][j-1])
-    return result[len(s1)][len(s2)]
+    return kernels.lcs_seq_length(s1, s2)
 
 
 def lcs_seq_norm(s1: str, s2: str):
@@ -51,14 +95,7 @@ def lcs_seq_norm(s1: str, s2: str):
 
 # longest common substring
 def lcs_str(s1: str, s2: str):
-    max_len = 0
-    result = [[0 for _ in range(len(s2) + 1)] for _ in range(len(s1) + 1)]
-    for i in range(1, len(s1)+1):
-        for j in range(1, len(s2)+1):
-            if s1[i-1] == s2[j-1]:  # be careful with index
-                result[i][j] = result[i-1][j-1] + 1
-            max_len = max(max_len, result[i][j])
-    return max_len
+    return kernels.lcs_str_length(s1, s2)
 
 
 def lcs_str_norm(s1, s2):
@@ -66,27 +103,9 @@ def lcs_str_norm(s1, s2):
     return 2 * l / (len(s1) + len(s2))
 
 
-# longest common substring with o(1) space complexity
+# longest common substring with o(min(m, n)) space complexity
 def lcs_str_1(s1: str, s2: str):
-    max_len = 0
-    m, n = len(s1), len(s2)
-    row, column = 0, n-1
-    while row < m:
-        i, j = row, column
-        tmp_len = 0
-        while i < m and j < n:
-            if s1[i] == s2[j]:
-                tmp_len += 1
-            else:
-                tmp_len = 0
-            max_len = max(max_len, tmp_len)
-            i += 1
-            j += 1
-        if column > 0:
-            column -= 1
-        else:
-            row += 1
-    return max_len
+    return kernels.lcs_str_length(s1, s2)
 
 
 def lcs_str_1_norm(s1, s2):
@@ -95,20 +114,7 @@ def lcs_str_1_norm(s1, s2):
 
 
 def edit_distance(s1: str, s2: str):
-    result = [[0 for _ in range(len(s2) + 1)] for _ in range(len(s1) + 1)]
-    for i in range(len(s1) + 1):
-        result[i][0] = i
-    for j in range(len(s2) + 1):
-        result[0][j] = j
-
-    for i in range(1, len(s1)+1):
-        for j in range(1, len(s2)+1):
-            if s1[i-1] == s2[j-1]:
-                result[i][j] = result[i-1][j-1]
-            else:
-                result[i][j] = min(result[i-1][j], result[i][j-1], result[i-1][j-1]) + 1
-
-    return result[len(s1)][len(s2)]
+    return kernels.edit_distance(s1, s2)
 
 
 def jaro_distance(s1: str, s2: str):
@@ -175,14 +181,9 @@ def other_distance(s1, s2):
 
 
 def fuzzy(s1, s2):
-    return [fuzz.ratio(s1, s2) / 100,
-            fuzz.partial_ratio(s1, s2) / 100,
-            fuzz.token_sort_ratio(s1, s2) / 100,
-            fuzz.partial_token_sort_ratio(s1, s2) / 100,
-            fuzz.token_set_ratio(s1, s2) / 100,
-            fuzz.partial_token_set_ratio(s1, s2) / 100,
-            fuzz.QRatio(s1, s2) / 100,
-            fuzz.WRatio(s1, s2) / 100]
+    """ratio, partial_ratio, token_sort_ratio, partial_token_sort_ratio, token_set_ratio, partial_token_set_ratio,
+    QRatio and WRatio of fuzzywuzzy, divided by 100"""
+    return kernels.fuzzy_scores(analyze(s1).fuzzy_forms, analyze(s2).fuzzy_forms)
 
 
 def simhash(s1, s2):
@@ -190,58 +191,72 @@ def simhash(s1, s2):
 
 
 def char_ngram_overlap(s1, s2, ngram_range=range(1, 6)):
-    def ngram(s, n):
-        return set(s[i:i + n] for i in range(len(s) - n + 1))
-
+    s1 = analyze(s1)
+    s2 = analyze(s2)
     overlap_ratio = []
     for n in ngram_range:
-        ngram_s1 = ngram(s1, n)
-        n_gram_s2 = ngram(s2, n)
+        ngram_s1 = s1.char_ngram_set(n)
+        n_gram_s2 = s2.char_ngram_set(n)
         overlap_ratio.extend([2 * len(ngram_s1 & n_gram_s2) / (len(ngram_s1) + len(n_gram_s2)),
                               len(ngram_s1 & n_gram_s2) / len(ngram_s1 | n_gram_s2)])
     return overlap_ratio
 
 
 def word_ngram_overlap(s1, s2, ngram_range=(1, 4), word_cut_func=None):
-    def ngram(s, n):
-        return set(' '.join(s[i:i + n]) for i in range(len(s) - n + 1))
-
-    s1 = s1.split() if word_cut_func is None else word_cut_func(s1)
-    s2 = s2.split() if word_cut_func is None else word_cut_func(s2)
+    s1 = analyze(s1, word_cut_func)
+    s2 = analyze(s2, word_cut_func)
     overlap_ratio = []
     for n in ngram_range:
-        ngram_s1 = ngram(s1, n)
-        n_gram_s2 = ngram(s2, n)
+        ngram_s1 = s1.word_ngram_set(n)
+        n_gram_s2 = s2.word_ngram_set(n)
         overlap_ratio.extend([2 * len(ngram_s1 & n_gram_s2) / (len(ngram_s1) + len(n_gram_s2)),
                               len(ngram_s1 & n_gram_s2) / len(ngram_s1 | n_gram_s2)])
     return overlap_ratio
 
 
-def word_ngram_distance(s1, s2, ngram_range=(1, 4), word_cut_func=None):
-    def ngram(s, n):
-        return [' '.join(s[i:i + n]) for i in range(len(s) - n + 1)]
+def _char_count_vectors(texts):
+    """count vector of every text over the characters appearing in `texts`, shaped [len(texts), n_chars]"""
+    lengths = np.array([len(text) for text in texts], dtype=np.int64)
+    codes = np.frombuffer(''.join(texts).encode('utf-32-le'), dtype=np.uint32)
+    _, char_ids = np.unique(codes, return_inverse=True)
+    counts = np.zeros((len(texts), char_ids.max() + 1 if len(char_ids) else 0), dtype=np.int64)
+    np.add.at(counts, (np.repeat(np.arange(len(texts)), lengths), char_ids.ravel()), 1)
+    return counts, lengths
+
+
+def quick_ratio_distance_matrix(texts_1, texts_2):
+    """
+    1 - SequenceMatcher(None, t1, t2, False).quick_ratio() for every (t1, t2) in texts_1 x texts_2, shaped
+    [len(texts_1), len(texts_2)]. quick_ratio is 2 * M / (len(t1) + len(t2)), M being the size of the multiset
+    intersection of their characters, which is the min-sum of their character count vectors.
+    """
+    counts, lengths = _char_count_vectors(texts_1 + texts_2)
+    counts_1, counts_2 = counts[:len(texts_1)], counts[len(texts_1):]
+    lengths_1, lengths_2 = lengths[:len(texts_1)], lengths[len(texts_1):]
+    matches = np.minimum(counts_1[:, np.newaxis, :], counts_2[np.newaxis, :, :]).sum(axis=-1)
+    total_len = lengths_1[:, np.newaxis] + lengths_2[np.newaxis, :]
+    # quick_ratio of two empty strings is 1.
+    ratio = np.where(total_len > 0, 2.0 * matches / np.maximum(total_len, 1), 1.0)
+    return 1. - ratio
+
 
-    s1 = s1.split() if word_cut_func is None else word_cut_func(s1)
-    s2 = s2.split() if word_cut_func is None else word_cut_func(s2)
+def word_ngram_distance(s1, s2, ngram_range=(1, 4), word_cut_func=None):
+    s1 = analyze(s1, word_cut_func)
+    s2 = analyze(s2, word_cut_func)
     aggregation_modes_outer = [np.mean, np.max, np.min, np.median]
     aggregation_modes_inner = [np.mean, np.std, np.max, np.min, np.median]
 
     ngram_distance = list()
     for n in ngram_range:
-        ngram_s1 = ngram(s1, n)
-        n_gram_s2 = ngram(s2, n)
-        val_list = list()
-        for w1 in ngram_s1:
-            _val_list = list()
-            for w2 in n_gram_s2:
-                dist = 1. - SequenceMatcher(None, w1, w2, False).quick_ratio()
-                _val_list.append(dist)
-            if len(_val_list) == 0:
-                _val_list = [-1.]
-            val_list.append(_val_list)
-        if len(val_list) == 0:
-            val_list = [[-1.]]
-        ngram_distance.extend([mode_outer(mode_inner(np.array(val_list), axis=1))
+        ngram_s1 = s1.word_ngram_list(n)
+        n_gram_s2 = s2.word_ngram_list(n)
+        if len(ngram_s1) == 0:
+            val_matrix = np.array([[-1.]])
+        elif len(n_gram_s2) == 0:
+            val_matrix = np.full((len(ngram_s1), 1), -1.)
+        else:
+            val_matrix = quick_ratio_distance_matrix(ngram_s1, n_gram_s2)
+        ngram_distance.extend([mode_outer(mode_inner(val_matrix, axis=1))
                                for mode_inner in aggregation_modes_inner for mode_outer in aggregation_modes_outer])
     return ngram_distance
 
@@ -280,12 +295,34 @@ def weighted_word_ngram_overlap(s1, s2, ngram_range=(1, 3)):
     return overlap_ratio
 
 
-def word_share(s1, s2, word_cut_func=None):
-    s1_words = s1.split() if word_cut_func is None else word_cut_func(s1)
-    s2_words = s2.split() if word_cut_func is None else word_cut_func(s2)
+def word_power_factors(power_stats, num_least=100):
+    """
+    factor every word contributes to the word power rates of a pair, 1.0 for words below the count threshold
+    :param power_stats: array of shape (vocab, 7), statistics of words computed by `prepare_features.Feature.get_power_word`
+    :param num_least: only words appearing in more than `num_least` one-side (resp. both-side) pairs are considered
+    :return: factor of a shared word, factor of a non-shared word
+    """
+    shared_factor = np.where(power_stats[:, 0] * power_stats[:, 5] < num_least, 1.0, 1.0 - power_stats[:, 6])
+    diff_factor = np.where(power_stats[:, 0] * power_stats[:, 3] < num_least, 1.0, 1.0 - power_stats[:, 4])
+    return shared_factor, diff_factor
 
-    s1_words_count = dict(Counter(s1_words).most_common())
-    s2_words_count = dict(Counter(s2_words).most_common())
+
+def word_power_rate(s1, s2, word2idx, power_factors, word_cut_func=None):
+    """
+    :param word2idx: word --> row index of the word power statistics
+    :param power_factors: factors of shared & non-shared words, returned by `word_power_factors`
+    """
+    s1_words = set(analyze(s1, word_cut_func).tokens)
+    s2_words = set(analyze(s2, word_cut_func).tokens)
+    shared_ids = [word2idx[word] for word in s1_words.intersection(s2_words) if word in word2idx]
+    diff_ids = [word2idx[word] for word in s1_words.difference(s2_words) if word in word2idx]
+    # 共享词但是语句对不是正确的（label!=2）, 非共享词但是语句对是正确的（label=2）
+    return [1 - np.prod(power_factors[0][shared_ids]), 1 - np.prod(power_factors[1][diff_ids])]
+
+
+def word_share(s1, s2, word_cut_func=None):
+    s1_words_count = analyze(s1, word_cut_func).token_counts
+    s2_words_count = analyze(s2, word_cut_func).token_counts
 
     n_shared_word_in_s1 = sum([s1_words_count[w] for w in s1_words_count if w in s2_words_count])
     n_shared_word_in_s2 = sum([s2_words_count[w] for w in s2_words_count if w in s1_words_count])
@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+@author: alexyang
+
+@contact: alex.yang0326@gmail.com
+
+@file: graph.py
+
+@time: 2019/4/23 14:18
+
+@desc: graph features of sentence pairs computed on a sparse (csr) adjacency matrix of the sentence graph
+
+"""
+
+import heapq
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse import csgraph, linalg
+
+
+def adjacency_matrix(n_nodes, src, dst, weights):
+    """
+    symmetric csr adjacency matrix of an undirected weighted graph, given its edge list. Edges of weight 0 are kept as
+    explicit entries, and a self-loop is one entry on the diagonal.
+    """
+    src, dst = np.asarray(src, dtype=np.int64), np.asarray(dst, dtype=np.int64)
+    weights = np.asarray(weights, dtype=np.float64)
+    loop = src == dst
+    rows = np.concatenate([src, dst[~loop]])
+    cols = np.concatenate([dst, src[~loop]])
+    data = np.concatenate([weights, weights[~loop]])
+    # keep the weight of the last occurrence of a duplicated edge (in either direction), as `Graph.add_edge` does
+    edge_idx = np.arange(len(src))
+    order = np.lexsort((np.concatenate([edge_idx, edge_idx[~loop]]), cols, rows))
+    rows, cols, data = rows[order], cols[order], data[order]
+    last = np.ones(len(rows), dtype=bool)
+    last[:-1] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(rows[last], minlength=n_nodes))])
+    return sparse.csr_matrix((data[last], cols[last], indptr), shape=(n_nodes, n_nodes))
+
+
+def save_graph(filename, n_nodes, src, dst, weights):
+    """save the edge list of a graph as npz"""
+    np.savez(filename, n_nodes=n_nodes, src=np.asarray(src, dtype=np.int32),
+                        dst=np.asarray(dst, dtype=np.int32), weights=np.asarray(weights, dtype=np.float64))
+    print('Logging Info - Saved:', filename)
+
+
+def load_graph(filename):
+    """csr adjacency matrix of a graph saved by `save_graph`"""
+    with np.load(filename) as edges:
+        adj = adjacency_matrix(int(edges['n_nodes']), edges['src'], edges['dst'], edges['weights'])
+    print('Logging Info - Loaded:', filename)
+    return adj
+
+
+def graph_to_adjacency(graph, n_nodes):
+    """csr adjacency matrix of a networkx graph whose nodes are 0 .. n_nodes-1"""
+    src, dst, weights = zip(*graph.edges(data='weight')) if graph.number_of_edges() else ((), (), ())
+    return adjacency_matrix(n_nodes, src, dst, weights)
+
+
+def edge_structure(adj, with_loops=True):
+    """0/1 csr matrix of the edges of `adj`, explicit zero weights included"""
+    structure = sparse.csr_matrix((np.ones(len(adj.indices)), adj.indices, adj.indptr), shape=adj.shape)
+    if not with_loops:
+        structure.setdiag(0)
+        structure.eliminate_zeros()
+    return structure
+
+
+def degrees(adj):
+    """node degrees, a self-loop counts twice (same as networkx)"""
+    return np.diff(adj.indptr) + (edge_structure(adj).diagonal() > 0)
+
+
+def connected_components(adj):
+    """component label of every node and size of every component"""
+    _, labels = csgraph.connected_components(edge_structure(adj), directed=False)
+    return labels, np.bincount(labels)
+
+
+def bridges(adj):
+    """
+    (u, v) arrays with u < v of the bridges of an undirected graph, edges on no cycle: removing one disconnects its
+    two ends. Iterative Tarjan's lowlink dfs on the csr arrays, linear in the size of the graph.
+    """
+    structure = edge_structure(adj, with_loops=False)
+    indptr, indices = structure.indptr.tolist(), structure.indices.tolist()
+    n_nodes = adj.shape[0]
+    discovery, low = [-1] * n_nodes, [0] * n_nodes
+    found_src, found_dst = [], []
+    timer = 0
+    for root in range(n_nodes):
+        if discovery[root] != -1:
+            continue
+        discovery[root] = low[root] = timer
+        timer += 1
+        stack = [[root, -1, indptr[root]]]     # node, its dfs parent, next neighbour position
+        while stack:
+            frame = stack[-1]
+            u, parent, j = frame
+            if j < indptr[u+1]:
+                frame[2] += 1
+                v = indices[j]
+                if v == parent:     # adjacency is simple, the tree edge back to the parent is the only one
+                    continue
+                if discovery[v] == -1:
+                    discovery[v] = low[v] = timer
+                    timer += 1
+                    stack.append([v, u, indptr[v]])
+                elif discovery[v] < low[u]:
+                    low[u] = discovery[v]
+            else:
+                stack.pop()
+                if parent != -1:
+                    if low[u] < low[parent]:
+                        low[parent] = low[u]
+                    if low[u] > discovery[parent]:
+                        found_src.append(min(u, parent))
+                        found_dst.append(max(u, parent))
+    return np.array(found_src, dtype=np.int64), np.array(found_dst, dtype=np.int64)
+
+
+def pagerank(adj, alpha=0.85, max_iter=100, tol=1e-06):
+    """weighted pagerank by power iteration, same as `networkx.pagerank` (uniform teleport & dangling distribution)"""
+    n_nodes = adj.shape[0]
+    out_weights = np.asarray(adj.sum(axis=1)).ravel()
+    inv_weights = np.divide(1.0, out_weights, out=np.zeros(n_nodes), where=out_weights != 0)
+    transition = sparse.diags(inv_weights).dot(adj).T.tocsr()
+    dangling = out_weights == 0
+
+    x = np.full(n_nodes, 1.0 / n_nodes)
+    for _ in range(max_iter):
+        x_last = x
+        x = alpha * (transition.dot(x_last) + x_last[dangling].sum() / n_nodes) + (1 - alpha) / n_nodes
+        if np.abs(x - x_last).sum() < n_nodes * tol:
+            return x
+    print('Logging Warning - pagerank not converged in {} iterations'.format(max_iter))
+    return x
+
+
+def hits(adj, max_iter=100, tol=1e-08):
+    """
+    weighted hubs & authorities, normalized to sum 1, same as `networkx.hits`: the principal singular vectors of the
+    adjacency matrix, found by lanczos iterations (plain power iteration converges too slowly on sentence graphs, whose
+    top singular values are close)
+    """
+    n_nodes = adj.shape[0]
+    if n_nodes < 3:
+        _, _, vt = np.linalg.svd(adj.toarray())
+    else:
+        # fixed start vector, so that the result is deterministic
+        _, _, vt = linalg.svds(adj, k=1, v0=np.ones(n_nodes), maxiter=max_iter, tol=tol)
+    # the principal singular vector of a nonnegative matrix is of constant sign. When the top singular value is not
+    # unique (e.g. two identical components) any mix of the vectors is valid: networkx returns a random one, keep it
+    # nonnegative here
+    a = np.abs(vt[0].real)
+    h = adj.dot(a)
+    return h / h.sum(), a / a.sum()
+
+
+class CliqueIndex(object):
+    """
+    Approximate clique statistics, without enumerating all maximal cliques (exponential in the worst case).
+    The cliques containing an edge (u, v) are (u, v) plus a clique of their common neighbours C:
+    - the max clique size is 2 + a clique of C grown greedily by degree inside C;
+    - the number of maximal cliques is the number of connected components of the subgraph induced by C (1 if C is
+      empty).
+    Both are exact when every component of C is itself a clique, as in most sentence graphs, and C is cut to
+    `max_candidates` nodes of highest degree to bound the cost on hubs. Edges without common neighbours, the vast
+    majority, get (2, 1) without any work.
+    """
+    def __init__(self, adj, max_candidates=32):
+        self.max_candidates = max_candidates
+        structure = edge_structure(adj, with_loops=False)
+        self.indptr, self.indices = structure.indptr, structure.indices
+        self.degree = np.diff(self.indptr)
+        self.neighbor_sets = dict()
+        self.edge_cliques = dict()      # (u, v) with u <= v --> (max clique size, number of maximal cliques)
+
+        # only the edges closing at least one triangle need more work. Intersecting neighbour sets costs the smaller
+        # degree per edge, where the masked product A * A^2 would materialize deg^2 entries around every hub
+        rows = np.repeat(np.arange(len(self.degree)), self.degree)
+        upper = rows < self.indices
+        degree = self.degree.tolist()
+        for u, v in zip(rows[upper].tolist(), self.indices[upper].tolist()):
+            if degree[u] > 1 and degree[v] > 1:
+                common = self.neighbor_set(u).intersection(self.neighbor_set(v))
+                if common:
+                    self.edge_cliques[(u, v)] = self.clique_stats(np.array(sorted(common)), 2)
+
+        self.node_max_clique = np.where(self.degree > 0, 2, 1)
+        for (u, v), (size, _) in self.edge_cliques.items():
+            self.node_max_clique[u] = max(self.node_max_clique[u], size)
+            self.node_max_clique[v] = max(self.node_max_clique[v], size)
+
+    def neighbors(self, u):
+        return self.indices[self.indptr[u]:self.indptr[u+1]]
+
+    def neighbor_set(self, u):
+        if u not in self.neighbor_sets:
+            self.neighbor_sets[u] = set(self.neighbors(u).tolist())
+        return self.neighbor_sets[u]
+
+    def clique_stats(self, candidates, base_size):
+        if len(candidates) == 0:
+            return base_size, 1
+        if len(candidates) > self.max_candidates:
+            candidates = candidates[np.argsort(-self.degree[candidates], kind='stable')[:self.max_candidates]]
+        candidates = candidates.tolist()
+
+        inner = {c: self.neighbor_set(c).intersection(candidates) for c in candidates}
+        clique = []
+        for c in sorted(candidates, key=lambda c: -len(inner[c])):
+            if all(c in inner[member] for member in clique):
+                clique.append(c)
+
+        # connected components of the candidates
+        n_components, seen = 0, set()
+        for c in candidates:
+            if c in seen:
+                continue
+            n_components += 1
+            stack = [c]
+            seen.add(c)
+            while stack:
+                for nb in inner[stack.pop()]:
+                    if nb not in seen:
+                        seen.add(nb)
+                        stack.append(nb)
+        return base_size + len(clique), n_components
+
+    def edge(self, u, v):
+        """(max clique size, number of maximal cliques) of the cliques containing both u and v"""
+        if u == v:
+            # every clique of u
+            return self.clique_stats(self.neighbors(u), 1)
+        return self.edge_cliques.get((min(u, v), max(u, v)), (2, 1))
+
+
+class ShortestPaths(object):
+    """
+    Weighted shortest path length between two nodes without using their direct edge, -1 if there is none, by a
+    bidirectional dijkstra on the csr arrays. With `max_hops`, each side of the search is cut at half of it, so it stays
+    local on large graphs: paths with more hops are not considered and the pair may get -1 or a longer path.
+    A path between the two ends of an edge that avoids the edge closes a cycle with it, so it only uses edges lying on
+    cycles: pairs joined by a bridge (most premise-hypothesis edges) get -1 without any search, and the other pairs
+    joined by an edge are searched on the graph without its bridges, which is much smaller. Both are exact.
+    """
+    def __init__(self, adj, max_hops=None):
+        self.max_hops = max_hops
+        self.n_nodes = adj.shape[0]
+        bridge_src, bridge_dst = bridges(adj)
+        self.bridge_keys = np.sort(bridge_src * self.n_nodes + bridge_dst)
+
+        rows = np.repeat(np.arange(self.n_nodes), np.diff(adj.indptr))
+        self.edge_keys = np.sort(rows * self.n_nodes + adj.indices)
+        keep = ~np.isin(np.minimum(rows, adj.indices) * self.n_nodes + np.maximum(rows, adj.indices),
+                        self.bridge_keys)
+        core_indptr = np.concatenate([[0], np.cumsum(np.bincount(rows[keep], minlength=self.n_nodes))])
+        self.graph = (adj.indptr.tolist(), adj.indices.tolist(), adj.data.tolist())
+        self.core = (core_indptr.tolist(), adj.indices[keep].tolist(), adj.data[keep].tolist())
+
+    def is_edge(self, sources, targets):
+        keys = np.asarray(sources, dtype=np.int64) * self.n_nodes + np.asarray(targets, dtype=np.int64)
+        return np.isin(keys, self.edge_keys)
+
+    def is_bridge(self, sources, targets):
+        sources, targets = np.asarray(sources, dtype=np.int64), np.asarray(targets, dtype=np.int64)
+        return np.isin(np.minimum(sources, targets) * self.n_nodes + np.maximum(sources, targets), self.bridge_keys)
+
+    def length(self, source, target):
+        if source == target:
+            return 0
+        if self.is_edge(source, target):
+            return -1 if self.is_bridge(source, target) else self.search(self.core, source, target)
+        return self.search(self.graph, source, target)
+
+    def search(self, arrays, source, target):
+        """bidirectional dijkstra between source and target on csr `arrays`, skipping their direct edge"""
+        indptr, indices, weights = arrays
+        inf = float('inf')
+        max_hops = [inf, inf] if self.max_hops is None else [(self.max_hops + 1) // 2, self.max_hops // 2]
+        dists = [{source: 0.0}, {target: 0.0}]
+        heaps = [[(0.0, 0, source)], [(0.0, 0, target)]]
+        best = inf
+        while heaps[0] and heaps[1] and heaps[0][0][0] + heaps[1][0][0] < best:
+            side = 0 if len(heaps[0]) <= len(heaps[1]) else 1   # grow the smaller frontier
+            dist, other_dist = dists[side], dists[1 - side]
+            d, hops, u = heapq.heappop(heaps[side])
+            if d > dist[u] or hops >= max_hops[side]:
+                continue
+            for j in range(indptr[u], indptr[u+1]):
+                v = indices[j]
+                if (u == source and v == target) or (u == target and v == source):
+                    continue
+                nd = d + weights[j]
+                if nd < dist.get(v, inf):
+                    dist[v] = nd
+                    heapq.heappush(heaps[side], (nd, hops + 1, v))
+                if v in other_dist:
+                    best = min(best, nd + other_dist[v])
+        return best if best < inf else -1
+
+    def lengths(self, sources, targets):
+        """lengths of a batch of pairs, bridges are answered at once and each other distinct pair is searched once"""
+        sources, targets = np.asarray(sources, dtype=np.int64), np.asarray(targets, dtype=np.int64)
+        is_edge = self.is_edge(sources, targets)
+        lengths = np.where(sources == targets, 0., -1.)
+        to_search = np.flatnonzero((sources != targets) & ~(is_edge & self.is_bridge(sources, targets)))
+        cache = dict()
+        for i, source, target, on_edge in zip(to_search.tolist(), sources[to_search].tolist(),
+                                              targets[to_search].tolist(), is_edge[to_search].tolist()):
+            key = (min(source, target), max(source, target))
+            if key not in cache:
+                cache[key] = self.search(self.core if on_edge else self.graph, source, target)
+            lengths[i] = cache[key]
+        return lengths
+
+
+class GraphFeatures(object):
+    """
+    Global statistics of the sentence graph (degree, cliques, connected components, pagerank, hits), computed once on
+    its csr adjacency matrix, and the 25 graph features of sentence pairs gathered from them.
+    """
+    def __init__(self, adj, pagerank_alpha=0.9, max_iter=100, max_candidates=32, max_hops=None):
+        self.adj = adj
+        self.n_nodes = adj.shape[0]
+        self.pagerank_alpha = pagerank_alpha
+        self.degree = degrees(adj)
+        self.cliques = CliqueIndex(adj, max_candidates)
+        self.shortest_paths = ShortestPaths(adj, max_hops)
+        self.cc_labels, self.cc_sizes = connected_components(adj)
+        self.pagerank = pagerank(adj, alpha=pagerank_alpha, max_iter=max_iter)
+        self.hits_h, self.hits_a = hits(adj, max_iter=max_iter)
+
+    def has_edge(self, u, v):
+        neighbors = self.adj.indices[self.adj.indptr[u]:self.adj.indptr[u+1]]
+        return bool(np.any(neighbors == v))
+
+    def pair_features(self, p_ids, h_ids):
+        """graph features of the (premise, hypothesis) pairs given by their node ids, the pairs must be edges"""
+        p_ids, h_ids = np.asarray(p_ids, dtype=np.int64), np.asarray(h_ids, dtype=np.int64)
+
+        # graph in-degree fetures
+        indegree_features = [self.degree[p_ids], self.degree[h_ids]]
+
+        # clique features
+        edge_cliques = np.array([self.cliques.edge(p, h) for p, h in zip(p_ids.tolist(), h_ids.tolist())],
+                                dtype=np.float64).reshape(-1, 2)
+        lnode = self.cliques.node_max_clique[p_ids]
+        rnode = self.cliques.node_max_clique[h_ids]
+        clique_features = [edge_cliques[:, 0], edge_cliques[:, 1], lnode, rnode, np.maximum(lnode, rnode),
+                           np.minimum(lnode, rnode)]
+
+        # connected components features
+        cc_features = [self.cc_sizes[self.cc_labels[p_ids]]]
+
+        # page rank features
+        pr1, pr2 = self.pagerank[p_ids] * 1e6, self.pagerank[h_ids] * 1e6
+        pagerank_features = [pr1, pr2, np.maximum(pr1, pr2), np.minimum(pr1, pr2), (pr1 + pr2) / 2.]
+
+        # graph hits features
+        h1, h2 = self.hits_h[p_ids] * 1e6, self.hits_h[h_ids] * 1e6
+        a1, a2 = self.hits_a[p_ids] * 1e6, self.hits_a[h_ids] * 1e6
+        hits_features = [h1, h2, a1, a2, np.maximum(h1, h2), np.maximum(a1, a2), np.minimum(h1, h2),
+                         np.minimum(a1, a2), (h1 + h2) / 2., (a1 + a2) / 2.]
+
+        # graph shortest path features
+        shortestpath_features = [self.shortest_paths.lengths(p_ids, h_ids)]
+
+        return np.stack(indegree_features + clique_features + cc_features + pagerank_features + hits_features +
+                        shortestpath_features, axis=-1).astype(np.float64)
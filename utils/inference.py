@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+@author: alexyang
+
+@contact: alex.yang0326@gmail.com
+
+@file: inference.py
+
+@time: 2019/4/24 11:05
+
+@desc: thin loader running the frozen graphs written by export.py, it only depends on numpy & tensorflow
+
+"""
+
+import os
+import json
+
+import numpy as np
+import tensorflow as tf
+
+
+class FrozenNLIModel(object):
+    """
+    Run predictions with a model exported by `export.export_model`. Raw (premise, hypothesis) text is turned into id
+    matrices the way preprocess.py did (keras Tokenizer.texts_to_sequences, then pad_sequences), from the settings
+    saved in the spec, without keras, the model code or the embedding backends. Unlike preprocess.py, a sentence
+    without any known token is left fully padded instead of getting a random token.
+    """
+    def __init__(self, spec_file, session_config=None):
+        """
+        :param spec_file: spec written by `export.export_model`, the frozen graph it names is in the same directory
+        """
+        with open(spec_file, 'r') as reader:
+            self.spec = json.load(reader)
+        graph_file = os.path.join(os.path.dirname(spec_file), self.spec['graph_file'])
+        graph_def = tf.GraphDef()
+        with open(graph_file, 'rb') as reader:
+            graph_def.ParseFromString(reader.read())
+
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+        self.session = tf.Session(graph=self.graph, config=session_config)
+        self.inputs = dict((name, self.graph.get_tensor_by_name(tensor_name))
+                           for name, tensor_name in self.spec['inputs'].items())
+        self.output = self.graph.get_tensor_by_name(self.spec['outputs']['probabilities'])
+
+        self.max_len = self.spec['max_len']
+        self.labels = self.spec['labels']
+        tokenizer = self.spec['tokenizer']
+        self.word_index = tokenizer['word_index']
+        self.oov_index = self.word_index.get(tokenizer['oov_token']) if tokenizer['oov_token'] is not None else None
+        # every filtered character is replaced by `split` (which may be several characters long), as keras does
+        self.translate_map = str.maketrans(dict((c, tokenizer['split']) for c in tokenizer['filters']))
+        print('Logging Info - Loaded:', graph_file)
+
+    @property
+    def need_features(self):
+        return 'features' in self.inputs
+
+    def text_to_ids(self, text):
+        """same as `keras.preprocessing.text.Tokenizer.texts_to_sequences` for one text"""
+        tokenizer = self.spec['tokenizer']
+        if tokenizer['lower']:
+            text = text.lower()
+        if tokenizer['char_level']:
+            words = text
+        else:
+            words = [word for word in text.translate(self.translate_map).split(tokenizer['split']) if word]
+        ids = []
+        for word in words:
+            idx = self.word_index.get(word)
+            if idx is not None and not (tokenizer['num_words'] and idx >= tokenizer['num_words']):
+                ids.append(idx)
+            elif self.oov_index is not None:
+                ids.append(self.oov_index)
+        return ids
+
+    def texts_to_matrix(self, texts):
+        """ids of texts padded & truncated to max_len, same as `keras.preprocessing.sequence.pad_sequences`"""
+        matrix = np.zeros((len(texts), self.max_len), dtype=np.int32)
+        for i, text in enumerate(texts):
+            ids = self.text_to_ids(text)
+            ids = ids[:self.max_len] if self.spec['truncating'] == 'post' else ids[-self.max_len:]
+            if not ids:
+                continue
+            if self.spec['padding'] == 'post':
+                matrix[i, :len(ids)] = ids
+            else:
+                matrix[i, -len(ids):] = ids
+        return matrix
+
+    def predict_ids(self, premise_ids, hypothesis_ids, features=None, batch_size=512):
+        """class probabilities of pairs given as padded id matrices, [n_pairs, n_class]"""
+        if self.need_features and features is None:
+            raise ValueError('Model {} needs statistical features as input'.format(self.spec['exp_name']))
+        probabilities = []
+        for start in range(0, len(premise_ids), batch_size):
+            feed_dict = {self.inputs['premise']: premise_ids[start:start+batch_size],
+                         self.inputs['hypothesis']: hypothesis_ids[start:start+batch_size]}
+            if self.need_features:
+                feed_dict[self.inputs['features']] = features[start:start+batch_size]
+            probabilities.append(self.session.run(self.output, feed_dict))
+        return np.concatenate(probabilities) if probabilities else np.zeros((0, len(self.labels)))
+
+    def predict(self, premises, hypotheses, features=None, batch_size=512):
+        """class probabilities of raw (premise, hypothesis) pairs, tokenized like the processed data"""
+        return self.predict_ids(self.texts_to_matrix(premises), self.texts_to_matrix(hypotheses), features,
+                                batch_size)
+
+    def predict_labels(self, premises, hypotheses, features=None, batch_size=512):
+        probabilities = self.predict(premises, hypotheses, features, batch_size)
+        return [self.labels[idx] for idx in np.argmax(probabilities, axis=-1)]
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,407 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+@author: alexyang
+
+@contact: alex.yang0326@gmail.com
+
+@file: kernels.py
+
+@time: 2019/4/20 10:12
+
+@desc: fast kernels for pairwise string features, with O(min(m, n)) memory, and batched sentence signatures
+
+"""
+
+import re
+import zlib
+import hashlib
+
+import numpy as np
+from scipy import sparse
+from fuzzywuzzy import utils as fuzz_utils
+from fuzzywuzzy.fuzz import SequenceMatcher
+try:
+    import Levenshtein
+except ImportError:
+    Levenshtein = None
+
+
+def _char_masks(s: str):
+    """bit mask of the positions of each character in `s` (bit i set when s[i] == c)"""
+    masks = dict()
+    bit = 1
+    for c in s:
+        masks[c] = masks.get(c, 0) | bit
+        bit <<= 1
+    return masks
+
+
+def _shorter_last(s1, s2):
+    return (s1, s2) if len(s1) >= len(s2) else (s2, s1)
+
+
+# longest common sequence, bit-parallel (Hyyrö, 2004)
+def lcs_seq_length(s1: str, s2: str):
+    s1, s2 = _shorter_last(s1, s2)   # the shorter string is the bit vector
+    if len(s2) == 0:
+        return 0
+    masks = _char_masks(s2)
+    all_ones = (1 << len(s2)) - 1
+    v = all_ones
+    for c in s1:
+        u = v & masks.get(c, 0)
+        v = ((v + u) | (v - u)) & all_ones
+    # every zero bit of v is one more matched character
+    return len(s2) - bin(v).count('1')
+
+
+# levenshtein distance, bit-parallel (Myers, 1999; Hyyrö, 2001)
+def edit_distance(s1: str, s2: str):
+    s1, s2 = _shorter_last(s1, s2)
+    m = len(s2)
+    if m == 0:
+        return len(s1)
+    masks = _char_masks(s2)
+    all_ones = (1 << m) - 1
+    last_bit = 1 << (m - 1)
+    vp, vn, score = all_ones, 0, m
+    for c in s1:
+        eq = masks.get(c, 0)
+        d0 = (((eq & vp) + vp) ^ vp) | eq | vn
+        hp = vn | ~(d0 | vp)
+        hn = vp & d0
+        if hp & last_bit:
+            score += 1
+        elif hn & last_bit:
+            score -= 1
+        hp = (hp << 1) | 1
+        hn <<= 1
+        vp = (hn | ~(d0 | hp)) & all_ones
+        vn = hp & d0 & all_ones
+    return score
+
+
+# longest common substring, one vectorized dp row per character of the longer string
+def lcs_str_length(s1: str, s2: str):
+    s1, s2 = _shorter_last(s1, s2)
+    if len(s2) == 0:
+        return 0
+    codes = np.frombuffer(s2.encode('utf-32-le'), dtype=np.uint32)
+    char_match = dict()
+    prev = np.zeros(len(s2) + 1, dtype=np.int32)
+    cur = np.zeros(len(s2) + 1, dtype=np.int32)
+    max_len = 0
+    for c in s1:
+        if c not in char_match:
+            char_match[c] = codes == ord(c)
+        # length of the common substring ending at (c, s2[j-1]) is 1 + the one ending one step before on both sides
+        np.multiply(prev[:-1] + 1, char_match[c], out=cur[1:])
+        max_len = max(max_len, int(cur.max()))
+        prev, cur = cur, prev
+    return max_len
+
+
+def _batch(kernel, s1_list, s2_list):
+    assert len(s1_list) == len(s2_list)
+    return np.array([kernel(s1, s2) for s1, s2 in zip(s1_list, s2_list)], dtype=np.int64)
+
+
+def lcs_seq_length_batch(s1_list, s2_list):
+    return _batch(lcs_seq_length, s1_list, s2_list)
+
+
+def lcs_str_length_batch(s1_list, s2_list):
+    return _batch(lcs_str_length, s1_list, s2_list)
+
+
+def edit_distance_batch(s1_list, s2_list):
+    return _batch(edit_distance, s1_list, s2_list)
+
+
+def _gather_ranges(starts, lengths, rows):
+    """positions of the concatenated ranges [starts[r], starts[r] + lengths[r]) of `rows`, and the index of their row"""
+    lens = lengths[rows]
+    owner = np.repeat(np.arange(len(rows)), lens)
+    offsets = np.arange(len(owner)) - np.repeat(np.cumsum(lens) - lens, lens)
+    return np.repeat(starts[rows], lens) + offsets, owner
+
+
+def _ngram_overlap(token_ids, lengths, p_rows, h_rows, ngram_range):
+    """
+    dice & jaccard ratios between the n-gram sets of sequences p_rows[j] and h_rows[j] for every pair j, shaped
+    [n_pairs, 2 * len(ngram_range)]. N-grams are interned to dense ids one length at a time, the id of an n-gram
+    being the one of the pair ((n-1)-gram id, last token), so no hash collision can happen.
+    """
+    n_seqs, n_pairs, total = len(lengths), len(p_rows), len(token_ids)
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+    owner = np.repeat(np.arange(n_seqs), lengths)
+    pos = np.arange(total) - starts[owner]
+    vocab_size = int(token_ids.max()) + 1 if total else 1
+
+    ratios = np.empty((n_pairs, 2 * len(ngram_range)))
+    gram_ids = np.full(total, -1, dtype=np.int64)
+    for n in range(1, max(ngram_range) + 1):
+        starts_gram = np.nonzero(pos + n <= lengths[owner])[0]     # positions where an n-gram starts
+        if n == 1:
+            keys = token_ids[starts_gram]
+        else:
+            keys = gram_ids[starts_gram] * vocab_size + token_ids[starts_gram + n - 1]
+        gram_ids = np.full(total, -1, dtype=np.int64)
+        _, gram_ids[starts_gram] = np.unique(keys, return_inverse=True)
+        if n not in ngram_range:
+            continue
+
+        # n-gram set of every sequence: sorted unique (sequence, n-gram) keys
+        n_grams = int(gram_ids.max()) + 1 if len(starts_gram) else 1
+        seq_keys = np.sort(owner[starts_gram] * n_grams + gram_ids[starts_gram])
+        seq_keys = seq_keys[np.concatenate([[True], seq_keys[1:] != seq_keys[:-1]])] if len(seq_keys) else seq_keys
+        set_sizes = np.bincount(seq_keys // n_grams, minlength=n_seqs)
+        set_starts = np.concatenate([[0], np.cumsum(set_sizes)[:-1]])
+        set_grams = seq_keys % n_grams
+
+        # size of the intersection of every pair: look up (pair, n-gram) keys of premise among those of hypothesis
+        p_pos, p_owner = _gather_ranges(set_starts, set_sizes, p_rows)
+        h_pos, h_owner = _gather_ranges(set_starts, set_sizes, h_rows)
+        p_keys = p_owner * n_grams + set_grams[p_pos]
+        h_keys = np.sort(h_owner * n_grams + set_grams[h_pos])
+        found = np.minimum(np.searchsorted(h_keys, p_keys), max(len(h_keys) - 1, 0))
+        matched = h_keys[found] == p_keys if len(h_keys) else np.zeros(len(p_keys), dtype=bool)
+        n_common = np.bincount(p_owner[matched], minlength=n_pairs)
+
+        n_total = set_sizes[p_rows] + set_sizes[h_rows]
+        if np.any(n_total == 0):
+            raise ZeroDivisionError('both sequences of a pair have no {}-gram'.format(n))
+        i = 2 * ngram_range.index(n)
+        ratios[:, i] = 2 * n_common / n_total
+        ratios[:, i + 1] = n_common / (n_total - n_common)
+    return ratios
+
+
+def _pair_rows(s1_list, s2_list):
+    """unique sequences of both lists, and the row of each sequence of both lists among them"""
+    assert len(s1_list) == len(s2_list)
+    seq2row = dict()
+    p_rows = np.array([seq2row.setdefault(s, len(seq2row)) for s in s1_list], dtype=np.int64)
+    h_rows = np.array([seq2row.setdefault(s, len(seq2row)) for s in s2_list], dtype=np.int64)
+    return list(seq2row.keys()), p_rows, h_rows
+
+
+def char_ngram_overlap_batch(s1_list, s2_list, ngram_range=range(1, 6), batch_size=50000):
+    """same as `utils.features.char_ngram_overlap` for every pair, shaped [n_pairs, 2 * len(ngram_range)]"""
+    ngram_range = list(ngram_range)
+    results = []
+    for start in range(0, len(s1_list), batch_size):
+        texts, p_rows, h_rows = _pair_rows(s1_list[start:start+batch_size], s2_list[start:start+batch_size])
+        lengths = np.array([len(text) for text in texts], dtype=np.int64)
+        codes = np.frombuffer(''.join(texts).encode('utf-32-le'), dtype=np.uint32)
+        _, char_ids = np.unique(codes, return_inverse=True)
+        results.append(_ngram_overlap(char_ids.ravel().astype(np.int64), lengths, p_rows, h_rows, ngram_range))
+    return np.concatenate(results) if results else np.empty((0, 2 * len(ngram_range)))
+
+
+def word_ngram_overlap_batch(s1_list, s2_list, ngram_range=(1, 4), word_cut_func=None, batch_size=50000):
+    """same as `utils.features.word_ngram_overlap` for every pair, shaped [n_pairs, 2 * len(ngram_range)]"""
+    ngram_range = list(ngram_range)
+    results = []
+    for start in range(0, len(s1_list), batch_size):
+        texts, p_rows, h_rows = _pair_rows(s1_list[start:start+batch_size], s2_list[start:start+batch_size])
+        sent_words = [text.split() if word_cut_func is None else word_cut_func(text) for text in texts]
+        lengths = np.array([len(words) for words in sent_words], dtype=np.int64)
+        word2idx = dict()
+        word_ids = np.array([word2idx.setdefault(word, len(word2idx)) for words in sent_words for word in words],
+                            dtype=np.int64)
+        results.append(_ngram_overlap(word_ids, lengths, p_rows, h_rows, ngram_range))
+    return np.concatenate(results) if results else np.empty((0, 2 * len(ngram_range)))
+
+
+# popcount of every byte value
+_BYTE_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def popcount(x):
+    """number of set bits of every element of a uint64 array"""
+    x = np.ascontiguousarray(x, dtype=np.uint64)
+    return _BYTE_POPCOUNT[x.view(np.uint8)].reshape(x.shape + (8,)).sum(axis=-1, dtype=np.int64)
+
+
+def hamming_distance(sig1, sig2):
+    """element-wise hamming distance between two arrays of 64-bit signatures"""
+    return popcount(np.bitwise_xor(np.asarray(sig1, dtype=np.uint64), np.asarray(sig2, dtype=np.uint64)))
+
+
+_SIMHASH_WORD = re.compile(r'[\w\u4e00-\u9fcc]+')
+
+
+def _simhash_shingles(text):
+    """char 4-grams of the letters of `text`, tokenized as `Simhash` does"""
+    content = ''.join(_SIMHASH_WORD.findall(text.lower()))
+    return [content[i:i + 4] for i in range(max(len(content) - 3, 1))]
+
+
+def simhash_signatures(texts):
+    """
+    64-bit simhash of every text as a uint64 array, the same fingerprints as `Simhash(text).value`: bit k is set when
+    more than half of the (weighted) 4-gram md5 hashes have their bit k set. Every distinct 4-gram is hashed once, and
+    the bit votes of all texts are one sparse product.
+    """
+    gram2idx = dict()
+    rows, cols = list(), list()
+    for i, text in enumerate(texts):
+        for gram in _simhash_shingles(text):
+            rows.append(i)
+            cols.append(gram2idx.setdefault(gram, len(gram2idx)))
+    counts = sparse.csr_matrix((np.ones(len(cols), dtype=np.int64), (rows, cols)),
+                               shape=(len(texts), len(gram2idx)))
+    # last 8 bytes of the md5 digest, bit 63 first
+    digests = b''.join(hashlib.md5(gram.encode('utf-8')).digest()[-8:] for gram in gram2idx)
+    gram_bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8)).reshape(len(gram2idx), 64).astype(np.int64)
+    votes = counts.dot(gram_bits)
+    bits = 2 * votes > np.asarray(counts.sum(axis=1))
+    return np.packbits(bits.astype(np.uint8), axis=1).view('>u8').ravel().astype(np.uint64)
+
+
+_MERSENNE_PRIME = (1 << 31) - 1
+
+
+def minhash_signatures(texts, num_perm=64, seed=2019, chunk_size=4096):
+    """
+    minhash signatures of the word sets of texts, array of shape (len(texts), num_perm). Each permutation is the
+    universal hash (a * x + b) mod (2^31 - 1) of the crc32 of a word; a text without words gets 2^31 - 1 everywhere.
+    """
+    rand = np.random.RandomState(seed)
+    a = rand.randint(1, _MERSENNE_PRIME, size=num_perm).astype(np.uint64)
+    b = rand.randint(0, _MERSENNE_PRIME, size=num_perm).astype(np.uint64)
+    signatures = np.full((len(texts), num_perm), _MERSENNE_PRIME, dtype=np.uint64)
+    for start in range(0, len(texts), chunk_size):
+        words = [set(text.split()) for text in texts[start:start+chunk_size]]
+        lens = np.array([len(w) for w in words], dtype=np.int64)
+        if lens.sum() == 0:
+            continue
+        x = np.fromiter((zlib.crc32(word.encode('utf-8')) for w in words for word in w), dtype=np.uint64,
+                        count=int(lens.sum())) % _MERSENNE_PRIME
+        # a, b, x < 2^31 so a * x + b fits in 64 bits
+        hashed = (x[:, None] * a[None, :] + b[None, :]) % _MERSENNE_PRIME
+        non_empty = np.nonzero(lens)[0]
+        offsets = np.concatenate([[0], np.cumsum(lens)[:-1]])[non_empty]
+        signatures[start + non_empty] = np.minimum.reduceat(hashed, offsets, axis=0)
+    return signatures
+
+
+def minhash_similarity(sig1, sig2):
+    """estimated jaccard similarity of the word sets, row-wise between two minhash signature arrays"""
+    return np.mean(np.asarray(sig1) == np.asarray(sig2), axis=-1)
+
+
+def _lev_ratio(s1, s2):
+    """`SequenceMatcher.ratio` as used by fuzzywuzzy"""
+    return SequenceMatcher(None, s1, s2).ratio()
+
+
+if Levenshtein is not None:
+    # fuzzywuzzy's SequenceMatcher wraps python-Levenshtein then, call it directly
+    _lev_ratio = Levenshtein.ratio
+
+
+def _fuzz_ratio(s1, s2):
+    """same as `fuzz.ratio`"""
+    if s1 == s2:
+        return 100
+    if not s1 or not s2:
+        return 0
+    return fuzz_utils.intr(100 * _lev_ratio(s1, s2))
+
+
+def _fuzz_partial_ratio(s1, s2):
+    """same as `fuzz.partial_ratio`"""
+    if s1 == s2:
+        return 100
+    if not s1 or not s2:
+        return 0
+    shorter, longer = (s1, s2) if len(s1) <= len(s2) else (s2, s1)
+    if Levenshtein is not None:
+        blocks = Levenshtein.matching_blocks(Levenshtein.opcodes(shorter, longer), shorter, longer)
+    else:
+        blocks = SequenceMatcher(None, shorter, longer).get_matching_blocks()
+    # blocks aligned at the same start give the same substring, score it once
+    best, starts = 0, set()
+    for block in blocks:
+        long_start = max(block[1] - block[0], 0)
+        if long_start in starts:
+            continue
+        starts.add(long_start)
+        r = _lev_ratio(shorter, longer[long_start:long_start+len(shorter)])
+        if r > .995:
+            return 100
+        best = max(best, r)
+    return fuzz_utils.intr(100 * best)
+
+
+class FuzzyForms(object):
+    """
+    the forms of a sentence the fuzzywuzzy scorers work on, computed once per sentence: the raw text, the processed
+    text (`full_process` with force_ascii), its sorted tokens joined by space and its token set.
+    """
+    __slots__ = ['raw', 'processed', 'sorted_tokens', 'token_set']
+
+    def __init__(self, text):
+        self.raw = str(text)
+        self.processed = fuzz_utils.full_process(self.raw, force_ascii=True)
+        tokens = self.processed.split()
+        self.sorted_tokens = ' '.join(sorted(tokens)).strip()
+        self.token_set = set(tokens)
+
+
+def _fuzz_token_set(forms1, forms2, ratio_func):
+    """same as `fuzz._token_set` on already processed forms"""
+    if not forms1.processed or not forms2.processed:
+        return 0
+    sorted_sect = ' '.join(sorted(forms1.token_set & forms2.token_set))
+    combined_1to2 = (sorted_sect + ' ' + ' '.join(sorted(forms1.token_set - forms2.token_set))).strip()
+    combined_2to1 = (sorted_sect + ' ' + ' '.join(sorted(forms2.token_set - forms1.token_set))).strip()
+    sorted_sect = sorted_sect.strip()
+    return max(ratio_func(sorted_sect, combined_1to2), ratio_func(sorted_sect, combined_2to1),
+               ratio_func(combined_1to2, combined_2to1))
+
+
+def fuzzy_scores(forms1, forms2):
+    """
+    ratio, partial_ratio, token_sort_ratio, partial_token_sort_ratio, token_set_ratio, partial_token_set_ratio, QRatio
+    and WRatio of fuzzywuzzy (divided by 100) between two `FuzzyForms`. WRatio is combined from the scores already
+    computed for the other ones instead of recomputing them. It's about 2x faster than the eight scorers: most of the
+    remaining cost is python-Levenshtein's ratio over the substrings of the partial ratios (~10 per partial ratio),
+    which scores can't avoid while staying identical to fuzzywuzzy.
+    """
+    ratio = _fuzz_ratio(forms1.raw, forms2.raw)
+    partial_ratio = _fuzz_partial_ratio(forms1.raw, forms2.raw)
+    token_sort = _fuzz_ratio(forms1.sorted_tokens, forms2.sorted_tokens)
+    partial_token_sort = _fuzz_partial_ratio(forms1.sorted_tokens, forms2.sorted_tokens)
+    token_set = _fuzz_token_set(forms1, forms2, _fuzz_ratio)
+    partial_token_set = _fuzz_token_set(forms1, forms2, _fuzz_partial_ratio)
+
+    p1, p2 = forms1.processed, forms2.processed
+    if not p1 or not p2:
+        q_ratio = w_ratio = 0
+    else:
+        q_ratio = _fuzz_ratio(p1, p2)
+        len_ratio = float(max(len(p1), len(p2))) / min(len(p1), len(p2))
+        if len_ratio < 1.5:
+            w_ratio = fuzz_utils.intr(max(q_ratio, token_sort * .95, token_set * .95))
+        else:
+            partial_scale = .6 if len_ratio > 8 else .90
+            w_ratio = fuzz_utils.intr(max(q_ratio, _fuzz_partial_ratio(p1, p2) * partial_scale,
+                                          partial_token_sort * .95 * partial_scale,
+                                          partial_token_set * .95 * partial_scale))
+    return [ratio / 100, partial_ratio / 100, token_sort / 100, partial_token_sort / 100, token_set / 100,
+            partial_token_set / 100, q_ratio / 100, w_ratio / 100]
+
+
+def fuzzy_batch(s1_list, s2_list):
+    """`fuzzy_scores` of every pair, shaped [n_pairs, 8], the forms of each unique sentence are computed once"""
+    forms = dict()
+    for text in s1_list + s2_list:
+        if text not in forms:
+            forms[text] = FuzzyForms(text)
+    return np.array([fuzzy_scores(forms[s1], forms[s2]) for s1, s2 in zip(s1_list, s2_list)],
+                    dtype=np.float64).reshape(-1, 8)
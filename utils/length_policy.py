@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+@author: alexyang
+
+@contact: alex.yang0326@gmail.com
+
+@file: length_policy.py
+
+@time: 2019/4/23 16:40
+
+@desc: choose the padding length of sequences by coverage, and estimate the compute it saves for every model family
+
+"""
+
+import os
+import json
+
+# model family of every model in train.py, by the layers that dominate its cost
+MODEL_FAMILIES = {
+    'KerasInfersent': 'rnn',
+    'KerasSiameseBiLSTM': 'rnn',
+    'KerasSiameseLSTMCNNModel': 'rnn',
+    'KerasRefinedSSAModel': 'rnn',
+    'KerasSiameseCNN': 'cnn',
+    'KerasIACNN': 'cnn',
+    'KerasDecomposable': 'attention',
+    'KerasEsim': 'rnn_attention'
+}
+
+
+def _bilstm_cost(seq_len, input_dim, units):
+    # 2 directions x 4 gates of (input_dim + units) x units mul-adds per step; gates, cell & hidden states are kept
+    return 16 * (input_dim + units) * units * seq_len, 12 * units * seq_len
+
+
+def _cross_attention_cost(seq_len, dim):
+    # L x L alignment scores and the weighted sum over them, both kept
+    return 4 * seq_len * seq_len * dim, 2 * seq_len * seq_len + seq_len * dim
+
+
+def sentence_cost(family, seq_len, embed_dim=300, units=300, filter_lengths=(2, 3, 4, 5)):
+    """
+    rough forward cost of encoding one sentence padded to `seq_len` (padded steps cost as much as real ones):
+    (FLOPs, number of activations kept for backward), with the default dimensions of `ModelConfig`
+    """
+    if family == 'rnn':
+        return _bilstm_cost(seq_len, embed_dim, units)
+    elif family == 'cnn':
+        return 2 * sum(filter_lengths) * embed_dim * units * seq_len, len(filter_lengths) * units * seq_len
+    elif family == 'attention':
+        attend_flops, attend_memory = _cross_attention_cost(seq_len, embed_dim)
+        # feed forward networks over attended and compared representations
+        return attend_flops + 8 * embed_dim * units * seq_len, attend_memory + 2 * units * seq_len
+    elif family == 'rnn_attention':
+        encode_flops, encode_memory = _bilstm_cost(seq_len, embed_dim, units)
+        attend_flops, attend_memory = _cross_attention_cost(seq_len, 2 * units)
+        compose_flops, compose_memory = _bilstm_cost(seq_len, 8 * units, units)
+        return encode_flops + attend_flops + compose_flops, encode_memory + attend_memory + compose_memory
+    else:
+        raise ValueError('Model Family Not Understood: {}'.format(family))
+
+
+def length_policy(len_hist, n_examples, coverage=0.995, batch_size=512, max_len=None):
+    """
+    choose the max_len covering `coverage` of the sentences in `len_hist` (a `utils.analysis.LengthHistogram`),
+    and estimate, for every model family, the training cost per epoch (forward & backward taken as 3x forward FLOPs,
+    2 sentences per example) and the float32 activation memory per batch at this max_len and at the raw max length.
+    :param max_len: fixed max_len to use instead of the one chosen by `coverage`, its coverage & cost are then reported
+    """
+    fixed = max_len is not None
+    if not fixed:
+        max_len = max(len_hist.min_len_for_coverage(coverage), 1)
+    raw_max_len = len_hist.max_len
+    policy = {
+        'max_len': max_len,
+        'raw_max_len': raw_max_len,
+        'fixed': fixed,
+        'target_coverage': None if fixed else coverage,
+        'coverage': float(len_hist.coverage()[max_len]) if max_len <= raw_max_len else 1.0,
+        'cost': dict()
+    }
+    for family in sorted(set(MODEL_FAMILIES.values())):
+        flops, memory = sentence_cost(family, max_len)
+        raw_flops, raw_memory = sentence_cost(family, raw_max_len)
+        policy['cost'][family] = {
+            'epoch_tflops': 3 * 2 * n_examples * flops / 1e12,
+            'epoch_tflops_saved': 3 * 2 * n_examples * (raw_flops - flops) / 1e12,
+            'batch_memory_mb': 2 * batch_size * memory * 4 / 2 ** 20,
+            'batch_memory_mb_saved': 2 * batch_size * (raw_memory - memory) * 4 / 2 ** 20
+        }
+    print('Logging Info - %s max_len: %d (covers %f), raw max_len: %d' %
+          ('fixed' if fixed else 'chosen', max_len, policy['coverage'], raw_max_len))
+    for family, cost in policy['cost'].items():
+        print('Logging Info - %s : %.2f tflops per epoch (%.2f saved), %.1fmb per batch (%.1fmb saved)' %
+              (family, cost['epoch_tflops'], cost['epoch_tflops_saved'], cost['batch_memory_mb'],
+               cost['batch_memory_mb_saved']))
+    return policy
+
+
+def save_manifest(filename, manifest):
+    with open(filename, 'w') as writer:
+        json.dump(manifest, writer, indent=4, ensure_ascii=False)
+    print('Logging Info - Saved:', filename)
+
+
+def load_manifest(filename):
+    """processed data manifest, None if the data was processed before manifests were written"""
+    if not os.path.exists(filename):
+        return None
+    with open(filename, 'r') as reader:
+        manifest = json.load(reader)
+    print('Logging Info - Loaded:', filename)
+    return manifest
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+@author: alexyang
+
+@contact: alex.yang0326@gmail.com
+
+@file: serving.py
+
+@time: 2019/4/25 9:47
+
+@desc: dynamic micro-batching of concurrent prediction requests, latency metrics, and a local http server (tcp or
+       unix socket) & client on top of them. Nothing here depends on the model, see serve.py for that.
+
+"""
+
+import os
+import json
+import time
+import queue
+import socket
+import threading
+import http.client
+from collections import deque
+from socketserver import ThreadingMixIn, UnixStreamServer
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+
+class ServingMetrics(object):
+    """
+    Request latencies (from submission to result), batch sizes and model time of a `DynamicBatcher`. Percentiles are
+    computed over the latest `window` requests, counters and throughput over the whole uptime.
+    """
+    def __init__(self, window=10000):
+        self.lock = threading.Lock()
+        self.start_time = time.perf_counter()
+        self.latencies = deque(maxlen=window)
+        self.batch_sizes = deque(maxlen=window)
+        self.model_times = deque(maxlen=window)
+        self.n_requests = 0
+        self.n_errors = 0
+        self.n_batches = 0
+
+    def record_batch(self, latencies, model_time, error=False):
+        with self.lock:
+            self.latencies.extend(latencies)
+            self.batch_sizes.append(len(latencies))
+            self.model_times.append(model_time)
+            self.n_requests += len(latencies)
+            self.n_batches += 1
+            if error:
+                self.n_errors += len(latencies)
+
+    def report(self):
+        with self.lock:
+            uptime = time.perf_counter() - self.start_time
+            report = {
+                'uptime_s': uptime,
+                'n_requests': self.n_requests,
+                'n_errors': self.n_errors,
+                'n_batches': self.n_batches,
+                'throughput_rps': self.n_requests / uptime if uptime > 0 else 0.0,
+                'avg_batch_size': float(np.mean(self.batch_sizes)) if self.batch_sizes else 0.0
+            }
+            for name, values in [('latency', self.latencies), ('model_time', self.model_times)]:
+                percentiles = np.percentile(np.array(values) * 1000, [50, 95, 99]) if values else [0.0] * 3
+                report.update(('{}_p{}_ms'.format(name, q), float(p)) for q, p in zip([50, 95, 99], percentiles))
+        return report
+
+
+class _Request(object):
+    __slots__ = ['premise', 'hypothesis', 'features', 'arrival', 'done', 'result', 'error']
+
+    def __init__(self, premise, hypothesis, features=None):
+        self.premise = premise
+        self.hypothesis = hypothesis
+        self.features = features
+        self.arrival = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class DynamicBatcher(object):
+    """
+    Collect requests submitted concurrently into micro-batches for one model worker thread: a batch is run as soon as
+    it holds `max_batch_size` pairs, or when its oldest request has waited `max_latency` seconds, so batching never
+    adds more than `max_latency` to a request's latency while a loaded server runs the model on full batches.
+    `predict_func(premises, hypotheses, features)` is only ever called from the worker thread, and returns an array of
+    shape [n_pairs, n_class] (features is a [n_pairs, feature_len] array, or None when requests have no features).
+    """
+    def __init__(self, predict_func, max_batch_size=64, max_latency=0.01, metrics=None):
+        self.predict_func = predict_func
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.metrics = metrics or ServingMetrics()
+        self.queue = queue.Queue()
+        self.running = False
+        self.worker = None
+
+    def start(self):
+        self.running = True
+        self.worker = threading.Thread(target=self._work, name='batcher', daemon=True)
+        self.worker.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.worker is not None:
+            self.worker.join()
+
+    def submit(self, premise, hypothesis, features=None):
+        """enqueue one pair, the returned request is done once its prediction (or error) is set"""
+        if not self.running:
+            raise RuntimeError('Batcher is not running')
+        request = _Request(premise, hypothesis, features)
+        self.queue.put(request)
+        return request
+
+    def predict(self, premise, hypothesis, features=None, timeout=None):
+        """blocking prediction of one pair, batched with the pairs submitted concurrently"""
+        request = self.submit(premise, hypothesis, features)
+        if not request.done.wait(timeout):
+            raise TimeoutError('Prediction not done in {}s'.format(timeout))
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _collect(self):
+        try:
+            first = self.queue.get(timeout=0.1)     # wake up regularly to check whether to stop
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = first.arrival + self.max_latency
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                # requests already waiting are always taken, even past the deadline
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _work(self):
+        while self.running or not self.queue.empty():
+            batch = self._collect()
+            if not batch:
+                continue
+            start = time.perf_counter()
+            error = None
+            try:
+                features = np.array([request.features for request in batch]) \
+                    if batch[0].features is not None else None
+                predictions = self.predict_func([request.premise for request in batch],
+                                                [request.hypothesis for request in batch], features)
+                for request, prediction in zip(batch, predictions):
+                    request.result = prediction
+            except Exception as e:
+                error = e
+                for request in batch:
+                    request.error = e
+            end = time.perf_counter()
+            for request in batch:
+                request.done.set()
+            self.metrics.record_batch([end - request.arrival for request in batch], end - start, error is not None)
+
+
+class NLIRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /predict {"premise": ..., "hypothesis": ...} or {"pairs": [{"premise": ..., "hypothesis": ...}, ...]}
+    --> {"label": ..., "probabilities": {label: prob}} (a list of them for "pairs");
+    GET /metrics --> `ServingMetrics.report()`.
+    Sentences are tokenized text, tokens joined by space, as in the processed data.
+    """
+    protocol_version = 'HTTP/1.1'   # keep-alive, a client reuses its connection
+
+    def log_message(self, format, *args):
+        pass    # no log line per request
+
+    def _send_json(self, status, obj):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self._send_json(200, self.server.batcher.metrics.report())
+        else:
+            self._send_json(404, {'error': 'Path Not Understood: {}'.format(self.path)})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self._send_json(404, {'error': 'Path Not Understood: {}'.format(self.path)})
+            return
+        try:
+            data = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8'))
+            pairs = [(pair['premise'], pair['hypothesis']) for pair in (data['pairs'] if 'pairs' in data else [data])]
+            if not all(isinstance(premise, str) and isinstance(hypothesis, str) for premise, hypothesis in pairs):
+                raise TypeError('premise and hypothesis should be strings')
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {'error': 'Request Not Understood: {}'.format(e)})
+            return
+        try:
+            requests = self.server.submit_pairs(pairs)
+        except Exception as e:
+            # feature extraction may fail on some pairs, e.g. word n-gram overlap of sentences shorter than 4 words
+            self._send_json(500, {'error': 'Feature Extraction Failed: {!r}'.format(e)})
+            return
+        outputs = []
+        for request in requests:
+            request.done.wait()
+            if request.error is not None:
+                self._send_json(500, {'error': str(request.error)})
+                return
+            outputs.append({'label': self.server.labels[int(np.argmax(request.result))],
+                            'probabilities': dict(zip(self.server.labels, request.result.tolist()))})
+        self._send_json(200, {'pairs': outputs} if 'pairs' in data else outputs[0])
+
+
+class _NLIServerMixin(object):
+    daemon_threads = True
+
+    def setup_service(self, batcher, labels, feature_func=None):
+        """
+        :param feature_func: function computing the feature vector of a (premise, hypothesis) pair, run in the request
+                             thread before the pair is submitted, None when the model does not use features
+        """
+        self.batcher = batcher
+        self.labels = labels
+        self.feature_func = feature_func
+
+    def submit_pairs(self, pairs):
+        """submit (premise, hypothesis) pairs to the batcher, features of all pairs are computed before any is"""
+        if self.feature_func is not None:
+            features = [self.feature_func(premise, hypothesis) for premise, hypothesis in pairs]
+        else:
+            features = [None] * len(pairs)
+        return [self.batcher.submit(premise, hypothesis, feature)
+                for (premise, hypothesis), feature in zip(pairs, features)]
+
+
+class ThreadingNLIHTTPServer(_NLIServerMixin, ThreadingMixIn, HTTPServer):
+    pass
+
+
+class ThreadingNLIUnixServer(_NLIServerMixin, ThreadingMixIn, UnixStreamServer):
+    def get_request(self):
+        request, _ = super(ThreadingNLIUnixServer, self).get_request()
+        return request, ('unix', 0)     # http handlers expect a (host, port) client address
+
+
+def make_server(batcher, labels, feature_func=None, host='127.0.0.1', port=8080, unix_socket=None):
+    """http server on `unix_socket` when it is given, on (host, port) otherwise"""
+    if unix_socket is not None:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = ThreadingNLIUnixServer(unix_socket, NLIRequestHandler)
+    else:
+        server = ThreadingNLIHTTPServer((host, port), NLIRequestHandler)
+    server.setup_service(batcher, labels, feature_func)
+    return server
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, unix_socket, timeout=None):
+        super(UnixHTTPConnection, self).__init__('localhost', timeout=timeout)
+        self.unix_socket = unix_socket
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_socket)
+
+
+class NLIClient(object):
+    """client of the server above, one persistent connection, not thread safe (use one client per thread)"""
+    def __init__(self, host='127.0.0.1', port=8080, unix_socket=None, timeout=None):
+        if unix_socket is not None:
+            self.connection = UnixHTTPConnection(unix_socket, timeout=timeout)
+        else:
+            self.connection = http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def _request(self, method, path, obj=None):
+        body = json.dumps(obj).encode('utf-8') if obj is not None else None
+        self.connection.request(method, path, body=body, headers={'Content-Type': 'application/json'})
+        response = self.connection.getresponse()
+        result = json.loads(response.read().decode('utf-8'))
+        if response.status != 200:
+            raise RuntimeError('Server Error {}: {}'.format(response.status, result.get('error')))
+        return result
+
+    def predict(self, premise, hypothesis):
+        return self._request('POST', '/predict', {'premise': premise, 'hypothesis': hypothesis})
+
+    def predict_pairs(self, premises, hypotheses):
+        pairs = [{'premise': p, 'hypothesis': h} for p, h in zip(premises, hypotheses)]
+        return self._request('POST', '/predict', {'pairs': pairs})['pairs']
+
+    def metrics(self):
+        return self._request('GET', '/metrics')
+
+    def close(self):
+        self.connection.close()